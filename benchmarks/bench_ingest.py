@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Compare the cost per cycle of ingesting the vehicle feed by
+# starting "update_db.py" as a new process every poll (the old shell
+# loop) against the long running ingest process in databases/feedDaemon.py.
+#
+# A synthetic vehicle positions feed is served from a local HTTP server
+# and written into a scratch database, so nothing real is touched.
+
+import argparse
+import functools
+import http.server
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from google.transit import gtfs_realtime_pb2
+
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(topDir, 'databases'))
+import feedDaemon
+
+parser = argparse.ArgumentParser(description='Time ingest cycles, script vs long running process.')
+parser.add_argument('--num', type=int, default=10, help='Number of cycles to time for each case.')
+parser.add_argument('--vehicles', type=int, default=1000, help='Number of vehicles in the synthetic feed.')
+args = parser.parse_args()
+
+# Make a synthetic vehicle positions feed.
+feed = gtfs_realtime_pb2.FeedMessage()
+feed.header.gtfs_realtime_version = "2.0"
+feed.header.timestamp = int(time.time())
+for i in range(args.vehicles) :
+    entity = feed.entity.add()
+    entity.id = f"V{i}"
+    entity.vehicle.trip.route_id = f"R{i % 50}"
+    entity.vehicle.timestamp = int(time.time())
+    entity.vehicle.position.latitude  = 39.5 + (i % 100) * 0.01
+    entity.vehicle.position.longitude = -105.5 + (i // 100) * 0.01
+    entity.vehicle.position.bearing = float(i % 360)
+
+workDir = tempfile.mkdtemp(prefix='bench_ingest_')
+
+# Small function to publish a new version of the feed, so that
+# every cycle we time has something new to write.
+publishCount = 0
+def publish() :
+    global publishCount
+    publishCount += 1
+    feed.header.timestamp += 1
+    feedFile = os.path.join(workDir, 'VehiclePosition.pb')
+    with open(feedFile, 'wb') as file :
+        file.write(feed.SerializeToString())
+    mtime = 1000000 + 10 * publishCount
+    os.utime(feedFile, (mtime, mtime))
+    return
+
+publish()
+
+# Serve it out locally.
+class quietHandler(http.server.SimpleHTTPRequestHandler) :
+    def log_message(self, *args) :
+        return
+handler = functools.partial(quietHandler, directory=workDir)
+server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = f"http://127.0.0.1:{server.server_address[1]}/VehiclePosition.pb"
+
+# Make the scratch database.
+feedDir = os.path.join(topDir, 'databases', 'vehicles')
+dbFile = os.path.join(workDir, 'database.db')
+vehicleModule = feedDaemon.loadFeedModule(feedDir)
+vehicleModule.Base.metadata.create_all(vehicleModule.makeEngine(dbFile))
+
+# The old way - a new process per cycle.
+usage0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+t0 = time.perf_counter()
+for i in range(args.num) :
+    publish()
+    subprocess.run([sys.executable, os.path.join(feedDir, 'update_db.py'), '--url', url],
+                   cwd=workDir, check=True, stdout=subprocess.DEVNULL)
+scriptWall = (time.perf_counter() - t0) / args.num
+usage1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+scriptCpu = ((usage1.ru_utime + usage1.ru_stime) - (usage0.ru_utime + usage0.ru_stime)) / args.num
+
+# The long running process - one ingester, many cycles.
+ingester = feedDaemon.feedIngester(feedDir, dbFile)
+publish()
+ingester.runCycle(url) # Warm up
+cpu0 = time.process_time()
+t0 = time.perf_counter()
+for i in range(args.num) :
+    publish()
+    ingester.runCycle(url)
+daemonWall = (time.perf_counter() - t0) / args.num
+daemonCpu = (time.process_time() - cpu0) / args.num
+ingester.close()
+server.shutdown()
+
+print(f"Mean per cycle over {args.num} cycles, {args.vehicles} vehicles, seconds")
+print(f"  new process per cycle : wall {scriptWall:7.3f}  cpu {scriptCpu:7.3f}")
+print(f"  long running process   : wall {daemonWall:7.3f}  cpu {daemonCpu:7.3f}")
+
+sys.exit(0)
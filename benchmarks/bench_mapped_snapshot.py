@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Compare what each API worker pays for its snapshots when it loads them
+# from the database with what it pays when it maps the snapshot file the
+# ingest publishes (databases/snapshotFile.py) - the time to load or map a
+# new generation, and how many bytes of arrays the worker holds itself
+# rather than sharing with the other workers through the page cache.
+# Also times looking up the arrivals at a stop, the trip service's
+# query compared with the trip snapshot file.
+#
+# Scratch vehicle and trip databases are made for this, about as big as
+# a large agency's feeds. Like bench_read_path.py, it needs BFR_TEST_MODE
+# and BFR_AGENCY_NAME set (see run_benchmarks.sh) since it imports the API module.
+
+import argparse
+import mmap
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(topDir, 'webservices'))
+sys.path.insert(0, os.path.join(topDir, 'databases'))
+import bussinAPIs
+import bussinSnapshots
+import feedDaemon
+import snapshotFile
+
+parser = argparse.ArgumentParser(description='Time loading snapshots from the database vs mapping snapshot files.')
+parser.add_argument('--num', type=int, default=20, help='Number of loads to time for each case.')
+parser.add_argument('--vehicles', type=int, default=3000, help='Number of vehicles in the scratch database.')
+parser.add_argument('--arrivals', type=int, default=80000, help='Number of arrivals in the scratch database.')
+args = parser.parse_args()
+
+# Small function that runs a function num times and
+# returns the mean time per call, in milliseconds.
+def timeIt(func, num) :
+    func() # Warm up
+    t0 = time.perf_counter()
+    for i in range(num) :
+        func()
+    return 1000.0 * (time.perf_counter() - t0) / num
+
+# Small function to tell if a numpy array is a view of a mapped file.
+def isMapped(array) :
+    base = array.base
+    while base is not None :
+        if isinstance(base, mmap.mmap) :
+            return True
+        base = getattr(base, 'base', None) if isinstance(base, np.ndarray) else getattr(base, 'obj', None)
+    return False
+
+# Small function to add up the bytes of the arrays a snapshot holds
+# that are its own, rather than views of a mapped file.
+def ownBytes(snapshot) :
+    total = 0
+    for value in vars(snapshot).values() :
+        arrays = [ value ]
+        if isinstance(value, snapshotFile.stringColumn) :
+            arrays = [ value.offsets, value.data ]
+        for array in arrays :
+            if isinstance(array, np.ndarray) and not isMapped(array) :
+                total += array.nbytes
+    return total
+
+random.seed(1)
+workDir = tempfile.mkdtemp(prefix='bench_mapped_')
+
+# The vehicles.
+os.makedirs(os.path.join(workDir, 'vehicles'))
+vehicleModule = feedDaemon.loadFeedModule(os.path.join(topDir, 'databases', 'vehicles'))
+vehicleEngine = vehicleModule.makeEngine(os.path.join(workDir, 'vehicles', 'database.db'))
+vehicles = [ { 'vehicleid' : f"V{i}", 'tripid' : f"T{i}", 'route' : f"R{i % 80}",
+               'schedule_relationship' : 0, 'direction_id' : i % 2, 'current_status' : 2,
+               'timestamp' : 1700000000 + i, 'lat' : 39.5 + (i % 100) * 0.01,
+               'lon' : -105.5 + (i // 100) * 0.01, 'bearing' : float(i % 360) } for i in range(args.vehicles) ]
+vehicleModule.writeDatabase(vehicleEngine, vehicles, 1700000000)
+vehicleFile = snapshotFile.snapshotPath(vehicleEngine)
+
+# The arrivals, at a few thousand stops.
+os.makedirs(os.path.join(workDir, 'trip_updates'))
+tripModule = feedDaemon.loadFeedModule(os.path.join(topDir, 'databases', 'trip_updates'))
+tripEngine = tripModule.makeEngine(os.path.join(workDir, 'trip_updates', 'database.db'))
+now = int(time.time())
+trips = [ { 'route' : f"R{i % 120}", 'schedule_relationship' : 0, 'arrivaltime' : now + random.randint(0, 3600),
+            'stopid' : f"{random.randint(0, 9999)}" } for i in range(args.arrivals) ]
+tripModule.writeDatabase(tripEngine, trips, now)
+tripFile = snapshotFile.snapshotPath(tripEngine)
+TripSession = sessionmaker(autocommit=False, autoflush=False, bind=tripEngine)
+
+def loadArrivalSnapshot() :
+    with tripEngine.connect() as conn :
+        return bussinSnapshots.arrivalSnapshot(1, snapshotFile.readArrivalColumns(conn))
+
+cases = [ ("vehicles", vehicleFile,
+           lambda : bussinSnapshots.loadVehicleSnapshot(vehicleEngine, 1),
+           lambda : bussinSnapshots.mapVehicleSnapshot(snapshotFile.mappedSnapshot(vehicleFile))),
+          ("arrivals", tripFile, loadArrivalSnapshot,
+           lambda : bussinSnapshots.mapArrivalSnapshot(snapshotFile.mappedSnapshot(tripFile))) ]
+
+print(f"Per worker cost of a new generation, {args.vehicles} vehicles, {args.arrivals} arrivals")
+print("  snapshot  file bytes  load from db ms  own bytes  map file ms  own bytes")
+for name, path, fromDatabase, fromFile in cases :
+    print(f"  {name:8s}  {os.path.getsize(path):10d}  {timeIt(fromDatabase, args.num):15.3f}  {ownBytes(fromDatabase()):9d}"
+          f"  {timeIt(fromFile, args.num):11.3f}  {ownBytes(fromFile()):9d}")
+
+# Looking up the arrivals at a stop.
+mappedArrivals = bussinSnapshots.mapArrivalSnapshot(snapshotFile.mappedSnapshot(tripFile))
+
+def queryStop() :
+    db = TripSession()
+    bussinAPIs.tripQuery(db, f"{random.randint(0, 9999)}").all()
+    db.close()
+
+def mappedStop() :
+    mappedArrivals.arrivals(f"{random.randint(0, 9999)}")
+
+print(f"Mean time to get the arrivals at a stop over {100 * args.num} lookups, ms")
+print(f"  trip service query  {timeIt(queryStop, 100 * args.num):8.4f}")
+print(f"  trip snapshot file  {timeIt(mappedStop, 100 * args.num):8.4f}")
+
+vehicleEngine.dispose()
+tripEngine.dispose()
+shutil.rmtree(workDir)
+sys.exit(0)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Time the read path of the API end points.
+#
+# This is run from the benchmarks directory so that the relative
+# database paths the API uses (../test_databases) work out, and it
+# needs BFR_TEST_MODE and BFR_AGENCY_NAME set (see run_benchmarks.sh).
+#
+# For each end point we time :
+#
+# * The old way of doing things, where every request made a new
+#   declarative_base(), a new table class, a new engine and a new
+#   session factory, and re-read BFR_TEST_MODE, before querying.
+# * The query against the engine and session factory that the
+#   API now sets up once, when the module is loaded.
+# * A full request through the FastAPI test client.
+# * Serializing 1000 vehicles through the response model (validating
+#   every row, as FastAPI does if the end point hands it the rows)
+#   compared with the pydantic JSON encoder alone, as the end points now do.
+
+import argparse
+import os
+import sys
+import time
+
+from typing import List
+
+from fastapi import Response
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, Column, String, Float, Integer
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.dialects.mysql import BIGINT
+
+# So we can import the API module.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'webservices'))
+import bussinAPIs
+
+parser = argparse.ArgumentParser(description='Time the API read path.')
+parser.add_argument('--num', type=int, default=500, help='Number of requests to time for each case.')
+args = parser.parse_args()
+
+# Small function that runs a function num times and
+# returns the mean time per call, in milliseconds.
+def timeIt(func, num) :
+    func() # Warm up
+    t0 = time.perf_counter()
+    for i in range(num) :
+        func()
+    return 1000.0 * (time.perf_counter() - t0) / num
+
+# The old per-request setup for the vehicle end point.
+def legacyVehicleQuery() :
+    Base = declarative_base()
+
+    class vehiclesTable(Base):
+        __tablename__='vehicles'
+        id             = Column(Integer, nullable=False, primary_key=True)
+        route          = Column(String,  nullable=False)
+        schedule_relationship = Column(Integer, nullable=False)
+        direction_id   = Column(Integer, nullable=False)
+        current_status = Column(Integer, nullable=False)
+        timestamp      = Column(BIGINT(unsigned=True), nullable=False)
+        lat            = Column(Float,   nullable=False)
+        lon            = Column(Float,   nullable=False)
+        bearing        = Column(Float,   nullable=False)
+
+    db_dir='databases'
+    test_env = os.getenv('BFR_TEST_MODE', 'OFF')
+    if test_env.lower() == 'on' or test_env.lower() == 'true' :
+        db_dir='test_databases'
+
+    engine = create_engine("sqlite:///../" + db_dir + "/vehicles/database.db")
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+    query = db.query(vehiclesTable).with_entities(vehiclesTable.route, vehiclesTable.timestamp,
+                                vehiclesTable.current_status, vehiclesTable.lat, vehiclesTable.lon, vehiclesTable.bearing)
+    query = query.filter(vehiclesTable.lat >= -5.0).filter(vehiclesTable.lat <= 5.0)
+    query.limit(1000).all()
+    db.close()
+    engine.dispose()
+    return
+
+# The same query using what the API sets up at startup.
+def sharedVehicleQuery() :
+    vt = bussinAPIs.vehiclesTable
+    db = bussinAPIs.vehicleSession()
+    query = db.query(vt).with_entities(vt.route, vt.timestamp,
+                                vt.current_status, vt.lat, vt.lon, vt.bearing)
+    query = query.filter(vt.lat >= -5.0).filter(vt.lat <= 5.0)
+    query.limit(1000).all()
+    db.close()
+    return
+
+client=TestClient(bussinAPIs.bussinApp)
+
+print(f"Mean time per request over {args.num} requests, ms")
+print(f"  vehicle query, per-request setup  : {timeIt(legacyVehicleQuery, args.num):8.3f}")
+print(f"  vehicle query, shared setup       : {timeIt(sharedVehicleQuery, args.num):8.3f}")
+
+urls = [ "/busStopService?minLat=-5.0&maxLat=5.0&minLon=-5.0&maxLon=5.0",
+         "/vehicleService?minLat=-5.0&maxLat=5.0&minLon=-5.0&maxLon=5.0",
+         "/tripService?stopID=STP01" ]
+for url in urls :
+    ms = timeIt(lambda url=url : client.get(url), args.num)
+    print(f"  {url.split('?')[0]:33s} : {ms:8.3f}")
+
+vehicles = [ { "route" : f"R{i % 50}", "timestamp" : 1700000000 + i, "current_status" : 2,
+               "lat" : 39.5 + (i % 100) * 0.01, "lon" : -105.5 + (i // 100) * 0.01,
+               "bearing" : float(i % 360) } for i in range(1000) ]
+adapter = TypeAdapter(List[bussinAPIs.vehicleServiceResponseClass])
+print(f"  1000 vehicles, response model     : {timeIt(lambda : adapter.dump_json(adapter.validate_python(vehicles)), args.num):8.3f}")
+print(f"  1000 vehicles, jsonRows           : {timeIt(lambda : bussinAPIs.jsonRows(vehicles, Response()), args.num):8.3f}")
+
+sys.exit(0)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Time bus stop bounding box queries with and without the
+# spatial index (the stops_rtree table that databases/stops/update_db.py
+# builds), against a scratch database with as many stops as a large
+# agency (RTD has around 10,000) and a viewport about the size of a
+# zoomed in map. Like bench_read_path.py, it needs BFR_TEST_MODE and
+# BFR_AGENCY_NAME set (see run_benchmarks.sh) since it imports the API module.
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'webservices'))
+import bussinAPIs
+
+parser = argparse.ArgumentParser(description='Time bus stop bounding box queries, with and without the spatial index.')
+parser.add_argument('--num', type=int, default=500, help='Number of queries to time for each case.')
+parser.add_argument('--stops', type=int, default=10000, help='Number of stops in the scratch database.')
+args = parser.parse_args()
+
+# Small function that runs a function num times and
+# returns the mean time per call, in milliseconds.
+def timeIt(func, num) :
+    func() # Warm up
+    t0 = time.perf_counter()
+    for i in range(num) :
+        func()
+    return 1000.0 * (time.perf_counter() - t0) / num
+
+# Make the scratch database, stops on a 100 by N grid a bit over 0.01 degrees apart.
+workDir = tempfile.mkdtemp(prefix='bench_stops_')
+dbFile = os.path.join(workDir, 'database.db')
+engine = create_engine("sqlite:///" + dbFile)
+bussinAPIs.Base.metadata.create_all(engine, tables=[ bussinAPIs.stopsTable.__table__ ])
+conn = sqlite3.connect(dbFile)
+conn.executemany("INSERT INTO stops (stopid, stopname, stopdesc, lat, lon) VALUES (?, ?, ?, ?, ?)",
+                 [ (f"{i}", f"Stop {i}", "Description", 39.5 + (i % 100) * 0.011, -105.5 + (i // 100) * 0.011)
+                   for i in range(args.stops) ])
+conn.execute("CREATE VIRTUAL TABLE stops_rtree USING rtree(id, minLat, maxLat, minLon, maxLon)")
+conn.execute("INSERT INTO stops_rtree (id, minLat, maxLat, minLon, maxLon) SELECT rowid, lat, lat, lon, lon FROM stops")
+conn.commit()
+conn.close()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# A viewport with a few dozen stops in it.
+minLat, minLon, maxLat, maxLon = 39.90, -105.10, 39.97, -105.03
+
+def scanQuery() :
+    st = bussinAPIs.stopsTable
+    db = SessionLocal()
+    query = db.query(st).filter(st.lat >= minLat, st.lon >= minLon, st.lat <= maxLat, st.lon <= maxLon)
+    rows = query.limit(1000).all()
+    db.close()
+    return rows
+
+def indexQuery() :
+    st = bussinAPIs.stopsTable
+    rt = bussinAPIs.stopsRtreeTable
+    db = SessionLocal()
+    query = db.query(st).join(rt, rt.id == bussinAPIs.literal_column("stops.rowid"))
+    query = query.filter(rt.maxLat >= minLat, rt.maxLon >= minLon, rt.minLat <= maxLat, rt.minLon <= maxLon)
+    query = query.filter(st.lat >= minLat, st.lon >= minLon, st.lat <= maxLat, st.lon <= maxLon)
+    rows = query.limit(1000).all()
+    db.close()
+    return rows
+
+print(f"Mean time per query over {args.num} queries, {args.stops} stops, {len(indexQuery())} in the viewport, ms")
+print(f"  scan of the stops table : {timeIt(scanQuery, args.num):8.3f}")
+print(f"  spatial index           : {timeIt(indexQuery, args.num):8.3f}")
+
+engine.dispose()
+shutil.rmtree(workDir)
+sys.exit(0)
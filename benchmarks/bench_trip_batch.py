@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# Time getting the arrivals at several stops, one trip service query per
+# stop (what the web page would have to do for a station with several
+# platforms) compared with the one query the multi stop trip service
+# runs for all of them.
+#
+# The queries are the ones the API module builds, run against a scratch
+# database made from a synthetic trip updates feed, as in bench_trip_index.py.
+# Like bench_read_path.py, it needs BFR_TEST_MODE and BFR_AGENCY_NAME
+# set (see run_benchmarks.sh) since it imports the API module.
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from google.transit import gtfs_realtime_pb2
+from sqlalchemy.orm import sessionmaker
+
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(topDir, 'webservices'))
+sys.path.insert(0, os.path.join(topDir, 'databases'))
+import bussinAPIs
+import feedDaemon
+
+parser = argparse.ArgumentParser(description='Time arrivals at several stops, one query per stop vs one batched query.')
+parser.add_argument('--num', type=int, default=200, help='Number of lookups to time for each case.')
+parser.add_argument('--trips', type=int, default=2000, help='Number of trips in the synthetic feed.')
+parser.add_argument('--stops', type=int, default=10000, help='Number of stops the trips visit.')
+args = parser.parse_args()
+
+# Small function that runs a function num times and
+# returns the mean time per call, in milliseconds.
+def timeIt(func, num) :
+    func() # Warm up
+    t0 = time.perf_counter()
+    for i in range(num) :
+        func()
+    return 1000.0 * (time.perf_counter() - t0) / num
+
+# Make a synthetic trip updates feed, each trip visiting 40 stops a couple of minutes apart.
+random.seed(1)
+now = int(time.time())
+feed = gtfs_realtime_pb2.FeedMessage()
+feed.header.gtfs_realtime_version = "2.0"
+feed.header.timestamp = now
+for i in range(args.trips) :
+    entity = feed.entity.add()
+    entity.id = f"T{i}"
+    entity.trip_update.trip.route_id = f"R{i % 120}"
+    start = now + random.randint(0, 60 * 60)
+    firstStop = random.randint(0, args.stops - 1)
+    for j in range(40) :
+        stu = entity.trip_update.stop_time_update.add()
+        stu.stop_id = f"{(firstStop + 25 * j) % args.stops}"
+        stu.arrival.time = start + 120 * j
+
+tripModule = feedDaemon.loadFeedModule(os.path.join(topDir, 'databases', 'trip_updates'))
+workDir = tempfile.mkdtemp(prefix='bench_trip_batch_')
+engine = tripModule.makeEngine(os.path.join(workDir, 'database.db'))
+tripModule.writeDatabase(engine, tripModule.feedRows(feed, now=now))
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Small function to pick some stops to ask about.
+def someStops(numStops) :
+    return [ f"{random.randint(0, args.stops - 1)}" for i in range(numStops) ]
+
+def singleQueries(numStops) :
+    db = SessionLocal()
+    for stopID in someStops(numStops) :
+        bussinAPIs.tripQuery(db, stopID).all()
+    db.close()
+
+def batchQuery(numStops) :
+    db = SessionLocal()
+    bussinAPIs.stopsTripQuery(db, someStops(numStops)).all()
+    db.close()
+
+print(f"Mean time to get the arrivals at several stops over {args.num} lookups, {args.trips} trips, ms")
+print("  stops  one query per stop  one batched query")
+for numStops in [ 1, 2, 5, 10, 25, 100 ] :
+    print(f"  {numStops:5d}  {timeIt(lambda numStops=numStops : singleQueries(numStops), args.num):18.3f}"
+          f"  {timeIt(lambda numStops=numStops : batchQuery(numStops), args.num):17.3f}")
+
+engine.dispose()
+shutil.rmtree(workDir)
+sys.exit(0)
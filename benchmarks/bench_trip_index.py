@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Time the trip service's stop lookup against a feed sized trip table,
+# without any index (as it used to be), and with the covering index on
+# (stopid, arrivaltime, route) that databases/trip_updates now keeps.
+# The table sizes before and after dropping arrivals that are zero or
+# in the past at ingest are printed too.
+#
+# A synthetic trip updates feed is turned into rows with the
+# trip_updates feedRows() function and written into scratch databases,
+# so nothing real is touched.
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from google.transit import gtfs_realtime_pb2
+
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(topDir, 'databases'))
+import feedDaemon
+
+parser = argparse.ArgumentParser(description='Time trip service stop lookups, with and without the index.')
+parser.add_argument('--num', type=int, default=500, help='Number of lookups to time for each case.')
+parser.add_argument('--trips', type=int, default=2000, help='Number of trips in the synthetic feed.')
+parser.add_argument('--stops', type=int, default=10000, help='Number of stops the trips visit.')
+args = parser.parse_args()
+
+# Small function that runs a function num times and
+# returns the mean time per call, in milliseconds.
+def timeIt(func, num) :
+    func() # Warm up
+    t0 = time.perf_counter()
+    for i in range(num) :
+        func()
+    return 1000.0 * (time.perf_counter() - t0) / num
+
+# Make a synthetic trip updates feed. Each trip visits 40 stops a
+# couple of minutes apart, and is somewhere along its way, so some
+# of its arrivals have already gone by. A few have no arrival time.
+random.seed(1)
+now = int(time.time())
+feed = gtfs_realtime_pb2.FeedMessage()
+feed.header.gtfs_realtime_version = "2.0"
+feed.header.timestamp = now
+for i in range(args.trips) :
+    entity = feed.entity.add()
+    entity.id = f"T{i}"
+    entity.trip_update.trip.route_id = f"R{i % 120}"
+    start = now - random.randint(0, 60 * 60)
+    firstStop = random.randint(0, args.stops - 1)
+    for j in range(40) :
+        stu = entity.trip_update.stop_time_update.add()
+        stu.stop_id = f"{(firstStop + 25 * j) % args.stops}"
+        if random.random() > 0.02 :
+            stu.arrival.time = start + 120 * j
+
+tripModule = feedDaemon.loadFeedModule(os.path.join(topDir, 'databases', 'trip_updates'))
+workDir = tempfile.mkdtemp(prefix='bench_trips_')
+
+# Small function to write rows to a new scratch
+# database, with or without the trip service index.
+def makeDatabase(name, rows, indexed) :
+    dbFile = os.path.join(workDir, name + '.db')
+    engine = tripModule.makeEngine(dbFile)
+    tripModule.Base.metadata.create_all(engine)
+    tripModule.writeDatabase(engine, rows)
+    engine.dispose()
+    conn = sqlite3.connect(dbFile)
+    if not indexed :
+        conn.execute("DROP INDEX stop_arrival_index")
+    conn.execute("ANALYZE")
+    return conn
+
+# Setting now to zero keeps the arrivals that have gone by (the zero ones are still dropped).
+allRows = tripModule.feedRows(feed, now=0)
+prunedRows = tripModule.feedRows(feed, now=now)
+
+databases = { 'past rows, no index'   : makeDatabase('unindexed', allRows, False),
+              'past rows, index'     : makeDatabase('indexed', allRows, True),
+              'pruned rows, index'   : makeDatabase('pruned', prunedRows, True) }
+
+# The trip service query, for a random stop each time.
+def lookup(conn) :
+    stopid = f"{random.randint(0, args.stops - 1)}"
+    return conn.execute("SELECT route, arrivaltime FROM intrepid_trips WHERE stopid = ? AND arrivaltime >= ? "
+                        "ORDER BY arrivaltime", (stopid, now)).fetchall()
+
+print(f"Mean time per stop lookup over {args.num} lookups, {args.trips} trips, {args.stops} stops, ms")
+for name, conn in databases.items() :
+    numRows = conn.execute("SELECT COUNT(*) FROM intrepid_trips").fetchone()[0]
+    print(f"  {name:20s} ({numRows:6d} rows) : {timeIt(lambda conn=conn : lookup(conn), args.num):8.3f}")
+    conn.close()
+
+shutil.rmtree(workDir)
+sys.exit(0)
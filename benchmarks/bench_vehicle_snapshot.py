@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Time filtering the vehicles by bounding box and route, comparing
+# the database query against the in memory snapshot the vehicle
+# end point now serves from (webservices/bussinSnapshots.py).
+# It also compares the size (plain and gzipped) and the time to make
+# the usual JSON list of vehicles against the compact columnar format.
+#
+# A scratch vehicle database with a few thousand synthetic vehicles
+# is made for this, so it is about as big as a large agency's feed.
+# Like bench_read_path.py, it needs BFR_TEST_MODE and BFR_AGENCY_NAME
+# set (see run_benchmarks.sh) since it imports the API module.
+
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pydantic_core import to_json
+from sqlalchemy.orm import sessionmaker
+
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(topDir, 'webservices'))
+sys.path.insert(0, os.path.join(topDir, 'databases'))
+import bussinAPIs
+import bussinSnapshots
+import feedDaemon
+
+parser = argparse.ArgumentParser(description='Time vehicle filtering, database query vs in memory snapshot.')
+parser.add_argument('--num', type=int, default=500, help='Number of filters to time for each case.')
+parser.add_argument('--vehicles', type=int, default=3000, help='Number of vehicles in the scratch database.')
+args = parser.parse_args()
+
+# Small function that runs a function num times and
+# returns the mean time per call, in milliseconds.
+def timeIt(func, num) :
+    func() # Warm up
+    t0 = time.perf_counter()
+    for i in range(num) :
+        func()
+    return 1000.0 * (time.perf_counter() - t0) / num
+
+# Make the scratch database.
+workDir = tempfile.mkdtemp(prefix='bench_snapshot_')
+vehicleModule = feedDaemon.loadFeedModule(os.path.join(topDir, 'databases', 'vehicles'))
+engine = vehicleModule.makeEngine(os.path.join(workDir, 'database.db'))
+vehicles = [ { 'vehicleid' : f"V{i}", 'tripid' : f"T{i}", 'route' : f"R{i % 80}",
+               'schedule_relationship' : 0, 'direction_id' : i % 2, 'current_status' : 2,
+               'timestamp' : 1700000000 + i, 'lat' : 39.5 + (i % 100) * 0.01,
+               'lon' : -105.5 + (i // 100) * 0.01, 'bearing' : float(i % 360) } for i in range(args.vehicles) ]
+vehicleModule.writeDatabase(engine, vehicles, 1700000000)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+cache = bussinSnapshots.snapshotCache(engine, bussinSnapshots.loadVehicleSnapshot, 1.0)
+t0 = time.perf_counter()
+snapshot = cache.refresh()
+loadMs = 1000.0 * (time.perf_counter() - t0)
+
+cases = { 'bounding box'           : (39.8, -105.3, 40.0, -105.1, None),
+          'bounding box and routes': (39.8, -105.3, 40.0, -105.1, [ 'R1', 'R2', 'R3' ]),
+          'routes only'            : (None, None, None, None, [ 'R1', 'R2', 'R3' ]) }
+
+print(f"Mean time per filter over {args.num} filters, {args.vehicles} vehicles, ms")
+print(f"  snapshot load (once per generation) : {loadMs:8.3f}")
+for name, (minLat, minLon, maxLat, maxLon, routes) in cases.items() :
+
+    def sqlFilter(minLat=minLat, minLon=minLon, maxLat=maxLat, maxLon=maxLon, routes=routes) :
+        db = SessionLocal()
+        bussinAPIs.vehicleQuery(db, minLat, minLon, maxLat, maxLon, routes).all()
+        db.close()
+
+    def snapshotSelect(minLat=minLat, minLon=minLon, maxLat=maxLat, maxLon=maxLon, routes=routes) :
+        snapshot.select(minLat, minLon, maxLat, maxLon, routes, limit=1000)
+
+    def snapshotFilter(minLat=minLat, minLon=minLon, maxLat=maxLat, maxLon=maxLon, routes=routes) :
+        snapshot.rows(snapshot.select(minLat, minLon, maxLat, maxLon, routes, limit=1000))
+
+    print(f"  {name}")
+    print(f"    database query                    : {timeIt(sqlFilter, args.num):8.3f}")
+    print(f"    snapshot mask only                : {timeIt(snapshotSelect, args.num):8.3f}")
+    print(f"    snapshot mask and rows            : {timeIt(snapshotFilter, args.num):8.3f}")
+
+# All the vehicles, as the usual JSON and in columns.
+indices = snapshot.select(limit=args.vehicles)
+payloads = { 'JSON list'   : lambda : to_json(snapshot.rows(indices)),
+             'JSON columns': lambda : to_json(snapshot.columns(indices)) }
+print(f"Payload for all {len(indices)} vehicles : bytes, gzipped bytes, ms to make")
+for name, make in payloads.items() :
+    payload = make()
+    print(f"  {name:<12} : {len(payload):8d} {len(gzip.compress(payload)):8d} {timeIt(make, args.num):8.3f}")
+
+engine.dispose()
+shutil.rmtree(workDir)
+sys.exit(0)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Load test for the nginx cache in front of the API (see load_nginx_cache.sh,
+# which sets up nginx and uvicorn and runs this). A number of simulated
+# browsers, each looking at a map somewhere near the same place (as people
+# who all start at the agency's default map position are), ask for the
+# vehicles, stops, routes and the arrivals at a stop every so often, the
+# way the web pages do. Prints how many requests nginx answered itself
+# (from the X-Cache-Status header that bussinfr_cache.conf adds) and how
+# many got through to python, and the response times.
+#
+# The map areas are snapped outwards to a grid as webpages/js/bbox.js does,
+# unless --gridDeg is zero. The test databases are old, so the API lets
+# nginx keep what it sends for a second at most (the data are overdue,
+# see sharedCacheSec in bussinAPIs.py) - with live data it's longer.
+
+import argparse
+import asyncio
+import math
+import random
+import time
+
+import httpx
+
+parser = argparse.ArgumentParser(description='Load test the API, with or without the nginx cache in front of it.')
+parser.add_argument('--url', type=str, default='http://127.0.0.1:8080/test', help='Where the API is.')
+parser.add_argument('--clients', type=int, default=50, help='Number of simulated browsers.')
+parser.add_argument('--duration', type=float, default=20.0, help='How long to run for, seconds.')
+parser.add_argument('--period', type=float, default=2.0, help='How often each browser asks, seconds.')
+parser.add_argument('--gridDeg', type=float, default=0.01, help='Grid the map areas are snapped to, degrees. Zero to not snap them.')
+parser.add_argument('--lat', type=float, default=0.0, help='Latitude the maps are near.')
+parser.add_argument('--lon', type=float, default=0.0, help='Longitude the maps are near.')
+parser.add_argument('--spanDeg', type=float, default=10.0, help='Size of each map, degrees.')
+parser.add_argument('--jitterDeg', type=float, default=0.004, help='How far from each other the maps are, degrees.')
+args = parser.parse_args()
+
+# What nginx said it did, by X-Cache-Status. These ones didn't go to python
+# (or, for UPDATING, went once in the background for everyone).
+answeredByCache = ('HIT', 'UPDATING', 'STALE', 'REVALIDATED')
+
+# Small function to snap a map area outwards to the grid, to
+# strings the way webpages/js/bbox.js writes them.
+def snapArea(minLat, minLon, maxLat, maxLon) :
+    if args.gridDeg <= 0.0 :
+        return [ str(x) for x in (minLat, minLon, maxLat, maxLon) ]
+    places = min(max(math.ceil(-math.log10(args.gridDeg)), 0), 8)
+
+    def down(x) :
+        return f"{math.floor(x / args.gridDeg) * args.gridDeg:.{places}f}"
+
+    def up(x) :
+        return f"{math.ceil(x / args.gridDeg) * args.gridDeg:.{places}f}"
+
+    return [ down(minLat), down(minLon), up(maxLat), up(maxLon) ]
+
+# One browser. Asks for everything every period seconds until the end
+# time, and puts the X-Cache-Status and time taken of each request in results.
+async def browser(client, endTime, results) :
+    lat = args.lat + random.uniform(-args.jitterDeg, args.jitterDeg)
+    lon = args.lon + random.uniform(-args.jitterDeg, args.jitterDeg)
+    minLat, minLon, maxLat, maxLon = snapArea(lat - args.spanDeg / 2, lon - args.spanDeg / 2,
+                                              lat + args.spanDeg / 2, lon + args.spanDeg / 2)
+    area = f"minLat={minLat}&minLon={minLon}&maxLat={maxLat}&maxLon={maxLon}"
+    urls = [ f"/vehicleService?{area}", f"/busStopService?{area}&zoom=14", "/routeService",
+             f"/tripService?stopID=STP{random.randint(1, 3):02d}" ]
+
+    # Don't all start at once.
+    await asyncio.sleep(random.uniform(0.0, args.period))
+    while time.monotonic() < endTime :
+        for url in urls :
+            t0 = time.perf_counter()
+            response = await client.get(url)
+            results.append((response.status_code, response.headers.get('x-cache-status', 'none'),
+                            time.perf_counter() - t0))
+        await asyncio.sleep(args.period)
+    return
+
+async def run() :
+    results = []
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client :
+        endTime = time.monotonic() + args.duration
+        await asyncio.gather(*[ browser(client, endTime, results) for i in range(args.clients) ])
+    return results
+
+random.seed(1)
+results = asyncio.run(run())
+
+statuses = {}
+for status, cacheStatus, seconds in results :
+    statuses[cacheStatus] = statuses.get(cacheStatus, 0) + 1
+numCached = sum(count for cacheStatus, count in statuses.items() if cacheStatus in answeredByCache)
+times = sorted(seconds for status, cacheStatus, seconds in results)
+errors = sum(1 for status, cacheStatus, seconds in results if status != 200)
+
+print(f"{len(results)} requests from {args.clients} browsers over {args.duration} seconds, grid {args.gridDeg} degrees, {errors} errors")
+print("  " + "  ".join(f"{cacheStatus} {count}" for cacheStatus, count in sorted(statuses.items())))
+print(f"  answered by the cache {numCached} ({100.0 * numCached / max(len(results), 1):.1f}%), "
+      f"went to python {len(results) - numCached}")
+print(f"  mean {1000.0 * sum(times) / max(len(times), 1):.2f} ms, "
+      f"95th percentile {1000.0 * times[int(0.95 * (len(times) - 1))]:.2f} ms")
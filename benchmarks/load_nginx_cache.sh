@@ -0,0 +1,50 @@
+#!/bin/bash
+
+# Load test of the nginx cache in front of the API. Starts uvicorn serving
+# the test databases on port 8000 and nginx in front of it on port 8080
+# (see nginx_load_test.conf), then runs load_nginx_cache.py three ways :
+# through nginx with the map areas snapped to the grid as the web pages do,
+# through nginx with the areas as they are, and straight to uvicorn.
+# Needs nginx and the test databases (see test_databases/). Any
+# arguments are passed on to load_nginx_cache.py.
+
+# Turn on test mode so test databases are used
+export BFR_TEST_MODE=TRUE
+
+# Spoof an agency name
+export BFR_AGENCY_NAME="Test"
+
+benchDir=`dirname $0`
+benchDir=`cd "$benchDir"; pwd`
+workDir=`mktemp -d`
+
+cd "$benchDir"/../webservices
+uv run uvicorn bussinAPIs:bussinApp --host 127.0.0.1 --port 8000 --workers 2 > "$workDir"/uvicorn.log 2>&1 &
+uvicornPID=$!
+
+nginx -p "$workDir" -e "$workDir"/error.log -c "$benchDir"/nginx_load_test.conf
+if [ "$?" -ne 0 ]
+then
+ echo Could not start nginx
+ kill $uvicornPID
+ exit -1
+fi
+
+sleep 5
+cd "$benchDir"
+
+echo Through nginx, areas snapped to the grid
+uv run ./load_nginx_cache.py --url http://127.0.0.1:8080/test "$@"
+echo
+echo Through nginx, areas as they are
+uv run ./load_nginx_cache.py --url http://127.0.0.1:8080/test --gridDeg 0 "$@"
+echo
+echo Straight to uvicorn
+uv run ./load_nginx_cache.py --url http://127.0.0.1:8000 "$@"
+
+nginx -p "$workDir" -e "$workDir"/error.log -c "$benchDir"/nginx_load_test.conf -s quit
+kill $uvicornPID
+sleep 1
+rm -rf "$workDir"
+
+exit 0
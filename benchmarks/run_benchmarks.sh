@@ -0,0 +1,16 @@
+#!/bin/bash
+
+# Turn on test mode so test databases are used
+export BFR_TEST_MODE=TRUE
+
+# Spoof an agency name
+export BFR_AGENCY_NAME="Test"
+
+for bench in bench_*.py
+do
+ echo Running $bench
+ uv run ./"$bench"
+ echo
+done
+
+exit 0
@@ -0,0 +1,2 @@
+# Empty init file just so pytest treats
+# this directory as a package.
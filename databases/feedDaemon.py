@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+
+# Long running ingest process for one of the realtime feeds
+# (vehicle positions or trip updates).
+#
+# Previously fetchVehicleUpdates.sh and fetchTripUpdates.sh ran
+# "uv run update_db.py" on every poll, so every 15 seconds we paid for
+# starting a new Python interpreter, importing protobuf, requests and
+# SQLAlchemy and creating a database engine, only to exit again.
+# This process stays up instead. It keeps its HTTP session (so the
+# connection to the agency can be kept alive) and its database engine
+# between polls, and uses the fetch/parse/write functions in the
+# feed's update_db.py to do the work.
+#
+# It keeps the same controls as the shell loop :
+#  * If stop.marker exists in the feed directory, it exits.
+#  * If hold.marker exists in the feed directory, it sleeps until it is removed.
+#  * The environment file is re-read every cycle, so changes to the URL
+#    or the poll interval (BFR_VEHICLE_POLL or BFR_TRIP_POLL) take effect
+#    without a restart.
+#
+# Rather than every poll interval, the feed is fetched when the agency
+# next publishes it, which we learn as we go (see pollSchedule.py), and
+# failures back off. Setting BFR_ADAPTIVE_POLL to FALSE in the
+# environment file polls every poll interval instead.
+#
+# If the feed has not changed since the last time we wrote it
+# the database is left alone (see feedIngester below).
+#
+# Only one process can write a feed's database at a time, this or
+# feedPoller.py - whichever starts first holds writer.lock in the feed
+# directory until it exits, and the other one doesn't start.
+#
+# Every cycle it writes updated.time in the feed directory with the
+# wall clock time taken to fetch, parse and write the data, the CPU
+# time used (so the cost per cycle can be compared with the old script
+# based loop) and counts of the cycles applied and skipped so far.
+# Run it from the feed's fetch script, eg :
+#   ./feedDaemon.py --feed vehicles --envFile $HOME/bussinFR/environment.vars
+
+import argparse
+import datetime
+import fcntl
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+
+import requests
+
+# Run as a script, or imported as part of the package by the tests.
+try:
+    from . import pollSchedule
+except ImportError:
+    import pollSchedule
+
+# The feeds we know how to ingest. The key is the directory under
+# databases/ and the values are the names of the environment variables
+# that hold the feed URL and the poll interval.
+feeds = {
+    'vehicles'     : { 'urlVar':'BFR_VEHICLES_URL', 'pollVar':'BFR_VEHICLE_POLL' },
+    'trip_updates' : { 'urlVar':'BFR_TRIPS_URL',    'pollVar':'BFR_TRIP_POLL'    }
+}
+
+# Small function to read the environment variables out of an
+# environment.vars file, which is a bash script made up of lines like :
+# export BFR_VEHICLE_POLL="15"
+# Anything already in the environment (like $HOME) is expanded.
+def readEnvFile(envFile) :
+    envVars = {}
+    exportLine = re.compile(r'^\s*export\s+(\w+)=(.*)$')
+    with open(envFile, 'r') as file :
+        for line in file :
+            match = exportLine.match(line)
+            if match is None :
+                continue
+            value = match.group(2).strip().strip('"').strip("'")
+            envVars[match.group(1)] = os.path.expandvars(value)
+    return envVars
+
+# Small function to get the settings for a feed (one of feeds) out of an
+# agency's environment file. Returns the environment variables, the feed
+# URL and the poll interval. Raises ValueError if the file doesn't
+# have them (or OSError if it can't be read).
+def feedSettings(envFile, feed) :
+    envVars = readEnvFile(envFile)
+    for var in [ feeds[feed]['urlVar'], feeds[feed]['pollVar'] ] :
+        if var not in envVars :
+            raise ValueError(f"{envFile} does not set {var}")
+    try :
+        poll = float(envVars[feeds[feed]['pollVar']])
+    except ValueError :
+        raise ValueError(f"{feeds[feed]['pollVar']} in {envFile} is not a number of seconds") from None
+    return envVars, envVars[feeds[feed]['urlVar']], poll
+
+# Small function that loads the update_db.py module from a feed
+# directory. The module is given a name that includes the feed,
+# since every feed directory has a module called update_db.py.
+def loadFeedModule(feedDir) :
+    feedName = os.path.basename(os.path.normpath(feedDir))
+    spec = importlib.util.spec_from_file_location(feedName + "_update_db",
+                                                  os.path.join(feedDir, "update_db.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class feedIngester :
+    """
+    Holds what we keep between polls of a feed - the feed's update_db
+    module, the HTTP session, the database engine and what we know about
+    the last version of the feed we wrote - and runs one
+    fetch/parse/write cycle at a time.
+
+    The agency often republishes the feed less often than we poll, so
+    a cycle skips the parsing and database writes if the feed has not
+    changed since we last wrote it. We can tell that in three ways,
+    cheapest first :
+     * The server answers our conditional GET (If-None-Match and/or
+       If-Modified-Since) with 304 Not Modified.
+     * The content hashes to the same thing as last time.
+     * The FeedMessage header timestamp is the same as last time.
+    Counts of cycles applied and skipped (and why) are kept in counters.
+    """
+
+    def __init__(self, feedDir, db_file="database.db") :
+        self.feedModule  = loadFeedModule(feedDir)
+        self.httpSession = None
+        self.engine      = self.feedModule.makeEngine(db_file)
+        self.cycle       = 0
+
+        # Anything the agency's environment file says about how to write
+        # the feed (see configure), passed on to the feed's writeDatabase.
+        self.writeOptions = {}
+
+        # What we know about the last version of the feed that we wrote.
+        self.etag          = None
+        self.lastModified  = None
+        self.contentDigest = None
+        self.feedTimestamp = None
+
+        self.counters = { "applied"          : 0,
+                          "skipped"          : 0,
+                          "notModified"      : 0,
+                          "sameContent"      : 0,
+                          "sameTimestamp"    : 0 }
+
+    # Small function to take the settings for writing the feed from the
+    # agency's environment variables (as from readEnvFile), if the feed's
+    # update_db module has any (a writeOptions function). Called every
+    # cycle, since the environment file is re-read every cycle.
+    def configure(self, envVars) :
+        if hasattr(self.feedModule, 'writeOptions') :
+            self.writeOptions = self.feedModule.writeOptions(envVars)
+        return
+
+    # Small function to get the headers for a conditional GET of the
+    # feed, from what we know about the last version of it we wrote.
+    def conditionalHeaders(self) :
+        headers = {}
+        if self.etag is not None :
+            headers['If-None-Match'] = self.etag
+        if self.lastModified is not None :
+            headers['If-Modified-Since'] = self.lastModified
+        return headers
+
+    # Fetch the feed with a conditional GET. Returns the response.
+    # Raises requests.exceptions.RequestException on failure. The
+    # session is made the first time, and kept so the connection
+    # to the agency can be kept alive between polls.
+    def fetch(self, url) :
+        if self.httpSession is None :
+            self.httpSession = requests.Session()
+        response = self.httpSession.get(url, timeout=10, headers=self.conditionalHeaders())
+        response.raise_for_status() # Raise an exception for bad status codes
+        return response
+
+    # Small function to note that a cycle was skipped, and why.
+    def skip(self, reason) :
+        self.counters["skipped"] += 1
+        self.counters[reason] += 1
+        print(f"Feed has not changed ({reason}), skipping database update")
+        return reason
+
+    # Fetch, parse and write the feed once, unless it has not changed.
+    # Returns a dictionary of how long each step took, if the
+    # feed was applied or skipped and the counters so far.
+    # Exceptions are passed on to the caller.
+    def runCycle(self, url) :
+        t0 = time.perf_counter()
+        response = self.fetch(url)
+        return self.ingest(response.status_code, response.content, response.headers, time.perf_counter() - t0)
+
+    # Parse and write a version of the feed that has been fetched (the status
+    # code, content and headers of the response), unless it has not changed.
+    # fetchSec is how long the fetch took, for the timing. parse is what parses
+    # the feed, given the content and a header timestamp to skip making the
+    # rows for, by default parseFeedRows in this process (feedPoller.py hands
+    # it to another process instead). Returns the same as runCycle.
+    def ingest(self, statusCode, content, headers, fetchSec=0.0, parse=None) :
+        if parse is None :
+            parse = functools.partial(parseFeedRows, self.feedModule)
+
+        self.cycle += 1
+        cpuStart = time.process_time()
+        t1 = t2 = t3 = time.perf_counter()
+        numRows = 0
+        skipped = None
+        changes = None
+
+        if statusCode == 304 :
+            skipped = self.skip("notModified")
+        else :
+            digest = hashlib.sha1(content).hexdigest()
+            if digest == self.contentDigest :
+                skipped = self.skip("sameContent")
+            else :
+                feedTimestamp, rows = parse(content, self.feedTimestamp)
+                t2 = t3 = time.perf_counter()
+
+                if rows is None :
+                    skipped = self.skip("sameTimestamp")
+                else :
+                    numRows = len(rows)
+                    changes = self.feedModule.writeDatabase(self.engine, rows, feedTimestamp, **self.writeOptions)
+                    t3 = time.perf_counter()
+                    self.counters["applied"] += 1
+
+                # Only remember this version of the feed once it's in the database.
+                self.contentDigest = digest
+                self.feedTimestamp = feedTimestamp
+
+            self.etag         = headers.get('ETag')
+            self.lastModified = headers.get('Last-Modified')
+
+        timing = { "cycle"       : self.cycle,
+                   "applied"     : skipped is None,
+                   "skipReason"  : skipped,
+                   "numRows"     : numRows,
+                   "fetchSec"    : round(fetchSec, 3),
+                   "parseSec"    : round(t2 - t1, 3),
+                   "writeSec"    : round(t3 - t2, 3),
+                   "durationSec" : round(fetchSec + t3 - t1, 3),
+                   "cpuSec"      : round(time.process_time() - cpuStart, 3) }
+        # Some feeds (vehicles) tell us how many rows were
+        # inserted, updated and deleted.
+        if changes is not None :
+            timing["changes"] = changes
+        timing["counters"] = dict(self.counters)
+        return timing
+
+    def close(self) :
+        if self.httpSession is not None :
+            self.httpSession.close()
+        self.engine.dispose()
+        return
+
+# Parse a version of a feed with the feed's update_db module, and turn it into
+# the rows for the database. Returns the feed header timestamp and the rows,
+# or None for the rows if the timestamp is skipTimestamp (the one we last
+# wrote), since then the feed has not changed and there's no need to make them.
+def parseFeedRows(feedModule, content, skipTimestamp=None) :
+    feed = feedModule.parseFeed(content)
+
+    # A zero timestamp means the agency didn't set one, so we can't go by it.
+    feedTimestamp = feed.header.timestamp
+    if feedTimestamp != 0 and feedTimestamp == skipTimestamp :
+        return feedTimestamp, None
+    return feedTimestamp, feedModule.feedRows(feed)
+
+# Small function to write the updated.time file (in the feed directory,
+# or wherever path says) so we know when we last updated and how long it took.
+def writeUpdatedTime(timing, path="updated.time") :
+    endTm = int(time.time())
+    endDt = datetime.datetime.fromtimestamp(endTm, datetime.timezone.utc).strftime("%Y/%m/%d %H:%M:%S UTC")
+    status = { "updated" : endDt, "utim" : endTm }
+    status.update(timing)
+    with open(path, "w") as file :
+        file.write(json.dumps(status) + "\n")
+    print(json.dumps(status))
+    return
+
+# Small function to sleep for a number of seconds, a second at a time,
+# returning early if the stop marker appears.
+def sleepUnlessStopped(sleepSec) :
+    while sleepSec > 0 and not os.path.exists("stop.marker") :
+        time.sleep(min(1.0, sleepSec))
+        sleepSec -= 1.0
+    return
+
+# Small function to take the lock that says we're the one writing the
+# database in feedDir (writer.lock in there), so that this and feedPoller.py
+# can't both write the same feed. Returns the file descriptor of the lock
+# file, which holds the lock until releaseWriter closes it (or we exit),
+# or None if someone else has it.
+def lockWriter(feedDir) :
+    lockFD = os.open(os.path.join(feedDir, 'writer.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try :
+        fcntl.flock(lockFD, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError :
+        os.close(lockFD)
+        return None
+    return lockFD
+
+# Small function to let go of the lock lockWriter took.
+def releaseWriter(lockFD) :
+    os.close(lockFD)
+    return
+
+def main() :
+
+    parser = argparse.ArgumentParser(description='Long running ingest of a realtime feed into its database.')
+    parser.add_argument('--feed', required=True, choices=sorted(feeds.keys()), help='The feed to ingest.')
+    parser.add_argument('--envFile', required=True, type=str, help='The environment file, re-read every cycle.')
+    args = parser.parse_args()
+
+    # Work in the feed's directory, where the database and marker files are.
+    feedDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.feed)
+    os.chdir(feedDir)
+
+    # If feedPoller.py (or another of us) is writing this feed, leave it to that.
+    writerLock = lockWriter(feedDir)
+    if writerLock is None :
+        print(f"Another process is writing {feedDir}, exiting")
+        sys.exit(0)
+
+    try :
+        ingestLoop(feedDir, args.envFile, args.feed)
+    finally :
+        releaseWriter(writerLock)
+    sys.exit(0)
+
+# Ingest the feed (one of feeds) in feedDir until the stop marker appears,
+# re-reading envFile every cycle. main() runs this with the writer lock held.
+def ingestLoop(feedDir, envFile, feed) :
+    ingester = feedIngester(feedDir)
+    schedule = pollSchedule.pollSchedule(15.0)
+
+    # What the env file said last time, until we've read it.
+    envVars = {}
+    poll = schedule.pollSec
+
+    while True :
+
+        # Stop if the stop marker is present.
+        if os.path.exists("stop.marker") :
+            print("Stopping...")
+            break
+
+        # Hold if the hold marker is present.
+        while os.path.exists("hold.marker") :
+            print("Holding...")
+            time.sleep(1)
+
+        # Re-read the env file for realtime updates, and run a cycle. If
+        # either fails, say so and try again next time rather than exiting
+        # - we're meant to stay up. (A broken env file backs off like a
+        # failed fetch, with the poll interval from when it was last read.)
+        cycleStart = time.time()
+        try :
+            envVars, url, poll = feedSettings(envFile, feed)
+            schedule.pollSec = poll
+            ingester.configure(envVars)
+            timing = ingester.runCycle(url)
+        except Exception as e : # noqa: BLE001
+            print(f"Failed to update db : {e}")
+            timing = { "cycle" : ingester.cycle, "error" : str(e), "durationSec" : 0.0,
+                       "counters" : dict(ingester.counters) }
+
+        writeUpdatedTime(timing)
+        pollSchedule.noteCycle(schedule, ingester, timing, cycleStart)
+
+        # Sleep until the feed should have been published again or,
+        # if we're not polling adaptively, calculate roughly how long
+        # we should sleep for in order to meet the polling spec.
+        if pollSchedule.adaptivePolling(envVars) :
+            sleepSec = schedule.nextFetch() - time.time()
+        else :
+            sleepSec = poll - timing["durationSec"]
+        if sleepSec > 0 :
+            print(f"Sleeping for {sleepSec:.1f} seconds")
+            sleepUnlessStopped(sleepSec)
+
+        print()
+
+    ingester.close()
+    return
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# What every feed's database has in common - how the engine is set up and
+# the feed_generation table, which the API reads to tell when the data in
+# the database have changed.
+#
+# The update_db.py (and init_db.py) of each feed, and the make_db.py of each
+# test database, used to have their own copies of these. They all use this
+# module instead, so the databases all work the same way.
+
+import time
+
+from sqlalchemy import Column, Integer
+from sqlalchemy.dialects.mysql import BIGINT
+
+# Run sqlite in write-ahead log (WAL) mode. In WAL mode a writer does not
+# block readers - they keep seeing the data as it was before the writer's
+# transaction until the writer commits. That is what lets us swap in new
+# data without taking the database offline. The setting is stored in the
+# database file, so this only really does anything the first time.
+def useWAL(engine) :
+    with engine.connect() as conn :
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    return
+
+class generationColumns :
+    """
+    The feed_generation table, a single row table that the API reads to tell
+    when the data have changed. The generation goes up by one every time
+    new data are written (in the same transaction), and feedtime and
+    updatetime are the feed header timestamp (zero if there isn't one) and
+    when the data were written. Each feed makes the table on its own
+    declarative base, with
+        class generationTable(feedGeneration.generationColumns, Base) :
+    """
+    __tablename__  = 'feed_generation'
+    id             = Column(Integer, nullable=False, primary_key=True)
+    generation     = Column(Integer, nullable=False)
+    feedtime       = Column(BIGINT(unsigned=True), nullable=False)
+    updatetime     = Column(BIGINT(unsigned=True), nullable=False)
+
+# Small function to bump the generation in a feed's generationTable (made
+# as above). Called inside the transaction that writes the change.
+# Returns the row, with the new generation and update time.
+def publishGeneration(session, generationTable, feedTimestamp) :
+    row = session.get(generationTable, 1)
+    if row is None :
+        row = generationTable(id=1, generation=0)
+        session.add(row)
+    row.generation = row.generation + 1
+    row.feedtime   = feedTimestamp
+    row.updatetime = int(time.time())
+    return row
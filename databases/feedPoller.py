@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+# One process that polls the realtime feeds (vehicle positions and trip
+# updates) of every agency we serve.
+#
+# feedDaemon.py runs one process per feed per agency, each fetching its
+# feed with its own blocking HTTP session on its own schedule, so the
+# vehicle and trip loops of an agency drift apart, and with several
+# agencies on the one machine there are several processes doing the
+# same thing. This polls them all from one asyncio event loop instead :
+#  * The fetches go out together, on one httpx.AsyncClient, whose pool of
+#    connections is kept alive between polls, so each poll of a feed is
+#    a request on a connection that's already open rather than a new TCP
+#    connection and TLS handshake (agencies usually publish both feeds
+#    from the same host, so they can share connections too).
+#  * Each feed is fetched when the agency next publishes it, as
+#    feedDaemon.py does (see pollSchedule.py). If BFR_ADAPTIVE_POLL is
+#    FALSE, each feed is polled on a fixed schedule instead, every
+#    BFR_VEHICLE_POLL (or BFR_TRIP_POLL) seconds from when the poller
+#    started, rather than sleeping that long after each cycle, so the
+#    feeds don't drift.
+#  * Parsing the protobuf and making the rows is CPU work that would
+#    hold up the event loop (and every other feed's fetch), so it's done
+#    in a pool of worker processes. Writing the database is done by a
+#    thread per feed, as feedDaemon.py would, with the feed's
+#    feedIngester, so the skipping of unchanged feeds, the counters and
+#    updated.time are all the same.
+#
+# Each agency's environment file says where its tree is (BFR_TOP_DIR), and
+# its feeds are written to the databases there, just as the fetch scripts
+# would. The environment files are re-read every cycle, and the stop and
+# hold markers in each feed directory work as they do for feedDaemon.py
+# (when every feed has stopped, the poller exits). It holds the writer
+# lock of every feed it polls (see feedDaemon.lockWriter), so it won't
+# start if a fetch script is already writing one of them, and the fetch
+# scripts won't start while it's running. Run it like so :
+#   ./feedPoller.py $HOME/bussinFR/environment.vars /home/cdot/bussinFR/environment.vars
+
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import httpx
+
+# Run as a script from this directory, or imported as part of the package by the tests.
+try:
+    from . import feedDaemon
+    from . import pollSchedule
+except ImportError:
+    import feedDaemon
+    import pollSchedule
+
+codeDir = os.path.dirname(os.path.abspath(__file__))
+
+# The feeds we poll, as feedDaemon.py knows them.
+feeds = feedDaemon.feeds
+
+# The update_db modules a parsing worker process has loaded, by feed directory.
+workerModules = {}
+
+# Parse a version of a feed, in a worker process. Returns the
+# same as feedDaemon.parseFeedRows, which is what does the work.
+def parseInWorker(feedDir, content, skipTimestamp) :
+    if feedDir not in workerModules :
+        workerModules[feedDir] = feedDaemon.loadFeedModule(feedDir)
+    return feedDaemon.parseFeedRows(workerModules[feedDir], content, skipTimestamp)
+
+# Small function to parse a version of a feed in the pool of worker
+# processes and wait for it, for feedIngester.ingest (which is run in
+# a thread of its own, so waiting doesn't hold anything else up).
+def parseElsewhere(parsePool, feedDir, content, skipTimestamp) :
+    return parsePool.submit(parseInWorker, feedDir, content, skipTimestamp).result()
+
+class feedPoller :
+    """
+    Polls the vehicle and trip feeds of the agencies with the environment
+    files envFiles, all at once on one pool of HTTP connections (at most
+    maxConnections of them), parsing in parseWorkers worker processes
+    (or, if that's zero, in the database threads).
+    """
+
+    def __init__(self, envFiles, parseWorkers=2, maxConnections=20) :
+        self.client = httpx.AsyncClient(timeout=10.0, follow_redirects=True,
+                                        limits=httpx.Limits(max_connections=maxConnections,
+                                                            max_keepalive_connections=maxConnections))
+        self.parsePool = None
+        if parseWorkers > 0 :
+            self.parsePool = ProcessPoolExecutor(parseWorkers)
+
+        # What we know about each feed of each agency.
+        self.polled = []
+        for envFile in envFiles :
+            topDir = feedDaemon.readEnvFile(envFile)['BFR_TOP_DIR']
+            for feed in feeds :
+                feedDir = os.path.join(topDir, 'databases', feed)
+                writerLock = feedDaemon.lockWriter(feedDir)
+                if writerLock is None :
+                    for polled in self.polled :
+                        feedDaemon.releaseWriter(polled['writerLock'])
+                    raise RuntimeError(f"Another process is writing {feedDir}, stop it first")
+                ingester = feedDaemon.feedIngester(os.path.join(codeDir, feed), os.path.join(feedDir, 'database.db'))
+                ingester.feedModule.Base.metadata.create_all(ingester.engine) # As init_db.py would
+                self.polled.append({ 'envFile' : envFile, 'feed' : feed, 'feedDir' : feedDir, 'ingester' : ingester,
+                                     'writerLock' : writerLock, 'schedule' : pollSchedule.pollSchedule(15.0),
+                                     'adaptive' : True })
+
+        # A thread for each feed, so no feed's database write waits on another's.
+        self.dbPool = ThreadPoolExecutor(max(len(self.polled), 1))
+
+    # Fetch, parse and write one feed once (one of self.polled), unless it has
+    # not changed, and write its updated.time. Returns the timing (as from
+    # feedIngester.runCycle, or with the error if it failed) and how often
+    # the environment file says to poll the feed (or said, last time we
+    # could read it).
+    async def pollOnce(self, polled) :
+        ingester = polled['ingester']
+        poll = polled['schedule'].pollSec
+
+        parse = None
+        if self.parsePool is not None :
+            parse = functools.partial(parseElsewhere, self.parsePool, os.path.join(codeDir, polled['feed']))
+
+        # Re-read the environment file and poll. If either fails, say so and
+        # try again next time rather than exiting - like feedDaemon.py, we're
+        # meant to stay up, and the other feeds go on being polled.
+        cycleStart = time.time()
+        try :
+            envVars, url, poll = feedDaemon.feedSettings(polled['envFile'], polled['feed'])
+            polled['schedule'].pollSec = poll
+            polled['adaptive'] = pollSchedule.adaptivePolling(envVars)
+            ingester.configure(envVars)
+
+            t0 = time.perf_counter()
+            response = await self.client.get(url, headers=ingester.conditionalHeaders())
+            if response.is_error : # Raise an exception for bad status codes (httpx counts 304 as one)
+                response.raise_for_status()
+            timing = await asyncio.get_running_loop().run_in_executor(self.dbPool, ingester.ingest,
+                                                                      response.status_code, response.content,
+                                                                      response.headers, time.perf_counter() - t0,
+                                                                      parse)
+        except Exception as e : # noqa: BLE001
+            print(f"Failed to update {polled['feedDir']} : {e}")
+            timing = { "cycle" : ingester.cycle, "error" : str(e), "durationSec" : 0.0,
+                       "counters" : dict(ingester.counters) }
+
+        feedDaemon.writeUpdatedTime(timing, os.path.join(polled['feedDir'], 'updated.time'))
+        pollSchedule.noteCycle(polled['schedule'], ingester, timing, cycleStart)
+        return timing, poll
+
+    # Poll one feed until its stop marker appears.
+    async def pollFeed(self, polled) :
+        stopMarker = os.path.join(polled['feedDir'], 'stop.marker')
+        holdMarker = os.path.join(polled['feedDir'], 'hold.marker')
+        nextPoll = time.monotonic()
+        while not os.path.exists(stopMarker) :
+
+            while os.path.exists(holdMarker) :
+                await asyncio.sleep(1.0)
+
+            _, poll = await self.pollOnce(polled)
+
+            # Next time is when the feed should have been published again or,
+            # if we're not polling adaptively, poll seconds after this time
+            # was due, or now, if the cycle took longer than that. We sleep
+            # a second at a time to see the stop marker.
+            if polled['adaptive'] :
+                nextPoll = time.monotonic() + max(polled['schedule'].nextFetch() - time.time(), 0.0)
+            else :
+                nextPoll = max(nextPoll + poll, time.monotonic())
+            while time.monotonic() < nextPoll and not os.path.exists(stopMarker) :
+                await asyncio.sleep(min(1.0, nextPoll - time.monotonic()))
+
+        print(f"Stopping {polled['feedDir']}...")
+        return
+
+    # Poll every feed until they've all stopped.
+    async def run(self) :
+        await asyncio.gather(*[ self.pollFeed(polled) for polled in self.polled ])
+        return
+
+    async def close(self) :
+        await self.client.aclose()
+        if self.parsePool is not None :
+            self.parsePool.shutdown()
+        self.dbPool.shutdown()
+        for polled in self.polled :
+            polled['ingester'].close()
+            feedDaemon.releaseWriter(polled['writerLock'])
+        return
+
+def main() :
+
+    parser = argparse.ArgumentParser(description='Poll the realtime feeds of several agencies from one process.')
+    parser.add_argument('envFiles', nargs='+', type=str, help='The environment files of the agencies, re-read every cycle.')
+    parser.add_argument('--parseWorkers', type=int, default=2, help='Number of processes to parse the feeds in, zero to parse in threads.')
+    parser.add_argument('--maxConnections', type=int, default=20, help='Most HTTP connections to keep open.')
+    args = parser.parse_args()
+
+    async def pollAll() :
+        poller = feedPoller(args.envFiles, args.parseWorkers, args.maxConnections)
+        try :
+            await poller.run()
+        finally :
+            await poller.close()
+
+    asyncio.run(pollAll())
+    sys.exit(0)
+
+if __name__ == "__main__" :
+    main()
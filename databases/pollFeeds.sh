@@ -0,0 +1,69 @@
+#!/bin/bash
+
+
+# Poll the vehicle and trip feeds of several agencies from one
+# process (see feedPoller.py), rather than running fetchVehicleUpdates.sh
+# and fetchTripUpdates.sh for each of them. It can be run from cron
+# every minute, like the cron_monitor.sh scripts, in place of their
+# entries for the vehicles and trip updates - if the poller is already
+# running, this does nothing :
+# * * * * * $HOME/bussinFR/databases/pollFeeds.sh /home/cdot/bussinFR/environment.vars /home/rtd/bussinFR/environment.vars > $HOME/bussinFR/databases/pollFeeds.log 2>&1;
+
+# Needed to run under cron : If the file
+# $HOME/.local/bin/env exists then
+# source it so that uv will be found.
+if [ -f "$HOME/.local/bin/env" ]
+then
+ source "$HOME/.local/bin/env"
+fi
+
+pn=`basename $0`
+
+# Get the agencies' environment files from the command line.
+if [ "$#" -lt 1 ]
+then
+ echo $pn : One or more environment files are required on the command line, eg
+ echo $pn /home/cdot/bussinFR/environment.vars /home/rtd/bussinFR/environment.vars
+ exit -1
+fi
+
+envFiles=""
+for envFile in "$@"
+do
+ if [ ! -f "$envFile" ]
+ then
+  echo $pn : Environment file $envFile not found
+  exit -1
+ fi
+ envFiles="$envFiles `readlink -f "$envFile"`"
+done
+
+# Get the username. Try $USER, $LOGNAME and the end of $HOME
+# in that order.
+if [ -z "$USER" ]
+then
+ if [ -z "$LOGNAME" ]
+ then
+  # Try to get it from the home dir name
+  un=`basename "$HOME"`
+ else
+  # Use LOGNAME
+  un="$LOGNAME"
+ fi
+else
+ un="$USER"
+fi
+
+numRunning=`ps aux | grep "$un" | grep feedPoller.py | grep -v grep | wc -l`
+echo $numRunning such processes running
+
+if [ "$numRunning" -ne 0 ]
+then
+ exit 0
+fi
+
+cd `dirname $0`
+
+uv run ./feedPoller.py $envFiles
+
+exit 0
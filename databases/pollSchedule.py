@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# Works out when to fetch a realtime feed next, from when the agency
+# publishes it, rather than every BFR_VEHICLE_POLL (or BFR_TRIP_POLL)
+# seconds regardless.
+#
+# Agencies publish their feeds on a schedule of their own - every 30
+# seconds, say - and polling on a fixed schedule that isn't lined up with
+# it means the data we serve are up to a whole poll interval older than
+# they need to be, and polling more often than the feed changes fetches
+# the same feed again for nothing. Instead we learn the feed's schedule :
+#  * When each version of the feed was published, from the FeedMessage
+#    header timestamp, or the Last-Modified header if the agency doesn't
+#    set that, or when we first saw it if neither.
+#  * The period, the typical gap between versions we've seen lately
+#    (leaving out the gaps where we missed a version, which are two
+#    periods or more).
+#  * How long after it's published a version shows up for us, which also
+#    takes care of any difference between the agency's clock and ours. We
+#    only know that to within how often we look, so every time a version
+#    is there the first time we look, we look a little earlier the next
+#    time, until it isn't there yet.
+# and fetch when the next version should show up. If it isn't there yet,
+# we look again a second later, then two seconds, four and so on, up to
+# the poll interval (so a feed that stops being published is polled as
+# before). Every so often we look half way through the period, so if the
+# agency starts publishing more often, we see it. Until we know the period
+# we poll every poll interval as before, and if a fetch fails, we wait
+# the poll interval, then twice that and so on, up to maxBackoffSec, so
+# we don't hammer an agency that's having trouble.
+
+import collections
+import itertools
+from email.utils import parsedate_to_datetime
+
+class pollSchedule :
+    """
+    When to fetch a feed next. Tell it about each fetch with fetched()
+    (or failed(), if it failed) and nextFetch() says when to fetch again,
+    in seconds since the epoch. pollSec is the poll interval from the
+    environment file, used until the feed's period is known and as
+    the longest we wait to look again when a version is late.
+    """
+
+    def __init__(self, pollSec, minPollSec=1.0, maxBackoffSec=300.0, stepSec=0.5, history=20, probeEvery=10) :
+        self.pollSec       = pollSec
+        self.minPollSec    = minPollSec    # Never fetch more often than this
+        self.maxBackoffSec = maxBackoffSec # Longest to wait after failures
+        self.stepSec       = stepSec       # How much earlier to look each time a version is there already
+        self.probeEvery    = probeEvery    # Look half way through the period after this many versions
+
+        # The publish times of the versions we've seen lately (in the agency's
+        # clock) and how long after that we think a version shows up for us.
+        self.publishTimes = collections.deque(maxlen=history)
+        self.delay        = None
+
+        self.lastFetch   = None
+        self.versions    = 0 # Versions seen
+        self.errors      = 0 # Failed fetches in a row
+        self.misses      = 0 # Fetches in a row without a new version
+
+    # Note a fetch at fetchTime (seconds since the epoch, when the response
+    # came in). newVersion is True if it got a version of the feed we hadn't
+    # seen, published at publishTime (see publishTimeOf, None if we can't tell).
+    def fetched(self, fetchTime, publishTime=None, newVersion=False) :
+        self.lastFetch = fetchTime
+        self.errors = 0
+        if not newVersion :
+            self.misses += 1
+            return
+        if publishTime is None :
+            publishTime = fetchTime
+        if len(self.publishTimes) > 0 and publishTime <= self.publishTimes[-1] :
+            self.misses = 0
+            return
+
+        # If we had looked already and it wasn't there, it showed up since then,
+        # so this is about how long it takes. If it was there the first time we
+        # looked, it may have been there a while, so look a little earlier next time.
+        # (The delay can be negative if the agency's clock is ahead of ours.)
+        delay = fetchTime - publishTime
+        if self.delay is None or self.misses > 0 :
+            self.delay = delay
+        else :
+            self.delay = min(self.delay, delay) - self.stepSec
+
+        self.publishTimes.append(publishTime)
+        self.versions += 1
+        self.misses = 0
+        return
+
+    # Note a fetch at fetchTime that failed.
+    def failed(self, fetchTime) :
+        self.lastFetch = fetchTime
+        self.errors += 1
+        return
+
+    # The feed's period, or None if we don't know it yet. That's the median
+    # of the gaps between the versions we've seen lately, leaving out the
+    # ones where we must have missed a version in between (half as long
+    # again as the shortest gap, or more) and the ones too short to poll for.
+    def period(self) :
+        times = list(self.publishTimes)
+        gaps = [ later - earlier for earlier, later in itertools.pairwise(times) if later - earlier >= self.minPollSec ]
+        if len(gaps) == 0 :
+            return None
+        shortest = min(gaps)
+        gaps = sorted(gap for gap in gaps if gap < 1.5 * shortest)
+        return gaps[len(gaps) // 2]
+
+    # When to fetch next, in seconds since the epoch.
+    def nextFetch(self) :
+        if self.lastFetch is None :
+            return 0.0
+
+        # After a failure, back off.
+        if self.errors > 0 :
+            return self.lastFetch + min(self.pollSec * 2 ** (self.errors - 1), self.maxBackoffSec)
+
+        period = self.period()
+        if period is None :
+            return self.lastFetch + self.pollSec
+
+        # When the next version should show up, in our clock. Every probeEvery
+        # versions, look half way there in case it's sooner now.
+        due = self.publishTimes[-1] + self.delay
+        if self.misses == 0 and self.versions % self.probeEvery == 0 :
+            due += period / 2.0
+        else :
+            due += period
+
+        # If we've looked since it was due, it's late, so look
+        # again soon, but less and less often the later it is.
+        if self.lastFetch >= due :
+            due = self.lastFetch + min(self.minPollSec * 2 ** max(self.misses - 1, 0), self.pollSec)
+
+        return max(due, self.lastFetch + self.minPollSec)
+
+# Small function to get the publish time of a version of a feed, in seconds
+# since the epoch, from its header timestamp if the agency set one (it's
+# zero if not), otherwise from the Last-Modified header (a string, or None
+# if there wasn't one). Returns None if we can't tell.
+def publishTimeOf(feedTimestamp, lastModified=None) :
+    if feedTimestamp is not None and feedTimestamp > 0 :
+        return float(feedTimestamp)
+    if lastModified is not None :
+        try :
+            return parsedate_to_datetime(lastModified).timestamp()
+        except (TypeError, ValueError) :
+            return None
+    return None
+
+# Small function to tell a pollSchedule about an ingest cycle of a
+# feedIngester (see feedDaemon.py) that started at cycleStart (seconds
+# since the epoch) and returned timing, which has an error in it if it failed.
+def noteCycle(schedule, ingester, timing, cycleStart) :
+    fetchTime = cycleStart + timing.get("fetchSec", 0.0)
+    if "error" in timing :
+        schedule.failed(fetchTime)
+        return
+    schedule.fetched(fetchTime, publishTimeOf(ingester.feedTimestamp, ingester.lastModified), timing["applied"])
+    return
+
+# Small function to see if the environment file asks for adaptive
+# polling (BFR_ADAPTIVE_POLL, which is on unless it's FALSE).
+def adaptivePolling(envVars) :
+    return envVars.get('BFR_ADAPTIVE_POLL', 'TRUE').upper() not in ('FALSE', 'OFF', '0')
+
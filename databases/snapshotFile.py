@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# Snapshot files - a read only copy of what the API serves out, published
+# by the ingest every time it writes a new generation of the data.
+#
+# Each API worker used to keep its own copy of the vehicles in memory (see
+# webservices/bussinSnapshots.py) loaded from its own database connection,
+# so running more uvicorn workers meant more copies and more readers on the
+# databases. Instead, after each write the ingest puts what the API needs
+# in a snapshot file next to the database (snapshot.bin in the feed's
+# directory), and every worker maps that file into memory (mmap). The pages
+# of a mapped file are the operating system's page cache, so however many
+# workers there are, there is one copy of the data, and the workers don't
+# touch the database at all while the file is there.
+#
+# There is a snapshot file for each database :
+#  * vehicles     - the vehicles (in table order), the vehicle_changes ring
+#                   and the route catalog, from databases/vehicles/update_db.py.
+#  * trip_updates - the arrivals, grouped by stop, from databases/trip_updates/update_db.py.
+#  * stops        - the stops (in table order), from databases/stops/update_db.py.
+#
+# The file is written to a temporary file that is then renamed over the
+# old one, which is atomic, so a worker that opens the file gets either
+# the old generation or the new one, never half of each. A worker that
+# still has the old file mapped keeps it until it lets go of it (the
+# operating system keeps the old file around until then).
+#
+# The layout is fixed, all little endian :
+#  * A header (headerFormat) - magic, generation, update time and the number of columns.
+#  * A directory entry (entryFormat) for each column - its name, numpy
+#    dtype, where its data starts in the file and how many items it has.
+#  * The data of each column, each starting on an 8 byte boundary.
+# Columns of strings are stored as two columns, name.o with the offsets
+# of each string (one more than there are strings) and name.b with the
+# UTF-8 bytes of all of them, one after the other (see stringColumn).
+
+import mmap
+import os
+import struct
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+snapshotFileName = "snapshot.bin"
+stopTileFileName = "stopTiles.bin" # The stop tiles, see stops/stopTiles.py
+snapshotMagic    = b"BFRSNAP1"
+headerFormat     = "<8sqqq"
+entryFormat      = "<24s8sqq"
+
+class stringColumn :
+    """
+    A column of strings, held as the offsets of each string in a buffer
+    of their UTF-8 bytes, both numpy arrays. Strings are only turned back
+    into python strings when they are asked for, so a mapped column costs
+    nothing until it is used.
+    """
+
+    def __init__(self, offsets, data) :
+        self.offsets = offsets
+        self.data    = data
+
+    def __len__(self) :
+        return len(self.offsets) - 1
+
+    # One string. Along with len() this is enough for bisect to
+    # search a column of strings that is in order.
+    def __getitem__(self, i) :
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    # The strings at the indices, as a list.
+    def take(self, indices) :
+        offsets = self.offsets
+        return [ self.data[offsets[i]:offsets[i + 1]].tobytes().decode() for i in np.asarray(indices).tolist() ]
+
+    def tolist(self) :
+        return self.take(np.arange(len(self)))
+
+# Small function to make a stringColumn from a list of strings.
+def stringColumnOf(strings) :
+    encoded = [ s.encode() for s in strings ]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([ len(e) for e in encoded ], dtype=np.int64)
+    return stringColumn(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+# Write a snapshot file. columns is a dictionary of column name to numpy
+# array or stringColumn. The file is written next to where it goes and
+# then renamed over the old one, so readers never see half a file.
+def writeSnapshotFile(path, generation, updatetime, columns) :
+    arrays = []
+    for name, column in columns.items() :
+        if isinstance(column, stringColumn) :
+            arrays.append((name + ".o", column.offsets))
+            arrays.append((name + ".b", column.data))
+        else :
+            arrays.append((name, column))
+
+    # Work out where each column goes.
+    entries = []
+    offset = struct.calcsize(headerFormat) + len(arrays) * struct.calcsize(entryFormat)
+    for name, array in arrays :
+        array = np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('<'))
+        offset = (offset + 7) // 8 * 8
+        entries.append((name, array, offset))
+        offset += array.nbytes
+
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as file :
+        file.write(struct.pack(headerFormat, snapshotMagic, generation, updatetime, len(entries)))
+        for name, array, offset in entries :
+            file.write(struct.pack(entryFormat, name.encode(), array.dtype.str.encode(), offset, len(array)))
+        for name, array, offset in entries :
+            file.write(b"\0" * (offset - file.tell()))
+            file.write(array.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmpPath, path)
+    return
+
+class mappedSnapshot :
+    """
+    A snapshot file mapped into memory. columns is a dictionary of
+    column name to numpy array (or stringColumn), all of them read
+    only views of the mapped file rather than copies. identity tells
+    this file apart from the one that replaces it.
+    """
+
+    def __init__(self, path) :
+        with open(path, "rb") as file :
+            stat = os.fstat(file.fileno())
+            self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.generation, self.updatetime, numColumns = struct.unpack_from(headerFormat, self.map, 0)
+        if magic != snapshotMagic :
+            raise ValueError(f"{path} is not a snapshot file")
+
+        arrays = {}
+        entryOffset = struct.calcsize(headerFormat)
+        for i in range(numColumns) :
+            name, dtype, offset, count = struct.unpack_from(entryFormat, self.map, entryOffset)
+            entryOffset += struct.calcsize(entryFormat)
+            arrays[name.rstrip(b"\0").decode()] = np.frombuffer(self.map, dtype=np.dtype(dtype.rstrip(b"\0").decode()),
+                                                                count=count, offset=offset)
+
+        self.columns = {}
+        for name, array in arrays.items() :
+            if name.endswith(".o") :
+                self.columns[name[:-2]] = stringColumn(array, arrays[name[:-2] + ".b"])
+            elif not name.endswith(".b") :
+                self.columns[name] = array
+
+# Small function to get the identity of the snapshot file at path, to see if
+# it has been replaced since we mapped it. Returns None if there isn't one.
+def snapshotIdentity(path) :
+    try :
+        stat = os.stat(path)
+    except FileNotFoundError :
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Small function to get the generation and update time out of
+# the feed_generation table, (0, 0) if there isn't one.
+def readPublished(conn) :
+    try :
+        row = conn.execute(text("SELECT generation, updatetime FROM feed_generation WHERE id=1")).fetchone()
+    except OperationalError :
+        return 0, 0
+    if row is None :
+        return 0, 0
+    return row[0], row[1]
+
+# Small function to dictionary encode a list of strings. Returns the
+# distinct strings, in order, and the index of each string in them.
+def dictionaryEncode(strings) :
+    if len(strings) == 0 :
+        return [], np.array([], dtype=np.int64)
+    names, codes = np.unique(np.array(strings, dtype=object), return_inverse=True)
+    return names.tolist(), codes.reshape(-1).astype(np.int64)
+
+# What goes in the vehicle snapshot file. The vehicles are in
+# table order, which is the order the API serves them out in, with
+# the routes dictionary encoded, then the vehicle_changes ring
+# (for the deltas) and the route catalog (for the route end point).
+def readVehicleColumns(conn) :
+    rows = conn.execute(text("SELECT vehicleid, route, timestamp, current_status, lat, lon, bearing "
+                             "FROM vehicles ORDER BY rowid")).fetchall()
+    # Databases made before the vehicle_changes ring just don't do deltas.
+    try :
+        changes = conn.execute(text("SELECT generation, vehicleid, updatetime FROM vehicle_changes")).fetchall()
+    except OperationalError :
+        changes = []
+    # And databases made before there was a vehicle_routes table count the routes from the vehicles.
+    try :
+        catalog = conn.execute(text("SELECT route, vehicles FROM vehicle_routes ORDER BY route")).fetchall()
+    except OperationalError :
+        catalog = conn.execute(text("SELECT route, COUNT(*) FROM vehicles GROUP BY route ORDER BY route")).fetchall()
+
+    routeNames, routeCodes = dictionaryEncode([ r.route for r in rows ])
+    return { "vehicleid"        : stringColumnOf([ r.vehicleid for r in rows ]),
+             "routeNames"       : stringColumnOf(routeNames),
+             "routeCodes"       : routeCodes,
+             "timestamp"        : np.array([ r.timestamp for r in rows ], dtype=np.int64),
+             "current_status"   : np.array([ r.current_status for r in rows ], dtype=np.int64),
+             "lat"              : np.array([ r.lat for r in rows ], dtype=np.float64),
+             "lon"              : np.array([ r.lon for r in rows ], dtype=np.float64),
+             "bearing"          : np.array([ r.bearing for r in rows ], dtype=np.float64),
+             "changeGeneration" : np.array([ c[0] for c in changes ], dtype=np.int64),
+             "changeVehicle"    : stringColumnOf([ c[1] for c in changes ]),
+             "changeUpdatetime" : np.array([ c[2] for c in changes ], dtype=np.int64),
+             "catalogRoute"     : stringColumnOf([ c[0] for c in catalog ]),
+             "catalogVehicles"  : np.array([ c[1] for c in catalog ], dtype=np.int64) }
+
+# What goes in the trip snapshot file - the arrivals grouped by stop. The
+# stops are in order, so a stop can be found with a binary search, and
+# the arrivals at the stop with index s are arrivalStarts[s] up to
+# arrivalStarts[s+1], in the same order the trip service's query gives
+# them (arrival time, then route).
+def readArrivalColumns(conn) :
+    rows = conn.execute(text("SELECT stopid, route, arrivaltime FROM intrepid_trips "
+                             "ORDER BY stopid, arrivaltime, route")).fetchall()
+    stopIDs, stopCodes = dictionaryEncode([ r.stopid for r in rows ])
+    routeNames, routeCodes = dictionaryEncode([ r.route for r in rows ])
+    return { "stopIDs"       : stringColumnOf(stopIDs),
+             "arrivalStarts" : np.searchsorted(stopCodes, np.arange(len(stopIDs) + 1)).astype(np.int64),
+             "routeNames"    : stringColumnOf(routeNames),
+             "routeCodes"    : routeCodes,
+             "arrivaltime"   : np.array([ r.arrivaltime for r in rows ], dtype=np.int64) }
+
+# What goes in the stop snapshot file - the stops, in table order.
+# Databases made before the stops had a minimum zoom show every stop at every zoom.
+def readStopColumns(conn) :
+    try :
+        rows = conn.execute(text("SELECT stopid, stopname, stopdesc, lat, lon, minzoom FROM stops ORDER BY rowid")).fetchall()
+    except OperationalError :
+        rows = conn.execute(text("SELECT stopid, stopname, stopdesc, lat, lon, 0 FROM stops ORDER BY rowid")).fetchall()
+    return { "stopid"   : stringColumnOf([ r[0] for r in rows ]),
+             "stopname" : stringColumnOf([ r[1] for r in rows ]),
+             "stopdesc" : stringColumnOf([ r[2] for r in rows ]),
+             "lat"      : np.array([ r[3] for r in rows ], dtype=np.float64),
+             "lon"      : np.array([ r[4] for r in rows ], dtype=np.float64),
+             "minzoom"  : np.array([ r[5] for r in rows ], dtype=np.int64) }
+
+# Small function to get where the snapshot file for a database goes, next to the database file.
+def snapshotPath(engine) :
+    return os.path.join(os.path.dirname(os.path.abspath(engine.url.database)), snapshotFileName)
+
+# Publish the snapshot file for a database, with what readColumns (one of the
+# functions above) gets out of it. The ingest calls this after it commits a new
+# generation, and it is the only writer, so what we read is that generation.
+#
+# If it fails, the old snapshot file is removed, so that the API goes back to
+# the database rather than serving out the old data, and the exception is
+# passed on. Returns the path of the snapshot file.
+def publishSnapshot(engine, readColumns) :
+    path = snapshotPath(engine)
+    published = False
+    try :
+        with engine.connect() as conn :
+            generation, updatetime = readPublished(conn)
+            columns = readColumns(conn)
+        writeSnapshotFile(path, generation, updatetime, columns)
+        published = True
+    finally :
+        if not published :
+            for stale in [ path, path + ".tmp" ] :
+                if os.path.exists(stale) :
+                    os.remove(stale)
+    return path
@@ -3,7 +3,7 @@
 # Clean up runtime files. After this, the database will
 # have to be reinitialized.
 
-rm -vf database.db
+rm -vf database.db database.db-wal database.db-shm
 rm -vrf fromAgency
 rm -vf updated.time
 
@@ -2,9 +2,15 @@
 
 # Initialize the database.
 
-from sqlalchemy import create_engine, UniqueConstraint, Column, String, Float
+from sqlalchemy import text, create_engine, UniqueConstraint, Column, String, Float, Integer
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.orm import declarative_base
+import os
+import sys
+
+# The generation table and WAL mode are the same for every feed's database.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import feedGeneration
 
 # Make the table.
 Base = declarative_base()
@@ -16,6 +22,7 @@ class stopsTable(Base):
     stopdesc = Column(String, nullable=False)
     lat      = Column(Float,  nullable=False)
     lon      = Column(Float,  nullable=False)
+    minzoom  = Column(Integer, nullable=False, server_default='0')
     __table_args__ = (UniqueConstraint('stopid', name='unique_constraint'),)
 
 class stopsTableUpdate(Base):
@@ -25,8 +32,15 @@ class stopsTableUpdate(Base):
     stopdesc = Column(String, nullable=False)
     lat      = Column(Float,  nullable=False)
     lon      = Column(Float,  nullable=False)
+    minzoom  = Column(Integer, nullable=False, server_default='0')
     __table_args__ = (UniqueConstraint('stopid', name='unique_constraint'),)
 
+# The generation of the stops, which update_db.py bumps every time
+# it writes them and the API uses to tell if they have changed.
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
+
 # Create the database.
 # Had to install sqlalchemy_utils to do this.
 engine = create_engine("sqlite:///database.db", echo=False)
@@ -44,5 +58,16 @@ engine.echo=True
 Base.metadata.create_all(engine)
 engine.echo=False
 
+# Also make an empty spatial index on the stops table (an sqlite
+# R*Tree virtual table, which the ORM can't make for us). update_db.py
+# fills it in when it swaps in new stops.
+with engine.begin() as conn :
+    conn.execute(text("DROP TABLE IF EXISTS stops_rtree"))
+    conn.execute(text("CREATE VIRTUAL TABLE stops_rtree USING rtree(id, minLat, maxLat, minLon, maxLon)"))
+
+# Run in write-ahead log (WAL) mode so that readers are never blocked
+# while update_db.py swaps in new data, see ../feedGeneration.py.
+feedGeneration.useWAL(engine)
+
 quit()
 
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Level of detail for the bus stops.
+#
+# Zoomed out, the map can't usefully show every stop - they pile up on
+# top of each other and there are too many to send. So each stop gets
+# a minimum zoom, the lowest map zoom level at which it is shown, worked
+# out when the stops are written (see update_db.py) so that at every
+# zoom level the stops shown are spread out evenly over the map.
+#
+# It is done by thinning on a grid. At each zoom level, starting at 0,
+# the map is split into cells cellPixels on a side (in web mercator
+# pixels, which is what the map draws in) and each cell that doesn't
+# have a stop in it yet gets one more, the first one in it in order of
+# priority. Stops that are still left at maxZoom get maxZoom. Parent
+# stations, which are what people look for zoomed out, come first,
+# and then the stops in the order they came in.
+
+import math
+
+# The zoom level by which every stop is shown, and the size of the grid
+# cells in pixels. Stop icons are 20 pixels, so at most one stop in 32
+# pixels means they don't sit on top of each other.
+maxZoom = 16
+cellPixels = 32
+
+# Small function to get where a lat, lon is on the map at a zoom
+# level, in web mercator pixels from the top left of the world.
+def mercatorPixels(lat, lon, zoom) :
+    worldPixels = 256.0 * (2 ** zoom)
+    lat = max(min(lat, 85.0511), -85.0511) # Mercator doesn't go all the way to the poles
+    x = (lon + 180.0) / 360.0 * worldPixels
+    y = (1.0 - math.log(math.tan(math.radians(lat)) + 1.0 / math.cos(math.radians(lat))) / math.pi) / 2.0 * worldPixels
+    return x, y
+
+# Work out the minimum zoom for each stop. stops is a list of
+# dictionaries with lat and lon keys (and stopid, if there are
+# parent stations) and important is the stop IDs to put first.
+# Sets the minzoom key in each dictionary.
+def assignMinZooms(stops, important=(), maxZoom=maxZoom, cellPixels=cellPixels) :
+    important = set(important)
+    left = sorted(stops, key=lambda stop : 0 if stop.get('stopid') in important else 1)
+    shown = []
+
+    # Small function to get the grid cell a stop is in at a zoom level.
+    def cellOf(stop, zoom) :
+        x, y = mercatorPixels(stop['lat'], stop['lon'], zoom)
+        return int(x // cellPixels), int(y // cellPixels)
+
+    for zoom in range(maxZoom) :
+        # The stops already shown at lower zoom levels have their cells, and
+        # then the first of the others in each empty cell is shown from here on.
+        occupied = { cellOf(stop, zoom) for stop in shown }
+        stillLeft = []
+        for stop in left :
+            cell = cellOf(stop, zoom)
+            if cell in occupied :
+                stillLeft.append(stop)
+                continue
+            occupied.add(cell)
+            stop['minzoom'] = zoom
+            shown.append(stop)
+        left = stillLeft
+
+    for stop in left :
+        stop['minzoom'] = maxZoom
+
+    return stops
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Slippy map tiles of the bus stops.
+#
+# The stops only change when update_db.py runs (once a week or so), but the
+# web page used to ask for the stops in the exact area of the map every
+# time it moved, which no browser or proxy could cache. Instead, the map
+# is cut into the usual slippy map tiles - at zoom z the world is 2^z by
+# 2^z tiles of 256 web mercator pixels, numbered x from the west and y
+# from the north - and the page asks for the tiles the map covers, at
+# URLs with the version of the stops in them, so a tile can be cached
+# for as long as anyone likes.
+#
+# The tiles are all made here when the stops are written, and go in one
+# file next to the database (stopTiles.bin), in the same fixed layout as
+# the snapshot files (see ../snapshotFile.py), so the API just maps it and
+# hands out the bytes. The tile at zoom z has the stops in it that are
+# shown at that zoom (minzoom <= z, see stopLevels.py), most important
+# first, as the JSON the bus stop end point serves out, plus the minzoom
+# of each. Past stopLevels.maxZoom every stop is shown, so the page uses
+# the tiles at that zoom.
+#
+# So a stop is in one tile at every zoom from its minzoom up, and most stops
+# only show up at the highest zooms, but the few shown when zoomed out are
+# repeated at every zoom level after that. To keep the file down, there are
+# only tiles from minTileZoom up - the web pages don't zoom out further than
+# that (see minZoom in configs/*/config.json), and if one did, it would ask
+# the bus stop end point instead. Then a stop is in at most
+# stopLevels.maxZoom - minTileZoom + 1 tiles, rather than one for every
+# zoom from 0.
+
+import json
+import os
+import sys
+
+import numpy as np
+from sqlalchemy import text
+
+# update_db.py imports this as a top level module from this
+# directory, while the tests import it as part of the package.
+try:
+    from . import stopLevels
+    from .. import snapshotFile
+except ImportError:
+    import stopLevels
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import snapshotFile
+
+# The lowest zoom level there are tiles for.
+minTileZoom = 8
+
+# Small function to get the tile a lat, lon is in at a zoom level.
+def tileOf(lat, lon, zoom) :
+    x, y = stopLevels.mercatorPixels(lat, lon, zoom)
+    numTiles = 2 ** zoom
+    return min(max(int(x // 256), 0), numTiles - 1), min(max(int(y // 256), 0), numTiles - 1)
+
+# Small function to pack a tile's zoom, x and y into one number to look it up by.
+def tileKey(zoom, x, y) :
+    return (zoom << 48) | (x << 24) | y
+
+# Make the tiles for a list of stops (dictionaries with the columns of the
+# stops table) that is in order of minzoom, at zoom levels minZoom to
+# maxZoom. Returns the columns of the tile file - the zoom levels, the
+# tile keys, in order, and the JSON of each tile.
+def tileColumns(stops, minZoom=minTileZoom, maxZoom=stopLevels.maxZoom) :
+    tiles = {}
+    for zoom in range(minZoom, maxZoom + 1) :
+        for stop in stops :
+            if stop['minzoom'] > zoom :
+                continue
+            key = tileKey(zoom, *tileOf(stop['lat'], stop['lon'], zoom))
+            tiles.setdefault(key, []).append(stop)
+
+    keys = sorted(tiles.keys())
+    return { "minZoom"  : np.array([ minZoom ], dtype=np.int64),
+             "maxZoom"  : np.array([ maxZoom ], dtype=np.int64),
+             "tileKeys" : np.array(keys, dtype=np.int64),
+             "tiles"    : snapshotFile.stringColumnOf([ tileJSON(tiles[key]) for key in keys ]) }
+
+# Small function to make the JSON for the stops in a tile. It's a list, as
+# the bus stop end point serves them out, so a tile is a drop in replacement.
+def tileJSON(stops) :
+    return "[" + ",".join(json.dumps({ "stopid" : stop['stopid'], "stopname" : stop['stopname'],
+                                       "stopdesc" : stop['stopdesc'], "lat" : stop['lat'],
+                                       "lon" : stop['lon'], "minzoom" : stop['minzoom'] },
+                                     ensure_ascii=False, separators=(',', ':'))
+                          for stop in stops) + "]"
+
+# Make the tile file for the stops database the engine is on, from the stops in it.
+# The generation and update time of the stops are the tiles' version. Returns
+# the path of the tile file. update_db.py calls this after it writes the stops.
+#
+# As for the snapshot file, if it fails, the old tile file is removed, so that
+# the API stops serving out the old stops (the web page goes back to the bus
+# stop end point), and the exception is passed on.
+def publishStopTiles(engine) :
+    path = os.path.join(os.path.dirname(os.path.abspath(engine.url.database)), snapshotFile.stopTileFileName)
+    published = False
+    try :
+        with engine.connect() as conn :
+            generation, updatetime = snapshotFile.readPublished(conn)
+            rows = conn.execute(text("SELECT stopid, stopname, stopdesc, lat, lon, minzoom FROM stops "
+                                     "ORDER BY minzoom, rowid")).mappings().fetchall()
+        snapshotFile.writeSnapshotFile(path, generation, updatetime, tileColumns([ dict(row) for row in rows ]))
+        published = True
+    finally :
+        if not published :
+            for stale in [ path, path + ".tmp" ] :
+                if os.path.exists(stale) :
+                    os.remove(stale)
+    return path
@@ -26,6 +26,7 @@
 #	stopdesc VARCHAR NOT NULL, 
 #	lat FLOAT NOT NULL, 
 #	lon FLOAT NOT NULL, 
+#	minzoom INTEGER DEFAULT '0' NOT NULL, 
 #	PRIMARY KEY (stopid), 
 #	CONSTRAINT unique_constraint UNIQUE (stopid)
 # );
@@ -35,51 +36,47 @@
 #	stopdesc VARCHAR NOT NULL, 
 #	lat FLOAT NOT NULL, 
 #	lon FLOAT NOT NULL, 
+#	minzoom INTEGER DEFAULT '0' NOT NULL, 
 #	PRIMARY KEY (stopid), 
 #	CONSTRAINT unique_constraint UNIQUE (stopid)
 # );
+# CREATE VIRTUAL TABLE stops_rtree USING rtree(id, minLat, maxLat, minLon, maxLon);
+#
+# The stops_rtree table is an sqlite R*Tree spatial index on the
+# stops table - id is the rowid of the stop in the stops table, and since
+# a stop is a point, minLat=maxLat=lat and minLon=maxLon=lon. The API uses
+# it to find the stops in the map viewport without looking at every stop.
+#
+# minzoom is the lowest map zoom level at which the stop is shown, worked
+# out here (see stopLevels.py) so that the stops shown at each zoom level
+# are spread evenly over the map, with parent stations first.
 #
 # First we read the file. Then
 # we delete everything in the database table stops_update,
 # then we write the file information into
-# stops_update, then make a marker file that marks the database
-# as being offline, then delete everything in the stops table,
-# then copy from stops_update into stops (faster so that the
-# database is only offline for a moment).
+# stops_update, then in one transaction delete everything in
+# the stops table and copy from stops_update into stops. The
+# database runs in WAL mode, so readers keep seeing the old
+# stops until that transaction commits. The spatial index is rebuilt
+# in that same transaction, so it always agrees with the stops table.
 
 import argparse
 import os
 import sys
 import pprint
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine, UniqueConstraint, Column, String, Float
-from pathlib import Path
-from sqlalchemy import insert, select
-import time
-
-
-# The name of the marker file that indicates that the database is offline.
-marker_file="db_offline.marker"
-
-# Small function to write the marker file that marks the DB as being offline
-# to the rest of this system.
-# The file does not need content, it simply must exist.
-def put_db_offline() :
-    print("Taking database offline and waiting for clients to finish...")
-    Path(marker_file).touch()
-    # Sleep to allow clients to finish
-    time.sleep(2)
-    return
-
-# Small function to put the database back online to the rest of this system.
-# It just removes the marker file.
-def put_db_online() :
-    print("Putting database back online")
-    if os.path.exists(marker_file):
-        os.remove(marker_file)
-    else :
-        print("Went to put database back online... and found that it already was?")
-    return
+from sqlalchemy import create_engine, UniqueConstraint, Column, String, Float, Integer
+from sqlalchemy import insert, select, text, inspect
+from sqlalchemy.exc import SQLAlchemyError
+
+import stopLevels
+
+# The snapshot file the API maps is written the same way for every feed,
+# and the generation table and WAL mode are the same too.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import snapshotFile
+import feedGeneration
+import stopTiles
 
 # Parse command line args.
 parser = argparse.ArgumentParser(description='Update the database of bus stops.')
@@ -103,6 +100,7 @@ stop_list = []
 line_num=0
 indicies={}
 stop_id_list = []
+parent_stations = set()
 
 for line in lines_list :
     line_num += 1
@@ -120,6 +118,10 @@ for line in lines_list :
 
         for item in desired_items :
             indicies[item] = hdr_list.index(item)
+        # Older files don't have parent stations.
+        for item in [ 'parent_station', 'location_type' ] :
+            if item in hdr_list :
+                indicies[item] = hdr_list.index(item)
         print("Indicies from header line : ")
         pprint.pprint(indicies)
         # OK, done with first line.
@@ -143,6 +145,12 @@ for line in lines_list :
         print(f"Skipping line {line_num} of {args.stopFile} as could not convert '{items[indicies['stop_lon']]} to a float for longitude.")
         continue
 
+    # Note the parent stations, which are shown first when zoomed out.
+    if 'parent_station' in indicies and len(items[indicies['parent_station']].strip()) > 0 :
+        parent_stations.add(items[indicies['parent_station']].strip())
+    if 'location_type' in indicies and items[indicies['location_type']].strip() == '1' :
+        parent_stations.add(items[indicies['stop_id']])
+
     if items[indicies['stop_id']] in stop_id_list :
         print(f"Skipping line {line_num} of {args.stopFile} as stop id {items[indicies['stop_id']]} is a duplicate (parent station?)")
         continue
@@ -150,7 +158,10 @@ for line in lines_list :
 
     d = { "stopid":items[indicies['stop_id']], "stopname":items[indicies['stop_name']], "stopdesc":items[indicies['stop_desc']], "lat":lat, "lon":lon }
     stop_list.append(d)
-    
+
+# Work out the zoom level from which each stop is shown.
+stopLevels.assignMinZooms(stop_list, parent_stations)
+
 if args.verbose :
     pprint.pprint(stop_list)
 
@@ -167,6 +178,7 @@ class stopsTable(Base):
     stopdesc = Column(String, nullable=False)
     lat      = Column(Float,  nullable=False)
     lon      = Column(Float,  nullable=False)
+    minzoom  = Column(Integer, nullable=False, server_default='0')
     __table_args__ = (UniqueConstraint('stopid', name='unique_constraint'),)
 
 class stopsTableUpdate(Base):
@@ -176,11 +188,36 @@ class stopsTableUpdate(Base):
     stopdesc = Column(String, nullable=False)
     lat      = Column(Float,  nullable=False)
     lon      = Column(Float,  nullable=False)
+    minzoom  = Column(Integer, nullable=False, server_default='0')
     __table_args__ = (UniqueConstraint('stopid', name='unique_constraint'),)
 
+# The generation of the stops, which update_db.py bumps every time
+# it writes them and the API uses to tell if they have changed.
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
+# The spatial index on the stops table. This is an sqlite virtual
+# table, which the ORM can't make for us, so it's done in SQL.
+createRtree = "CREATE VIRTUAL TABLE IF NOT EXISTS stops_rtree USING rtree(id, minLat, maxLat, minLon, maxLon)"
+
 # Get the engine.
 engine = create_engine("sqlite:///database.db", echo=False)
 
+# In write-ahead log (WAL) mode, see ../feedGeneration.py.
+feedGeneration.useWAL(engine)
+
+# Make the spatial index and the generation table
+# if this database doesn't have them yet.
+with engine.begin() as conn :
+    conn.execute(text(createRtree))
+generationTable.__table__.create(engine, checkfirst=True)
+
+# Databases made before the stops had a minimum zoom get the column.
+with engine.begin() as conn :
+    for table in [ 'stops', 'stops_update' ] :
+        if 'minzoom' not in [ column['name'] for column in inspect(conn).get_columns(table) ] :
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN minzoom INTEGER NOT NULL DEFAULT 0"))
+
 # Delete all entries in the stops_update table.
 Session = sessionmaker(bind=engine)
 session = Session()
@@ -208,30 +245,55 @@ if not ok :
     print("Failed to insert into stops update table.")
     sys.exit(-1)
 
-# OK, if we got to here then the new data are in stopsTableUpdate and
-# the old data are in stopsTable. We write a marker file to pull the
-# database offline, then delete the old data in stopsTable, then
-# copy the new data from stopsTableUpdate into stopsTable.
+# ...and then, in one transaction, delete what we have in the "real" table
+# and copy the update table into it. Readers keep seeing the old data until
+# the transaction commits, and if anything goes wrong it is rolled back and
+# they keep seeing the old data, so the database never has to go offline.
 
-# Take the database offline while we do this.
-put_db_offline()
-
-# Delete everything in the current stops table.
-session.query(stopsTable).delete(synchronize_session=False)
-session.commit()
-
-# Copy from stopsTableUpdate to stopsTable.
-# Make a select statement on stopsUpdateTable...
+# Copy from the update table to the "real" table.
+# Make a select statement on update table...
 select_stmt = select(stopsTableUpdate)
-# ...and use that select statement in an insert statement on stopsTable
+# ...and use that select statement in an insert statement on the "real" table.
 insert_stmt = insert(stopsTable).from_select(
     stopsTable.__table__.columns.keys(), select_stmt
 )
-session.execute(insert_stmt)
-session.commit()
 
-# Put the database back online.
-put_db_online()
+try:
+    with Session() as session, session.begin() :
+        # Delete everything in the current "real" table...
+        session.query(stopsTable).delete(synchronize_session=False)
+        # ...and copy the update table in.
+        session.execute(insert_stmt)
+        # Then rebuild the spatial index from the new stops.
+        session.execute(text("DELETE FROM stops_rtree"))
+        session.execute(text("INSERT INTO stops_rtree (id, minLat, maxLat, minLon, maxLon) "
+                             "SELECT rowid, lat, lat, lon, lon FROM stops"))
+        # And bump the generation so the API knows the stops changed.
+        # The stops file has no feed timestamp, so that is left at zero.
+        feedGeneration.publishGeneration(session, generationTable, 0)
+
+except SQLAlchemyError as e:
+    print(f"Error copying update into table : {e}")
+    sys.exit(-1)
+
+# Now the new stops are committed, write the snapshot
+# file the API maps (see ../snapshotFile.py) and the
+# slippy map tiles of the stops (see stopTiles.py). Both
+# are tried, so that if one fails, the other isn't left
+# with the old stops in it (so whatever goes wrong with
+# the first, the second is still tried).
+failed = False
+for publish in [ lambda : snapshotFile.publishSnapshot(engine, snapshotFile.readStopColumns),
+                 lambda : stopTiles.publishStopTiles(engine) ] :
+    try:
+        publish()
+
+    except Exception as e: # noqa: BLE001
+        print(f"Error writing the snapshot file or the tiles : {e}")
+        failed = True
+
+if failed :
+    sys.exit(-1)
 
 print("Success!")
 
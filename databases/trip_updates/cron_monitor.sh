@@ -65,6 +65,16 @@ then
  exit 0
 fi
 
+# If feedPoller.py is polling this agency's feeds (see ../pollFeeds.sh),
+# it's the one writing the database, so don't start another writer.
+fullEnvFile=`readlink -f "$envFile"`
+numPolling=`ps aux | grep "$un" | grep feedPoller.py | grep -F "$fullEnvFile" | grep -v grep | wc -l`
+if [ "$numPolling" -ne 0 ]
+then
+ echo Polled by feedPoller.py, not starting
+ exit 0
+fi
+
 echo Starting
 ./fetchTripUpdates.sh $envFile $BFR_AGENCY_NAME &> /dev/null &
 
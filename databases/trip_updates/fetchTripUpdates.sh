@@ -20,70 +20,34 @@ fi
 
 source "$envFile"
 
-cd "$BFR_TOP_DIR"/databases/trip_updates
-
-while [ 1 -eq 1 ]
-do
-
- # Re-source the env file for realtime updates
- source "$envFile"
-
- # Stop if the stop maker is present
- if [ -f "stop.marker" ]
- then
-  echo Stopping...
-  exit 0
- fi
+# The ingest process is run from the feed directory, so
+# make sure it gets the full path to the environment file.
+envFile=`readlink -f "$envFile"`
 
- # Hold if the hold marker is present
- while [ -f "hold.marker" ]
- do
-  echo Holding...
-  sleep 1
- done
-
- # Create the database if it does not exist
- if [ ! -f "database.db" ]
- then
-  uv run ./init_db.py
-  status="$?"
-  if [ "$status" -ne 0 ]
-  then
-   echo Failed to init db
-   exit -1
-  fi
- fi
-
- startTm=`date --utc +%s`
+cd "$BFR_TOP_DIR"/databases/trip_updates
 
- uv run update_db.py --url "$BFR_TRIPS_URL"
+# Create the database if it does not exist
+if [ ! -f "database.db" ]
+then
+ uv run ./init_db.py
  status="$?"
  if [ "$status" -ne 0 ]
  then
-  echo Failed to update db
+  echo Failed to init db
   exit -1
  fi
+fi
 
- # Write a file so we know when we last updated and how long it took.
- endTm=`date --utc +%s`
- endDt=`date --date=@"$endTm" +"%Y/%m/%d %H:%M:%S %Z"`
- durationSec=`expr "$endTm" - "$startTm"`
-
- echo {\"updated\":\""$endDt"\", \"utim\":"$endTm", \"durationSec\":"$durationSec" } > updated.time
- cat updated.time
-
- # Calculate roughly how long we should sleep for in order to
- # meet the polling spec. 
- sleepSec=`expr "$BFR_TRIP_POLL" - "$durationSec"`
- if [ "$sleepSec" -gt 0 ]
- then
-  echo Sleeping for $sleepSec seconds
-  sleep "$sleepSec"
- fi
-
- echo
-
-done # End of eternal loop
+# Run the long running ingest process. It polls the feed, handles the
+# stop.marker and hold.marker files, re-reads the environment file
+# every cycle and writes updated.time, so this script just waits on it
+# (staying in the process list so that cron_monitor.sh can see we're running).
+uv run ../feedDaemon.py --feed trip_updates --envFile "$envFile"
+status="$?"
+if [ "$status" -ne 0 ]
+then
+ echo Ingest process failed
+ exit -1
+fi
 
 exit 0
-
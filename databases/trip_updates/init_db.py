@@ -2,12 +2,17 @@
 
 # Initialize the database.
 
-from sqlalchemy import create_engine, Column, String, Integer
+from sqlalchemy import create_engine, Index, Column, String, Integer
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.dialects.mysql import BIGINT
+import os
 import sys
 
+# The generation table and WAL mode are the same for every feed's database.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import feedGeneration
+
 # Make the table.
 Base = declarative_base()
 
@@ -18,6 +23,9 @@ class tripsTable(Base):
     schedule_relationship = Column(Integer, nullable=False)
     arrivaltime    = Column(BIGINT(unsigned=True), nullable=False)
     stopid         = Column(String,   nullable=False)
+    # Covering index for the trip service, which looks up the arrivals
+    # at a stop in time order and only wants the route and arrival time.
+    __table_args__ = (Index('stop_arrival_index', 'stopid', 'arrivaltime', 'route'),)
 
 class tripsUpdateTable(Base):
     __tablename__='intrepid_trips_update'
@@ -27,6 +35,11 @@ class tripsUpdateTable(Base):
     arrivaltime    = Column(BIGINT(unsigned=True), nullable=False)
     stopid         = Column(String,   nullable=False)
 
+# The generation of the trip updates, which update_db.py bumps every
+# time it writes them and the API uses to tell if they have changed.
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
 
 # Create the database.
 # Had to install sqlalchemy_utils to do this.
@@ -45,5 +58,9 @@ engine.echo=True
 Base.metadata.create_all(engine)
 engine.echo=False
 
+# Run in write-ahead log (WAL) mode so that readers are never blocked
+# while update_db.py swaps in new data, see ../feedGeneration.py.
+feedGeneration.useWAL(engine)
+
 sys.exit(0)
 
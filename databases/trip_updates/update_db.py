@@ -1,83 +1,30 @@
 #!/usr/bin/env python
 
+# Fetch the trip updates feed and write it to the database.
+#
+# This can be run once from the command line :
+#   ./update_db.py --url "$BFR_TRIPS_URL"
+# or the functions in here can be used by a long running process
+# (see ../feedDaemon.py) that keeps its HTTP session and database
+# engine between polls rather than starting up from scratch every time.
+
 # Do the imports.
 from google.transit import gtfs_realtime_pb2
 import requests
 import argparse
+import os
 import sys
+import time
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine, Column, String, Integer
-from pathlib import Path
+from sqlalchemy import create_engine, Index, Column, String, Integer
 from sqlalchemy import insert, select
 from sqlalchemy.dialects.mysql import BIGINT
-import time
-import os
-
-# The name of the marker file that indicates that the database is offline.
-marker_file="db_offline.marker"
-
-# Small function to write the marker file that marks the DB as being offline
-# to the rest of this system.
-# The file does not need content, it simply must exist.
-def put_db_offline() :
-    print("Taking database offline and waiting for clients to finish...")
-    Path(marker_file).touch()
-    # Sleep to allow clients to finish
-    time.sleep(2)
-    return
 
-# Small function to put the database back online to the rest of this system.
-# It just removes the marker file.
-def put_db_online() :
-    print("Putting database back online")
-    if os.path.exists(marker_file):
-        os.remove(marker_file)
-    else :
-        print("Went to put database back online... and found that it already was?")
-    return
-
-
-
-
-# Get the URL from the url argument.
-parser = argparse.ArgumentParser(description='Dump realtime transport data from RTD.')
-parser.add_argument('--url', required=True, type=str, help='The RTD URL to dump.')
-args = parser.parse_args()
-
-# Initialize a FeedMessage object
-feed = gtfs_realtime_pb2.FeedMessage()
-
-# Get the URL from the --url option on the command line.
-url = args.url
-
-# Fetch and parse the data
-try:
-    response = requests.get(url, timeout=10)
-    response.raise_for_status() # Raise an exception for bad status codes
-    feed.ParseFromString(response.content)
-
-except requests.exceptions.RequestException as e:
-    print(f"Error fetching data: {e}")
-    sys.exit(-1)
-
-# Iterate over the entities and print information
-print(f"There are {len(feed.entity)} entities in the feed {args.url}")
-
-
-tripList = []
-for entity in feed.entity:
-    # Print different types of data based on what the entity contains
-
-    if entity.HasField('trip_update'):
-        for stu in entity.trip_update.stop_time_update :
-
-            d={}
-            d['route']                  = entity.trip_update.trip.route_id
-            d['schedule_relationship']  = stu.schedule_relationship
-            d['arrivaltime']            = stu.arrival.time
-            d['stopid']                 =   stu.stop_id
-
-            tripList.append(d)
+# The snapshot file the API maps is written the same way for every feed,
+# and the generation table and WAL mode are the same too.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import snapshotFile
+import feedGeneration
 
 Base = declarative_base()
 
@@ -88,6 +35,9 @@ class tripsTable(Base):
     schedule_relationship = Column(Integer, nullable=False)
     arrivaltime    = Column(BIGINT(unsigned=True), nullable=False)
     stopid         = Column(String,   nullable=False)
+    # Covering index for the trip service, which looks up the arrivals
+    # at a stop in time order and only wants the route and arrival time.
+    __table_args__ = (Index('stop_arrival_index', 'stopid', 'arrivaltime', 'route'),)
 
 class tripsUpdateTable(Base):
     __tablename__='intrepid_trips_update'
@@ -97,62 +47,146 @@ class tripsUpdateTable(Base):
     arrivaltime    = Column(BIGINT(unsigned=True), nullable=False)
     stopid         = Column(String,   nullable=False)
 
-engine = create_engine("sqlite:///database.db", echo=False)
-
-# Delete all entries in the update table.
-Session = sessionmaker(bind=engine)
-session = Session()
-session.query(tripsUpdateTable).delete(synchronize_session=False)
-session.commit()
-
-# Insert what we have in our list that we just got into the update table.
-ok=False
-try:
-    # Use bulk_insert_mappings (more efficient for large datasets)
-    session.bulk_insert_mappings(tripsUpdateTable, tripList)
-    session.commit()
-    print("Data inserted into update successfully.")
-    ok=True
-
-except Exception as e:
-    session.rollback() # Rollback on error
-    print(f"Error inserting data into update : {e}")
-    ok=False
-
-finally:
-    session.close()
+# A single row table that the API reads to tell when the trip updates have
+# changed. The generation goes up by one every time we write new trip updates
+# (in the same transaction), and feedtime and updatetime are the feed
+# header timestamp and when we wrote it.
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
+# Get the database engine.
+def makeEngine(db_file="database.db") :
+    engine = create_engine("sqlite:///" + db_file, echo=False)
+
+    # In write-ahead log (WAL) mode, see ../feedGeneration.py.
+    feedGeneration.useWAL(engine)
+
+    # Make the tables if they aren't there yet. Databases made before
+    # the trip service had its index get it here (create_all only makes
+    # indexes along with new tables). Does nothing if it's already there.
+    Base.metadata.create_all(engine)
+    for index in tripsTable.__table__.indexes :
+        index.create(engine, checkfirst=True)
+
+    return engine
+
+# Fetch the feed from the URL. The HTTP session can be passed in
+# so that a long running process can keep its connection open
+# between polls. Raises requests.exceptions.RequestException on failure.
+def fetchFeed(url, httpSession=requests) :
+    response = httpSession.get(url, timeout=10)
+    response.raise_for_status() # Raise an exception for bad status codes
+    return response.content
+
+# Parse the raw feed into a FeedMessage object.
+def parseFeed(content) :
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+    print(f"There are {len(feed.entity)} entities in the feed")
+    return feed
+
+# Turn the feed into a list of dictionaries, one per stop time update,
+# with keys having the same names as the database columns.
+#
+# Stop time updates with no arrival time (zero) or with an arrival
+# time that has already gone by are dropped - the trip service would
+# never serve them out, and a feed carries a lot of them, so leaving
+# them out keeps the table (and its index) small.
+def feedRows(feed, now=None) :
+
+    if now is None :
+        now = int(time.time())
+
+    tripList = []
+    numPruned = 0
+    for entity in feed.entity:
+
+        if entity.HasField('trip_update'):
+            for stu in entity.trip_update.stop_time_update :
+
+                if stu.arrival.time == 0 or stu.arrival.time < now :
+                    numPruned += 1
+                    continue
+
+                d={}
+                d['route']                  = entity.trip_update.trip.route_id
+                d['schedule_relationship']  = stu.schedule_relationship
+                d['arrivaltime']            = stu.arrival.time
+                d['stopid']                 =   stu.stop_id
+
+                tripList.append(d)
+
+    print(f"Kept {len(tripList)} stop time updates, dropped {numPruned} with no or past arrival times")
+    return tripList
+
+# Write the list of trip updates to the database. The generation in the
+# feed_generation table is bumped in the same transaction that swaps the
+# new trip updates in, and once that has committed the snapshot file
+# for the API is written. Raises an exception on failure.
+def writeDatabase(engine, tripList, feedTimestamp=0) :
+
+    # Delete all entries in the update table and insert
+    # what we have in our list into it.
+    Session = sessionmaker(bind=engine)
+    with Session() as session, session.begin() :
+        session.query(tripsUpdateTable).delete(synchronize_session=False)
+        # Use bulk_insert_mappings (more efficient for large datasets)
+        session.bulk_insert_mappings(tripsUpdateTable, tripList)
+
+    # ...and then, in one transaction, delete what we have in the "real" table
+    # and copy the update table into it. Readers keep seeing the old data until
+    # the transaction commits, and if anything goes wrong it is rolled back and
+    # they keep seeing the old data, so the database never has to go offline.
+
+    # Copy from the update table to the "real" table.
+    # Make a select statement on update table...
+    select_stmt = select(tripsUpdateTable)
+    # ...and use that select statement in an insert statement on the "real" table.
+    insert_stmt = insert(tripsTable).from_select(
+        tripsTable.__table__.columns.keys(), select_stmt
+    )
+
+    with Session() as session, session.begin() :
+        # Delete everything in the current "real" table...
+        session.query(tripsTable).delete(synchronize_session=False)
+        # ...and copy the update table in.
+        session.execute(insert_stmt)
+        feedGeneration.publishGeneration(session, generationTable, feedTimestamp)
+
+    # Now it's committed, write the snapshot file the API maps,
+    # with the arrivals grouped by stop (see ../snapshotFile.py).
+    snapshotFile.publishSnapshot(engine, snapshotFile.readArrivalColumns)
 
-if not ok :
-    print("Failed to insert into stops update table.")
-    sys.exit(-1)
+    return
 
-# ...and then pull the database offline, delete what we have in
-# our "real" table, and then copy the update table into the "real" table,
-# and finally put the DB back online.
+def main() :
 
-# Put the database offline
-put_db_offline()
+    # Get the URL from the url argument.
+    parser = argparse.ArgumentParser(description='Dump realtime transport data from RTD.')
+    parser.add_argument('--url', required=True, type=str, help='The RTD URL to dump.')
+    args = parser.parse_args()
 
-# Delete everything in the current "real" table.
-session.query(tripsTable).delete(synchronize_session=False)
-session.commit()
+    # Fetch the data
+    try:
+        content = fetchFeed(args.url)
 
-# Copy from the update table to the "real" table.
-# Make a select statement on update table...
-select_stmt = select(tripsUpdateTable)
-# ...and use that select statement in an insert statement on the "real" table.
-insert_stmt = insert(tripsTable).from_select(
-    tripsTable.__table__.columns.keys(), select_stmt
-)
-session.execute(insert_stmt)
-session.commit()
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data: {e}")
+        sys.exit(-1)
 
-# Put the database back online.
-put_db_online()
+    feed = parseFeed(content)
+    tripList = feedRows(feed)
 
-print("Success!")
+    try:
+        writeDatabase(makeEngine(), tripList, feed.header.timestamp)
 
-sys.exit(0)
+    except Exception as e:
+        print(f"Error writing data to database : {e}")
+        sys.exit(-1)
 
+    print("Success!")
 
+    sys.exit(0)
 
+if __name__ == "__main__" :
+    main()
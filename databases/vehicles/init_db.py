@@ -2,18 +2,24 @@
 
 # Initialize the database.
 
-from sqlalchemy import create_engine, Column, String, Float, Integer
+from sqlalchemy import create_engine, Column, String, Float, Integer, Index
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.dialects.mysql import BIGINT
+import os
 import sys
 
+# The generation table and WAL mode are the same for every feed's database.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import feedGeneration
+
 # Make the table.
 Base = declarative_base()
 
 class vehiclesTable(Base):
     __tablename__='vehicles'
-    id             = Column(Integer, nullable=False, primary_key=True)
+    vehicleid      = Column(String,  nullable=False, primary_key=True)
+    tripid         = Column(String,  nullable=False)
     route          = Column(String,  nullable=False)
     schedule_relationship = Column(Integer, nullable=False)
     direction_id   = Column(Integer, nullable=False)
@@ -22,19 +28,21 @@ class vehiclesTable(Base):
     lat            = Column(Float,   nullable=False)
     lon            = Column(Float,   nullable=False)
     bearing        = Column(Float,   nullable=False)
+    __table_args__ = (Index('vehicle_route_index', 'route'),)
 
-class vehiclesUpdateTable(Base):
-    __tablename__='vehicles_update'
-    id             = Column(Integer, nullable=False, primary_key=True)
-    route          = Column(String,  nullable=False)
-    schedule_relationship = Column(Integer, nullable=False)
-    direction_id   = Column(Integer, nullable=False)
-    current_status = Column(Integer, nullable=False)
-    timestamp      = Column(BIGINT(unsigned=True), nullable=False)
-    lat            = Column(Float,   nullable=False)
-    lon            = Column(Float,   nullable=False)
-    bearing        = Column(Float,   nullable=False)
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
 
+class changesTable(Base):
+    __tablename__='vehicle_changes'
+    generation     = Column(Integer, nullable=False, primary_key=True)
+    vehicleid      = Column(String,  nullable=False, primary_key=True)
+    updatetime     = Column(BIGINT(unsigned=True), nullable=False)
+
+class routesTable(Base):
+    __tablename__='vehicle_routes'
+    route          = Column(String,  nullable=False, primary_key=True)
+    vehicles       = Column(Integer, nullable=False)
 
 # Create the database.
 # Had to install sqlalchemy_utils to do this.
@@ -53,5 +61,9 @@ engine.echo=True
 Base.metadata.create_all(engine)
 engine.echo=False
 
+# Run in write-ahead log (WAL) mode so that readers are never blocked
+# while update_db.py swaps in new data, see ../feedGeneration.py.
+feedGeneration.useWAL(engine)
+
 sys.exit(0)
 
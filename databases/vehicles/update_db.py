@@ -1,70 +1,130 @@
 #!/usr/bin/env python
 
+# Fetch the vehicle positions feed and write it to the database.
+#
+# This can be run once from the command line :
+#   ./update_db.py --url "$BFR_VEHICLES_URL"
+# or the functions in here can be used by a long running process
+# (see ../feedDaemon.py) that keeps its HTTP session and database
+# engine between polls rather than starting up from scratch every time.
+
 # Do the imports.
 from google.transit import gtfs_realtime_pb2
 import requests
 import argparse
+import os
 import sys
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine, Column, String, Float, Integer
-from pathlib import Path
-from sqlalchemy import insert, select
+from sqlalchemy import create_engine, Column, String, Float, Integer, Index
+from sqlalchemy import inspect, select
 from sqlalchemy.dialects.mysql import BIGINT
-import time
-import os
-
-# The name of the marker file that indicates that the database is offline.
-marker_file="db_offline.marker"
-
-# Small function to write the marker file that marks the DB as being offline
-# to the rest of this system.
-# The file does not need content, it simply must exist.
-def put_db_offline() :
-    print("Taking database offline and waiting for clients to finish...")
-    Path(marker_file).touch()
-    # Sleep to allow clients to finish
-    time.sleep(2)
-    return
-
-# Small function to put the database back online to the rest of this system.
-# It just removes the marker file.
-def put_db_online() :
-    print("Putting database back online")
-    if os.path.exists(marker_file):
-        os.remove(marker_file)
-    else :
-        print("Went to put database back online... and found that it already was?")
-    return
-
 
+# The snapshot file the API maps is written the same way for every feed,
+# and the generation table and WAL mode are the same too.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import snapshotFile
+import feedGeneration
 
+Base = declarative_base()
 
-# Get the URL from the url argument.
-parser = argparse.ArgumentParser(description='Dump realtime transport data from RTD.')
-parser.add_argument('--url', required=True, type=str, help='The RTD URL to dump.')
-args = parser.parse_args()
-
-# Initialize a FeedMessage object
-feed = gtfs_realtime_pb2.FeedMessage()
-
-# Get the URL from the --url option on the command line.
-url = args.url
-
-# Fetch and parse the data
-try:
-    response = requests.get(url, timeout=10)
+# Vehicles are keyed by the vehicle ID from the feed, so that each
+# cycle we can update just the vehicles that changed rather than
+# rewriting the whole table.
+class vehiclesTable(Base):
+    __tablename__='vehicles'
+    vehicleid      = Column(String,  nullable=False, primary_key=True)
+    tripid         = Column(String,  nullable=False)
+    route          = Column(String,  nullable=False)
+    schedule_relationship = Column(Integer, nullable=False)
+    direction_id   = Column(Integer, nullable=False)
+    current_status = Column(Integer, nullable=False)
+    timestamp      = Column(BIGINT(unsigned=True), nullable=False)
+    lat            = Column(Float,   nullable=False)
+    lon            = Column(Float,   nullable=False)
+    bearing        = Column(Float,   nullable=False)
+    # Index on the route, so the vehicles on a few routes can
+    # be found without looking at every vehicle.
+    __table_args__ = (Index('vehicle_route_index', 'route'),)
+
+# A single row table that the API reads to tell when the vehicles have
+# changed. The generation goes up by one every time we write a change to
+# the vehicles table (in the same transaction), and feedtime and
+# updatetime are the feed header timestamp and when we wrote it.
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
+# The vehicles that changed (were inserted, updated or deleted) in each
+# of the last few generations, so that the API can send a client just
+# what changed since the generation it last saw. It's a ring - only the
+# last changeRingSize generations are kept (BFR_VEHICLE_CHANGE_RING,
+# default 20, which a long running ingest takes from the agency's
+# environment file every cycle, see writeOptions). updatetime is the same as in the feed_generation table for
+# that generation, so a client's token from a database that has since been
+# rebuilt (and started counting generations again) won't match.
+changeRingSize = int(os.getenv('BFR_VEHICLE_CHANGE_RING', '20'))
+
+class changesTable(Base):
+    __tablename__='vehicle_changes'
+    generation     = Column(Integer, nullable=False, primary_key=True)
+    vehicleid      = Column(String,  nullable=False, primary_key=True)
+    updatetime     = Column(BIGINT(unsigned=True), nullable=False)
+
+# The routes that have vehicles on them and how many, worked out every
+# time the vehicles change (in the same transaction), for the API's
+# list of the routes that are running.
+class routesTable(Base):
+    __tablename__='vehicle_routes'
+    route          = Column(String,  nullable=False, primary_key=True)
+    vehicles       = Column(Integer, nullable=False)
+
+# Get the database engine.
+def makeEngine(db_file="database.db") :
+    engine = create_engine("sqlite:///" + db_file, echo=False)
+
+    # In write-ahead log (WAL) mode, see ../feedGeneration.py.
+    feedGeneration.useWAL(engine)
+
+    # Databases made before vehicles were keyed by vehicle ID have
+    # an integer id column and a vehicles_update table instead. The
+    # vehicle table is rebuilt from the feed every cycle anyway,
+    # so just drop the old tables and make the new one.
+    inspector = inspect(engine)
+    if inspector.has_table('vehicles') :
+        columns = [ column['name'] for column in inspector.get_columns('vehicles') ]
+        if 'vehicleid' not in columns :
+            print("Rebuilding vehicles table keyed by vehicle ID")
+            with engine.begin() as conn :
+                conn.exec_driver_sql("DROP TABLE IF EXISTS vehicles")
+                conn.exec_driver_sql("DROP TABLE IF EXISTS vehicles_update")
+    Base.metadata.create_all(engine)
+
+    # Databases made before the route index get it here.
+    for index in vehiclesTable.__table__.indexes :
+        index.create(engine, checkfirst=True)
+
+    return engine
+
+# Fetch the feed from the URL. The HTTP session can be passed in
+# so that a long running process can keep its connection open
+# between polls. Raises requests.exceptions.RequestException on failure.
+def fetchFeed(url, httpSession=requests) :
+    response = httpSession.get(url, timeout=10)
     response.raise_for_status() # Raise an exception for bad status codes
-    feed.ParseFromString(response.content)
+    return response.content
 
-except requests.exceptions.RequestException as e:
-    print(f"Error fetching data: {e}")
-    sys.exit(-1)
-
-# Iterate over the entities and print information
-print(f"There are {len(feed.entity)} entities in the feed {args.url}")
+# Parse the raw feed into a FeedMessage object.
+def parseFeed(content) :
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+    print(f"There are {len(feed.entity)} entities in the feed")
+    return feed
 
+# Turn the feed into a list of dictionaries, one per vehicle.
+#
 # Database table looks like :
-# CREATE TABLE vehicles_update (
+# CREATE TABLE vehicles (
+#	vehicleid VARCHAR NOT NULL, 
+#	tripid VARCHAR NOT NULL, 
 #	route VARCHAR NOT NULL, 
 #	schedule_relationship INTEGER NOT NULL, 
 #	direction_id INTEGER NOT NULL, 
@@ -73,109 +133,151 @@ print(f"There are {len(feed.entity)} entities in the feed {args.url}")
 #	lat FLOAT NOT NULL, 
 #	lon FLOAT NOT NULL, 
 #	bearing FLOAT NOT NULL, 
-#	PRIMARY KEY (route)
+#	PRIMARY KEY (vehicleid)
 # )
+# CREATE INDEX vehicle_route_index ON vehicles (route)
 # So the dictionaries in our list should have those keys.
+def feedRows(feed) :
+
+    vehicleList = []
+    for entity in feed.entity:
+
+        if entity.HasField('vehicle'):
+            d={}
+            # Use the vehicle ID, or the entity ID if the agency didn't fill that in.
+            d['vehicleid']      = entity.vehicle.vehicle.id or entity.id
+            d['tripid']         = entity.vehicle.trip.trip_id
+            d['route']          = entity.vehicle.trip.route_id
+            d['schedule_relationship']    = entity.vehicle.trip.schedule_relationship
+            d['direction_id']   = entity.vehicle.trip.direction_id
+            d['current_status'] = entity.vehicle.current_status
+            d['timestamp']      = entity.vehicle.timestamp
+            d['lat']            = entity.vehicle.position.latitude
+            d['lon']            = entity.vehicle.position.longitude
+            d['bearing']        = entity.vehicle.position.bearing
+            vehicleList.append(d)
+
+    return vehicleList
+
+# Small function to note which vehicles changed in a generation in the
+# vehicle_changes ring, and drop the generations that fell off the end of it.
+# Called inside the transaction that writes the change.
+def recordChanges(session, published, vehicleIDs, ringSize) :
+    session.bulk_insert_mappings(changesTable, [ { 'generation' : published.generation, 'vehicleid' : vid,
+                                                   'updatetime' : published.updatetime } for vid in vehicleIDs ])
+    session.query(changesTable).filter(changesTable.generation <= published.generation - ringSize).delete(synchronize_session=False)
+    return
 
-vehicleList = []
-for entity in feed.entity:
-    # Print different types of data based on what the entity contains
-
-    if entity.HasField('vehicle'):
-        d={}
-        d['route']          = entity.vehicle.trip.route_id
-        d['schedule_relationship']    = entity.vehicle.trip.schedule_relationship
-        d['direction_id']   = entity.vehicle.trip.direction_id
-        d['current_status'] = entity.vehicle.current_status
-        d['timestamp']      = entity.vehicle.timestamp
-        d['lat']            = entity.vehicle.position.latitude
-        d['lon']            = entity.vehicle.position.longitude
-        d['bearing']        = entity.vehicle.position.bearing
-        vehicleList.append(d)
-
-Base = declarative_base()
-
-class vehiclesTable(Base):
-    __tablename__='vehicles'
-    id             = Column(Integer, nullable=False, primary_key=True)
-    route          = Column(String,  nullable=False)
-    schedule_relationship = Column(Integer, nullable=False)
-    direction_id   = Column(Integer, nullable=False)
-    current_status = Column(Integer, nullable=False)
-    timestamp      = Column(BIGINT(unsigned=True), nullable=False)
-    lat            = Column(Float,   nullable=False)
-    lon            = Column(Float,   nullable=False)
-    bearing        = Column(Float,   nullable=False)
-
-class vehiclesUpdateTable(Base):
-    __tablename__='vehicles_update'
-    id             = Column(Integer, nullable=False, primary_key=True)
-    route          = Column(String,  nullable=False)
-    schedule_relationship = Column(Integer, nullable=False)
-    direction_id   = Column(Integer, nullable=False)
-    current_status = Column(Integer, nullable=False)
-    timestamp      = Column(BIGINT(unsigned=True), nullable=False)
-    lat            = Column(Float,   nullable=False)
-    lon            = Column(Float,   nullable=False)
-    bearing        = Column(Float,   nullable=False)
-
-engine = create_engine("sqlite:///database.db", echo=False)
-
-
-# Delete all entries in the update table.
-Session = sessionmaker(bind=engine)
-session = Session()
-session.query(vehiclesUpdateTable).delete(synchronize_session=False)
-session.commit()
-
-# Insert what we have in our list that we just got into the update table.
-ok=False
-try:
-    # Use bulk_insert_mappings (more efficient for large datasets)
-    session.bulk_insert_mappings(vehiclesUpdateTable, vehicleList)
-    session.commit()
-    print("Data inserted into update successfully.")
-    ok=True
-
-except Exception as e:
-    session.rollback() # Rollback on error
-    print(f"Error inserting data into update : {e}")
-    ok=False
-
-finally:
-    session.close()
-
-if not ok :
-    print("Failed to insert into stops update table.")
-    sys.exit(-1)
-
-# ...and then pull the database offline, delete what we have in
-# our "real" table, and then copy the update table into the "real" table,
-# and finally put the DB back online.
-
-# Put the database offline
-put_db_offline()
-
-# Delete everything in the current "real" table.
-session.query(vehiclesTable).delete(synchronize_session=False)
-session.commit()
-
-# Copy from the update table to the "real" table.
-# Make a select statement on update table...
-select_stmt = select(vehiclesUpdateTable)
-# ...and use that select statement in an insert statement on the "real" table.
-insert_stmt = insert(vehiclesTable).from_select(
-    vehiclesTable.__table__.columns.keys(), select_stmt
-)
-session.execute(insert_stmt)
-session.commit()
-
-# Put the database back online.
-put_db_online()
-
-print("Success!")
-
-sys.exit(0)
-
-
+# Small function to rewrite the vehicle_routes table from the vehicles
+# (a dictionary of them, keyed by vehicle ID) as they now are.
+# Called inside the transaction that writes the change.
+def writeRoutes(session, vehicles) :
+    counts = {}
+    for d in vehicles.values() :
+        counts[d['route']] = counts.get(d['route'], 0) + 1
+    session.query(routesTable).delete(synchronize_session=False)
+    session.bulk_insert_mappings(routesTable, [ { 'route' : route, 'vehicles' : count }
+                                                for route, count in sorted(counts.items()) ])
+    return
 
+# Write the list of vehicles to the database. Rather than deleting
+# everything and inserting it all again, we compare what is in the
+# database with the list and only insert the vehicles that are new,
+# update the ones that changed (moved, changed status etc) and delete
+# the ones that are no longer in the feed. That way how much we write,
+# and how long we hold the write lock, goes with how much changed rather
+# than with the size of the fleet.
+#
+# It's all done in one transaction. The database is in WAL mode, so
+# readers keep seeing the old data until the transaction commits,
+# and if anything goes wrong it is rolled back.
+#
+# If anything changed, the generation in the feed_generation table
+# is bumped in the same transaction, which tells the API to reload, the
+# vehicles that changed are noted in the vehicle_changes ring and the
+# vehicle_routes table is brought up to date. Then, once that has
+# committed, the snapshot file the API maps (see ../snapshotFile.py)
+# is written for the new generation (or if there isn't one yet).
+#
+# ringSize is how many generations to keep in the vehicle_changes
+# ring, changeRingSize if it's None.
+#
+# Returns a dictionary with the number of vehicles inserted, updated
+# and deleted. Raises an exception on failure.
+def writeDatabase(engine, vehicleList, feedTimestamp=0, ringSize=None) :
+    if ringSize is None :
+        ringSize = changeRingSize
+
+    # If a vehicle is in the feed more than once, the last one wins.
+    newVehicles = { d['vehicleid'] : d for d in vehicleList }
+
+    columns = vehiclesTable.__table__.columns.keys()
+
+    Session = sessionmaker(bind=engine)
+    with Session() as session, session.begin() :
+
+        # What we have now, keyed by vehicle ID.
+        oldVehicles = {}
+        for row in session.execute(select(vehiclesTable.__table__)).mappings() :
+            oldVehicles[row['vehicleid']] = dict(row)
+
+        inserts = [ d for vid, d in newVehicles.items() if vid not in oldVehicles ]
+        updates = [ d for vid, d in newVehicles.items()
+                    if vid in oldVehicles and any(d[c] != oldVehicles[vid][c] for c in columns) ]
+        deletes = [ vid for vid in oldVehicles if vid not in newVehicles ]
+
+        if len(deletes) > 0 :
+            session.query(vehiclesTable).filter(vehiclesTable.vehicleid.in_(deletes)).delete(synchronize_session=False)
+        if len(inserts) > 0 :
+            session.bulk_insert_mappings(vehiclesTable, inserts)
+        if len(updates) > 0 :
+            session.bulk_update_mappings(vehiclesTable, updates)
+
+        if len(inserts) + len(updates) + len(deletes) > 0 :
+            published = feedGeneration.publishGeneration(session, generationTable, feedTimestamp)
+            recordChanges(session, published, [ d['vehicleid'] for d in inserts + updates ] + deletes, ringSize)
+            writeRoutes(session, newVehicles)
+
+    if len(inserts) + len(updates) + len(deletes) > 0 or not os.path.exists(snapshotFile.snapshotPath(engine)) :
+        snapshotFile.publishSnapshot(engine, snapshotFile.readVehicleColumns)
+
+    return { "inserted" : len(inserts), "updated" : len(updates), "deleted" : len(deletes) }
+
+# Small function to get the settings for writeDatabase out of an agency's
+# environment variables, for a long running ingest (see ../feedDaemon.py)
+# that may be writing the feeds of several agencies.
+def writeOptions(envVars) :
+    return { 'ringSize' : int(envVars.get('BFR_VEHICLE_CHANGE_RING', changeRingSize)) }
+
+def main() :
+
+    # Get the URL from the url argument.
+    parser = argparse.ArgumentParser(description='Dump realtime transport data from RTD.')
+    parser.add_argument('--url', required=True, type=str, help='The RTD URL to dump.')
+    args = parser.parse_args()
+
+    # Fetch the data
+    try:
+        content = fetchFeed(args.url)
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data: {e}")
+        sys.exit(-1)
+
+    feed = parseFeed(content)
+    vehicleList = feedRows(feed)
+
+    try:
+        changes = writeDatabase(makeEngine(), vehicleList, feed.header.timestamp)
+        print(f"Vehicles inserted {changes['inserted']}, updated {changes['updated']}, deleted {changes['deleted']}")
+
+    except Exception as e:
+        print(f"Error writing data to database : {e}")
+        sys.exit(-1)
+
+    print("Success!")
+
+    sys.exit(0)
+
+if __name__ == "__main__" :
+    main()
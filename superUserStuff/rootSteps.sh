@@ -34,3 +34,8 @@ echo systemctl status certbot.timer
 echo
 echo Also put top level HTML and favicon in place.
 echo
+echo For the API cache, copy bussinfr_cache.conf to /etc/nginx/snippets/
+echo and make the cache directory :
+echo mkdir -p /var/cache/nginx/bussinfr
+echo chown www-data /var/cache/nginx/bussinfr
+echo
@@ -44,5 +44,21 @@ do
 done
 echo
 
+# Kill the long running ingest processes started by those scripts
+ps aux | grep "$un" | grep feedDaemon.py | grep -v grep | awk '{print $2}' | while IFS= read -r pid
+do
+ echo Killing feedDaemon.py PID $pid
+ kill -9 "$pid"
+done
+echo
+
+# And the poller that does all the feeds at once, if that's how they're polled
+ps aux | grep "$un" | grep feedPoller.py | grep -v grep | awk '{print $2}' | while IFS= read -r pid
+do
+ echo Killing feedPoller.py PID $pid
+ kill -9 "$pid"
+done
+echo
+
 exit 0
 
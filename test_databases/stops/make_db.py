@@ -3,10 +3,21 @@
 # Write a bus stop database to test against.
 # Initialize the database.
 
-from sqlalchemy import create_engine, UniqueConstraint, Column, String, Float
+import os
+import sys
+
+from sqlalchemy import text, create_engine, UniqueConstraint, Column, String, Float, Integer
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+# The generation table and WAL mode are the same as in the real databases.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'databases'))
+import feedGeneration
+
+# The level of detail is worked out the same way as for the real stops.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'databases', 'stops'))
+import stopLevels
+
 # Make the table.
 Base = declarative_base()
 
@@ -17,8 +28,15 @@ class stopsTable(Base):
     stopdesc = Column(String, nullable=False)
     lat      = Column(Float,  nullable=False)
     lon      = Column(Float,  nullable=False)
+    minzoom  = Column(Integer, nullable=False, server_default='0')
     __table_args__ = (UniqueConstraint('stopid', name='unique_constraint'),)
 
+# The generation of the stops, which update_db.py bumps every time
+# it writes them and the API uses to tell if they have changed.
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
+
 # Create the database.
 # Had to install sqlalchemy_utils to do this.
 engine = create_engine("sqlite:///database.db", echo=False)
@@ -36,6 +54,9 @@ engine.echo=True
 Base.metadata.create_all(engine)
 engine.echo=False
 
+# Run in write-ahead log (WAL) mode, like the real databases.
+feedGeneration.useWAL(engine)
+
 stplist=[]
 for i in range(20) :
     stpid = f"{i:0{4}d}"
@@ -48,6 +69,8 @@ for i in range(20) :
 
     stplist.append(d)
 
+stopLevels.assignMinZooms(stplist)
+
 Session = sessionmaker(bind=engine)
 session = Session()
 
@@ -55,6 +78,7 @@ ok=False
 try:
     # Use bulk_insert_mappings (more efficient for large datasets)
     session.bulk_insert_mappings(stopsTable, stplist)
+    session.add(generationTable(id=1, generation=1, feedtime=0, updatetime=1700000000))
     session.commit()
     print("Data inserted successfully.")
     ok=True
@@ -67,6 +91,13 @@ except Exception as e:
 finally:
     session.close()
 
+# Build the spatial index on the stops, as databases/stops/update_db.py does.
+if ok :
+    with engine.begin() as conn :
+        conn.execute(text("CREATE VIRTUAL TABLE stops_rtree USING rtree(id, minLat, maxLat, minLon, maxLon)"))
+        conn.execute(text("INSERT INTO stops_rtree (id, minLat, maxLat, minLon, maxLon) "
+                          "SELECT rowid, lat, lat, lon, lon FROM stops"))
+
 # That's all - the database should be created.
 if ok :
     print("Normal termination.")
@@ -2,12 +2,17 @@
 
 # Initialize the database.
 
-from sqlalchemy import create_engine, Column, String, Integer
+from sqlalchemy import create_engine, Index, Column, String, Integer
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.dialects.mysql import BIGINT
+import os
 import sys
 
+# The generation table and WAL mode are the same as in the real databases.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'databases'))
+import feedGeneration
+
 # Make the table.
 Base = declarative_base()
 
@@ -18,6 +23,15 @@ class tripsTable(Base):
     schedule_relationship = Column(Integer, nullable=False)
     arrivaltime    = Column(BIGINT(unsigned=True), nullable=False)
     stopid         = Column(String,   nullable=False)
+    # Covering index for the trip service, which looks up the arrivals
+    # at a stop in time order and only wants the route and arrival time.
+    __table_args__ = (Index('stop_arrival_index', 'stopid', 'arrivaltime', 'route'),)
+
+# The generation of the trip updates, which update_db.py bumps every
+# time it writes them and the API uses to tell if they have changed.
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
 
 # Create the database.
 # Had to install sqlalchemy_utils to do this.
@@ -36,6 +50,9 @@ engine.echo=True
 Base.metadata.create_all(engine)
 engine.echo=False
 
+# Run in write-ahead log (WAL) mode, like the real databases.
+feedGeneration.useWAL(engine)
+
 tlist=[]
 for i in range(11) :
     d={}
@@ -64,6 +81,7 @@ ok=False
 try:
     # Use bulk_insert_mappings (more efficient for large datasets)
     session.bulk_insert_mappings(tripsTable, tlist)
+    session.add(generationTable(id=1, generation=1, feedtime=0, updatetime=1700000000))
     session.commit()
     print("Data inserted successfully.")
     ok=True
@@ -2,18 +2,24 @@
 
 # Initialize the database.
 
-from sqlalchemy import create_engine, Column, String, Float, Integer
+from sqlalchemy import create_engine, Column, String, Float, Integer, Index
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.dialects.mysql import BIGINT
+import os
 import sys
 
+# The generation table and WAL mode are the same as in the real databases.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'databases'))
+import feedGeneration
+
 # Make the table.
 Base = declarative_base()
 
 class vehiclesTable(Base):
     __tablename__='vehicles'
-    id             = Column(Integer, nullable=False, primary_key=True)
+    vehicleid      = Column(String,  nullable=False, primary_key=True)
+    tripid         = Column(String,  nullable=False)
     route          = Column(String,  nullable=False)
     schedule_relationship = Column(Integer, nullable=False)
     direction_id   = Column(Integer, nullable=False)
@@ -22,6 +28,21 @@ class vehiclesTable(Base):
     lat            = Column(Float,   nullable=False)
     lon            = Column(Float,   nullable=False)
     bearing        = Column(Float,   nullable=False)
+    __table_args__ = (Index('vehicle_route_index', 'route'),)
+
+class generationTable(feedGeneration.generationColumns, Base):
+    pass
+
+class changesTable(Base):
+    __tablename__='vehicle_changes'
+    generation     = Column(Integer, nullable=False, primary_key=True)
+    vehicleid      = Column(String,  nullable=False, primary_key=True)
+    updatetime     = Column(BIGINT(unsigned=True), nullable=False)
+
+class routesTable(Base):
+    __tablename__='vehicle_routes'
+    route          = Column(String,  nullable=False, primary_key=True)
+    vehicles       = Column(Integer, nullable=False)
 
 # Create the database.
 # Had to install sqlalchemy_utils to do this.
@@ -40,9 +61,14 @@ engine.echo=True
 Base.metadata.create_all(engine)
 engine.echo=False
 
+# Run in write-ahead log (WAL) mode, like the real databases.
+feedGeneration.useWAL(engine)
+
 vlist=[]
 for i in range(20) :
     d={}
+    d['vehicleid']=f"VEH{i:0{2}d}"
+    d['tripid']=f"TRIP{i:0{2}d}"
     d['route']=f"BUS{i:0{2}d}"
     d['schedule_relationship']=0
     d['direction_id']=0
@@ -61,6 +87,8 @@ ok=False
 try:
     # Use bulk_insert_mappings (more efficient for large datasets)
     session.bulk_insert_mappings(vehiclesTable, vlist)
+    session.bulk_insert_mappings(routesTable, [ { 'route' : d['route'], 'vehicles' : 1 } for d in vlist ])
+    session.add(generationTable(id=1, generation=1, feedtime=0, updatetime=1700000000))
     session.commit()
     print("Data inserted successfully.")
     ok=True
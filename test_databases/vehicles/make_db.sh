@@ -1,6 +1,6 @@
 #!/bin/bash
 
-rm -fv *.db
+rm -fv *.db *.db-wal *.db-shm
 uv run ./make_db.py
 
 exit 0
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+# Things several of the tests need, to make vehicles and agencies.
+
+import os
+import sqlite3
+
+from ..databases import feedDaemon
+from ..webservices.bussinAPIs import vehicleDbFile, stopsDbFile, tripDbFile
+
+# Where the feeds' update_db.py modules are, to load with feedDaemon.loadFeedModule.
+vehicleFeedDir = os.path.join(os.path.dirname(os.path.abspath(feedDaemon.__file__)), 'vehicles')
+tripFeedDir    = os.path.join(os.path.dirname(os.path.abspath(feedDaemon.__file__)), 'trip_updates')
+
+# Small function to make a row for the vehicle feed's writeDatabase.
+def vehicle(vid, lat=1.0, route='R1') :
+    return { 'vehicleid' : vid, 'tripid' : 'T' + vid, 'route' : route, 'schedule_relationship' : 0,
+             'direction_id' : 0, 'current_status' : 2, 'timestamp' : 100, 'lat' : lat, 'lon' : 1.0,
+             'bearing' : 0.0 }
+
+# Small function to set up an agency's tree, with a copy of the test databases
+# (with the first numVehicles vehicles) for the API, a web page, directories
+# for the ingest to write the feeds to and an environment.vars. If url is set,
+# the agency's feeds are there, polled every second. Returns the environment.vars file.
+def make_agency(topDir, name="Test", numVehicles=20, url=None) :
+    for feed, db_file in [ ('stops', stopsDbFile), ('vehicles', vehicleDbFile), ('trip_updates', tripDbFile) ] :
+        os.makedirs(os.path.join(topDir, 'test_databases', feed))
+        os.makedirs(os.path.join(topDir, 'databases', feed))
+        source = sqlite3.connect(db_file)
+        copy = sqlite3.connect(os.path.join(topDir, 'test_databases', feed, 'database.db'))
+        source.backup(copy)
+        source.close()
+        if feed == 'vehicles' :
+            copy.execute("DELETE FROM vehicles WHERE rowid > ?", (numVehicles,))
+            copy.execute("DELETE FROM vehicle_routes WHERE route NOT IN (SELECT route FROM vehicles)")
+            copy.commit()
+        copy.close()
+    os.makedirs(os.path.join(topDir, 'webpages'))
+    with open(os.path.join(topDir, 'webpages', 'index.html'), 'w') as file :
+        file.write(f"<html>{name}</html>")
+    envFile = os.path.join(topDir, 'environment.vars')
+    with open(envFile, 'w') as file :
+        file.write(f'export BFR_TOP_DIR="{topDir}"\nexport BFR_AGENCY_NAME="{name}"\nexport BFR_TEST_MODE="TRUE"\n'
+                   'export BFR_DB_THREADS="2"\n')
+        if url is not None :
+            file.write(f'export BFR_VEHICLES_URL="{url}/VehiclePosition.pb"\nexport BFR_VEHICLE_POLL="1"\n'
+                       f'export BFR_TRIPS_URL="{url}/TripUpdate.pb"\nexport BFR_TRIP_POLL="1"\n')
+    return envFile
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+from ..webservices.bussinAPIs import bussinApp, stopsDbFile, stopsIndexed
+
+client=TestClient(bussinApp)
+
+# The test database has the spatial index, and bounding box
+# queries go through it rather than scanning the stops table.
+def test_index_is_used():
+    assert stopsIndexed()
+    conn = sqlite3.connect(stopsDbFile)
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT stops.stopid FROM stops "
+                        "JOIN stops_rtree ON stops_rtree.id = stops.rowid "
+                        "WHERE stops_rtree.maxLat >= -5.0 AND stops_rtree.minLat <= 5.0").fetchall()
+    conn.close()
+    details = " ".join(row[-1] for row in plan)
+    assert "VIRTUAL TABLE" in details
+    assert "SCAN stops " not in details + " "
+
+# What the end point serves out using the index has to be what
+# the plain filters on the stops table give, including stops right
+# on the edge of the box.
+def test_index_matches_scan():
+    conn = sqlite3.connect(stopsDbFile)
+    boxes = [ (-5.0, -5.0, 5.0, 5.0), (-5.0, None, None, None), (None, None, 0.0, None),
+              (-10.0, 9.0, -9.0, 10.0), (-4.5, -4.5, 4.5, 4.5), (20.0, 20.0, 30.0, 30.0) ]
+    for minLat, minLon, maxLat, maxLon in boxes :
+        where = []
+        params = {}
+        for name, column, op, value in ( ('minLat', 'lat', '>=', minLat), ('minLon', 'lon', '>=', minLon),
+                                         ('maxLat', 'lat', '<=', maxLat), ('maxLon', 'lon', '<=', maxLon) ) :
+            if value is not None :
+                where.append(f"{column} {op} :{name}")
+                params[name] = value
+        expected = sorted(row[0] for row in conn.execute("SELECT stopid FROM stops WHERE " + " AND ".join(where), params))
+
+        response = client.get("/busStopService", params=params)
+        assert sorted(item['stopid'] for item in response.json()) == expected
+    conn.close()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import asyncio
+import sqlite3
+
+import httpx
+from fastapi import status
+
+from ..webservices.bussinAPIs import bussinApp, vehicleDbFile
+
+# Simulate an ingest swap by having another connection start the
+# swap transaction on the vehicle database (delete everything) and
+# hold it open while several vehicle requests and a static file
+# request are in flight. Since the database is in WAL mode, the
+# vehicle requests should all finish and still see the old data,
+# and the static file should be served too. The transaction is
+# rolled back at the end so the test database is left alone.
+async def requests_during_swap():
+    transport = httpx.ASGITransport(app=bussinApp)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client :
+        requests = [ client.get("/vehicleService") for i in range(10) ]
+        requests.append(client.get("/index.html"))
+        return await asyncio.gather(*requests)
+
+def test_requests_during_swap():
+    writer = sqlite3.connect(vehicleDbFile, isolation_level=None)
+    try :
+        assert writer.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("DELETE FROM vehicles")
+        responses = asyncio.run(asyncio.wait_for(requests_during_swap(), timeout=10))
+    finally :
+        writer.execute("ROLLBACK")
+        writer.close()
+
+    # The static file was served during the swap.
+    assert responses[-1].status_code == status.HTTP_200_OK
+
+    # The vehicle requests all finished, and saw the data from before the swap.
+    for response in responses[:-1] :
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == 20
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+from email.utils import formatdate
+
+from fastapi import Request, Response, status
+from fastapi.testclient import TestClient
+
+from ..webservices.bussinAPIs import bussinApp, clientIsCurrent
+from ..webservices.bussinSnapshots import generationStamp
+
+client=TestClient(bussinApp)
+
+urls = [ "/busStopService?minLat=-5.0&maxLat=5.0&minLon=-5.0&maxLon=5.0",
+         "/vehicleService?routesCSV=bus01,Bus02,BUS03",
+         "/tripService?stopID=STP01" ]
+
+# Send back the ETag we were given and get a 304 with no body,
+# send back some other ETag and get the full answer again.
+def test_etag():
+    for url in urls :
+        response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        etag = response.headers['ETag']
+
+        again = client.get(url, headers={ 'If-None-Match' : etag })
+        assert again.status_code == status.HTTP_304_NOT_MODIFIED
+        assert again.content == b''
+        assert again.headers['ETag'] == etag
+
+        # A weak version of the tag, in a list, also matches.
+        again = client.get(url, headers={ 'If-None-Match' : '"nope", W/' + etag })
+        assert again.status_code == status.HTTP_304_NOT_MODIFIED
+
+        other = client.get(url, headers={ 'If-None-Match' : '"0-0"' })
+        assert other.status_code == status.HTTP_200_OK
+        assert other.json() == response.json()
+
+# The stops and vehicles only change when the ingest writes, so they
+# have a Last-Modified header too. The trips don't, since the arrivals
+# that are still to come change as time goes by.
+def test_last_modified():
+    for url in urls[:2] :
+        response = client.get(url)
+        lastModified = response.headers['Last-Modified']
+        again = client.get(url, headers={ 'If-Modified-Since' : lastModified })
+        assert again.status_code == status.HTTP_304_NOT_MODIFIED
+        again = client.get(url, headers={ 'If-Modified-Since' : formatdate(0, usegmt=True) })
+        assert again.status_code == status.HTTP_200_OK
+    assert 'Last-Modified' not in client.get(urls[2]).headers
+
+# A new generation means a new ETag, and a database
+# with no generation gets no conditional GETs at all.
+def test_new_generation():
+    request = Request({ 'type' : 'http', 'headers' : [ (b'if-none-match', b'"7-1000"') ] })
+    assert clientIsCurrent(request, Response(), generationStamp(7, 1000))
+    assert not clientIsCurrent(request, Response(), generationStamp(8, 1010))
+    response = Response()
+    assert not clientIsCurrent(request, response, generationStamp(0, 0))
+    assert 'etag' not in response.headers
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+import functools
+import http.server
+import os
+import sqlite3
+import threading
+
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+from ..databases import feedDaemon
+from .helpers import vehicleFeedDir, tripFeedDir, vehicle
+
+class quietHandler(http.server.SimpleHTTPRequestHandler) :
+    def log_message(self, *args) :
+        return
+
+# Small function to write a vehicle positions feed file with
+# the given header timestamp and number of vehicles, and set its
+# modification time (which the server sends as Last-Modified).
+def write_feed(feedFile, timestamp, numVehicles, mtime) :
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = timestamp
+    for i in range(numVehicles) :
+        entity = feed.entity.add()
+        entity.id = f"V{i}"
+        entity.vehicle.trip.route_id = f"R{i}"
+        entity.vehicle.position.latitude = float(i)
+        entity.vehicle.position.longitude = float(-i)
+    with open(feedFile, 'wb') as file :
+        file.write(feed.SerializeToString())
+    os.utime(feedFile, (mtime, mtime))
+    return
+
+def count_vehicles(db_file) :
+    conn = sqlite3.connect(db_file)
+    count = conn.execute("SELECT COUNT(*) FROM vehicles").fetchone()[0]
+    conn.close()
+    return count
+
+def test_unchanged_feed_is_skipped(tmp_path):
+    handler = functools.partial(quietHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/VehiclePosition.pb"
+    feedFile = os.path.join(tmp_path, "VehiclePosition.pb")
+    db_file = os.path.join(tmp_path, "database.db")
+
+    ingester = feedDaemon.feedIngester(vehicleFeedDir, db_file)
+    ingester.feedModule.Base.metadata.create_all(ingester.engine)
+
+    try :
+        # First time through the feed is written.
+        write_feed(feedFile, 1000, 5, 1000000)
+        timing = ingester.runCycle(url)
+        assert timing['applied']
+        assert count_vehicles(db_file) == 5
+
+        # Nothing changed, the server says 304 Not Modified.
+        timing = ingester.runCycle(url)
+        assert timing['skipReason'] == 'notModified'
+
+        # Same bytes re-published.
+        write_feed(feedFile, 1000, 5, 1000010)
+        timing = ingester.runCycle(url)
+        assert timing['skipReason'] == 'sameContent'
+
+        # Different bytes, but the same feed timestamp.
+        write_feed(feedFile, 1000, 6, 1000020)
+        timing = ingester.runCycle(url)
+        assert timing['skipReason'] == 'sameTimestamp'
+        assert count_vehicles(db_file) == 5
+
+        # A new feed is written.
+        write_feed(feedFile, 2000, 7, 1000030)
+        timing = ingester.runCycle(url)
+        assert timing['applied']
+        assert count_vehicles(db_file) == 7
+
+        assert timing['counters'] == { 'applied' : 2, 'skipped' : 3, 'notModified' : 1,
+                                       'sameContent' : 1, 'sameTimestamp' : 1 }
+    finally :
+        ingester.close()
+        server.shutdown()
+
+def test_vehicle_upserts(tmp_path):
+    vehicleModule = feedDaemon.loadFeedModule(vehicleFeedDir)
+    db_file = os.path.join(tmp_path, "database.db")
+    engine = vehicleModule.makeEngine(db_file)
+
+    changes = vehicleModule.writeDatabase(engine, [ vehicle(f"V{i}", float(i)) for i in range(5) ])
+    assert changes == { 'inserted' : 5, 'updated' : 0, 'deleted' : 0 }
+
+    # V0 and V1 are gone, V2 moved, V3 and V4 stayed put and V5 is new.
+    changes = vehicleModule.writeDatabase(engine, [ vehicle("V2", 20.0), vehicle("V3", 3.0),
+                                                    vehicle("V4", 4.0), vehicle("V5", 5.0) ])
+    assert changes == { 'inserted' : 1, 'updated' : 1, 'deleted' : 2 }
+
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute("SELECT vehicleid, tripid, lat FROM vehicles ORDER BY vehicleid").fetchall()
+    conn.close()
+    engine.dispose()
+    assert rows == [ ('V2', 'TV2', 20.0), ('V3', 'TV3', 3.0), ('V4', 'TV4', 4.0), ('V5', 'TV5', 5.0) ]
+
+def test_trip_pruning_and_index(tmp_path):
+    tripModule = feedDaemon.loadFeedModule(tripFeedDir)
+
+    # Arrivals at zero and before "now" are dropped.
+    feed = gtfs_realtime_pb2.FeedMessage()
+    entity = feed.entity.add()
+    entity.id = "T1"
+    entity.trip_update.trip.route_id = "R1"
+    for stopid, arrival in [ ("S1", 0), ("S2", 900), ("S3", 1000), ("S4", 1100) ] :
+        stu = entity.trip_update.stop_time_update.add()
+        stu.stop_id = stopid
+        stu.arrival.time = arrival
+    rows = tripModule.feedRows(feed, now=1000)
+    assert [ row['stopid'] for row in rows ] == [ "S3", "S4" ]
+
+    # A database made without the index gets it from makeEngine.
+    db_file = os.path.join(tmp_path, "database.db")
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE intrepid_trips (id INTEGER PRIMARY KEY, route VARCHAR NOT NULL, "
+                 "schedule_relationship INTEGER NOT NULL, arrivaltime BIGINT NOT NULL, stopid VARCHAR NOT NULL)")
+    conn.close()
+    engine = tripModule.makeEngine(db_file)
+    tripModule.Base.metadata.create_all(engine)
+    tripModule.writeDatabase(engine, rows)
+    engine.dispose()
+
+    conn = sqlite3.connect(db_file)
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT route, arrivaltime FROM intrepid_trips "
+                        "WHERE stopid = 'S3' AND arrivaltime >= 1000 ORDER BY arrivaltime").fetchall()
+    conn.close()
+    assert "COVERING INDEX stop_arrival_index" in plan[0][-1]
+
+# The feed settings come out of the environment file, and a file that's
+# missing one or has a bad poll interval says so (so the daemon can try again).
+def test_feed_settings(tmp_path):
+    envFile = os.path.join(tmp_path, "environment.vars")
+    for contents, error in [ ('export BFR_VEHICLES_URL="http://x/v.pb"\nexport BFR_VEHICLE_POLL="15"\n', None),
+                             ('export BFR_VEHICLES_URL="http://x/v.pb"\n', "does not set BFR_VEHICLE_POLL"),
+                             ('export BFR_VEHICLES_URL="http://x/v.pb"\nexport BFR_VEHICLE_POLL="soon"\n', "not a number") ] :
+        with open(envFile, 'w') as file :
+            file.write(contents)
+        if error is None :
+            _, url, poll = feedDaemon.feedSettings(envFile, 'vehicles')
+            assert (url, poll) == ("http://x/v.pb", 15.0)
+        else :
+            with pytest.raises(ValueError, match=error) :
+                feedDaemon.feedSettings(envFile, 'vehicles')
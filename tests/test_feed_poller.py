@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import asyncio
+import functools
+import http.server
+import os
+import sqlite3
+import threading
+import time
+from typing import ClassVar
+
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+from ..databases import feedDaemon, feedPoller
+from .helpers import make_agency
+
+class keepAliveHandler(http.server.SimpleHTTPRequestHandler) :
+    """
+    Serves the recorded feeds, keeping connections open between
+    requests, and counts the connections and requests.
+    """
+    protocol_version = "HTTP/1.1"
+    counts: ClassVar[dict] = { "connections" : 0, "requests" : 0 }
+
+    def setup(self) :
+        keepAliveHandler.counts["connections"] += 1
+        super().setup()
+
+    def do_GET(self) :
+        keepAliveHandler.counts["requests"] += 1
+        super().do_GET()
+
+    def log_message(self, *args) :
+        return
+
+# Small function to record a vehicle positions feed and a trip updates
+# feed for an agency, with numVehicles vehicles and an arrival at
+# each of numStops stops, in the directory the server serves out of.
+def record_feeds(feedsDir, numVehicles, numStops) :
+    os.makedirs(feedsDir)
+    vehicles = gtfs_realtime_pb2.FeedMessage()
+    vehicles.header.gtfs_realtime_version = "2.0"
+    vehicles.header.timestamp = 1000
+    for i in range(numVehicles) :
+        entity = vehicles.entity.add()
+        entity.id = f"V{i}"
+        entity.vehicle.trip.route_id = f"R{i}"
+        entity.vehicle.position.latitude = float(i)
+        entity.vehicle.position.longitude = float(-i)
+    with open(os.path.join(feedsDir, "VehiclePosition.pb"), 'wb') as file :
+        file.write(vehicles.SerializeToString())
+
+    trips = gtfs_realtime_pb2.FeedMessage()
+    trips.header.gtfs_realtime_version = "2.0"
+    trips.header.timestamp = 1000
+    entity = trips.entity.add()
+    entity.id = "T1"
+    entity.trip_update.trip.route_id = "R1"
+    for i in range(numStops) :
+        stu = entity.trip_update.stop_time_update.add()
+        stu.stop_id = f"S{i}"
+        stu.arrival.time = int(time.time()) + 3600
+    with open(os.path.join(feedsDir, "TripUpdate.pb"), 'wb') as file :
+        file.write(trips.SerializeToString())
+    return
+
+# Small function to write a file, from the async tests without opening it there.
+def write_file(path, text) :
+    with open(path, 'w') as file :
+        file.write(text)
+    return
+
+def count_rows(db_file, table) :
+    conn = sqlite3.connect(db_file)
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return count
+
+# Both feeds of both agencies are fetched at once, on connections that are
+# kept open, parsed in a worker process and written to each agency's databases.
+def test_poll_agencies(tmp_path):
+    feedsDir = os.path.join(tmp_path, 'feeds')
+    record_feeds(os.path.join(feedsDir, 'one'), 5, 3)
+    record_feeds(os.path.join(feedsDir, 'two'), 8, 2)
+    handler = functools.partial(keepAliveHandler, directory=feedsDir)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    topDirs = [ os.path.join(tmp_path, 'one'), os.path.join(tmp_path, 'two') ]
+    envFiles = [ make_agency(topDirs[0], "One", url=url + "/one"), make_agency(topDirs[1], "Two", url=url + "/two") ]
+    with open(envFiles[1], 'a') as file :
+        file.write('export BFR_VEHICLE_CHANGE_RING="3"\n')
+
+    async def run() :
+        poller = feedPoller.feedPoller(envFiles, parseWorkers=1)
+        try :
+            first = await asyncio.gather(*[ poller.pollOnce(polled) for polled in poller.polled ])
+            second = await asyncio.gather(*[ poller.pollOnce(polled) for polled in poller.polled ])
+
+            # Each agency's feeds are written with its own settings, and
+            # nothing else can write them while the poller has them.
+            ringSizes = [ polled['ingester'].writeOptions.get('ringSize') for polled in poller.polled ]
+            assert ringSizes == [ 20, None, 3, None ]
+            assert feedDaemon.lockWriter(poller.polled[0]['feedDir']) is None
+            with pytest.raises(RuntimeError) :
+                feedPoller.feedPoller(envFiles[:1], parseWorkers=0)
+
+            # An agency whose environment file is broken fails on its own,
+            # and the rest are polled as usual, then and when it's running.
+            write_file(envFiles[1], f'export BFR_TOP_DIR="{topDirs[1]}"\nexport BFR_VEHICLE_POLL="soon"\n')
+            third = await asyncio.gather(*[ poller.pollOnce(polled) for polled in poller.polled ])
+
+            # Then run until every feed is stopped.
+            task = asyncio.ensure_future(poller.run())
+            await asyncio.sleep(0.5)
+            for polled in poller.polled :
+                write_file(os.path.join(polled['feedDir'], 'stop.marker'), '')
+            await asyncio.wait_for(task, 5.0)
+        finally :
+            await poller.close()
+        return first, second, third
+
+    try :
+        first, second, third = asyncio.run(run())
+    finally :
+        server.shutdown()
+
+    writerLock = feedDaemon.lockWriter(os.path.join(topDirs[0], 'databases', 'vehicles'))
+    assert writerLock is not None
+    feedDaemon.releaseWriter(writerLock)
+
+    assert [ timing['applied'] for timing, poll in first ] == [ True ] * 4
+    assert [ timing['skipReason'] for timing, poll in second ] == [ 'notModified' ] * 4
+    assert [ poll for timing, poll in first ] == [ 1.0 ] * 4
+    assert [ timing.get('skipReason') for timing, poll in third[:2] ] == [ 'notModified' ] * 2
+    assert [ 'error' in timing for timing, poll in third[2:] ] == [ True ] * 2
+    assert [ poll for timing, poll in third ] == [ 1.0 ] * 4
+    for topDir, numVehicles, numStops in [ (topDirs[0], 5, 3), (topDirs[1], 8, 2) ] :
+        assert count_rows(os.path.join(topDir, 'databases', 'vehicles', 'database.db'), 'vehicles') == numVehicles
+        assert count_rows(os.path.join(topDir, 'databases', 'trip_updates', 'database.db'), 'intrepid_trips') == numStops
+        assert os.path.exists(os.path.join(topDir, 'databases', 'vehicles', 'updated.time'))
+
+    # Twelve requests (two rounds, then a third and one more when it ran for
+    # the first agency only - the second's environment file was broken by
+    # then) on no more connections than there were fetches at once.
+    assert keepAliveHandler.counts["requests"] == 12
+    assert keepAliveHandler.counts["connections"] <= 4
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+from typing import List
+
+from fastapi import Response
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+from ..webservices.bussinAPIs import (bussinApp, jsonRows, busStopServiceResponseClass,
+                                      vehicleServiceResponseClass, tripServiceResponseClass)
+
+client=TestClient(bussinApp)
+
+# What FastAPI would have sent out for these rows, going
+# through the response model of the end point.
+def model_json(model, rows) :
+    adapter = TypeAdapter(List[model])
+    return adapter.dump_json(adapter.validate_python(rows))
+
+# The end points skip the response model, but what they send
+# has to be byte for byte what it would have been with it.
+def test_same_bytes_as_response_model():
+    cases = [ ("/busStopService", busStopServiceResponseClass),
+              ("/busStopService?minLat=-5.0&maxLat=5.0&minLon=-5.0&maxLon=5.0", busStopServiceResponseClass),
+              ("/vehicleService", vehicleServiceResponseClass),
+              ("/vehicleService?routesCSV=bus01,Bus02,BUS03", vehicleServiceResponseClass),
+              ("/tripService?stopID=STP01", tripServiceResponseClass),
+              ("/tripService", tripServiceResponseClass) ]
+    for url, model in cases :
+        response = client.get(url)
+        assert response.headers['content-type'] == 'application/json'
+        assert response.content == model_json(model, response.json())
+
+# Including for values that are awkward to write out.
+def test_awkward_values():
+    stops = [ { "stopid" : "34385", "stopname" : "Wewatta St & 17th St", "stopdesc" : "Vehicles Travelling Northeast",
+                "lat" : 39.754143, "lon" : -105.001356 },
+              { "stopid" : "1", "stopname" : "Café \"Plaza\" – Gate D\n", "stopdesc" : "北口",
+                "lat" : 1e-05, "lon" : -1e16 },
+              { "stopid" : "2", "stopname" : "", "stopdesc" : "\\", "lat" : 0.1 + 0.2, "lon" : -0.0 } ]
+    assert jsonRows(stops, Response()).body == model_json(busStopServiceResponseClass, stops)
+
+    vehicles = [ { "route" : "BOLT", "timestamp" : 1767225600, "current_status" : 2,
+                   "lat" : 40.0150, "lon" : -105.2705, "bearing" : 359.99 } ]
+    assert jsonRows(vehicles, Response()).body == model_json(vehicleServiceResponseClass, vehicles)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import os
+
+import numpy as np
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+from ..databases import feedDaemon
+from ..databases.snapshotFile import (writeSnapshotFile, mappedSnapshot, stringColumnOf, publishSnapshot,
+                                      readVehicleColumns, readArrivalColumns, readStopColumns)
+from ..webservices import bussinSnapshots
+from ..webservices.bussinHost import makeHostApp
+from ..webservices.bussinSnapshots import (snapshotCache, loadVehicleSnapshot, mapArrivalSnapshot,
+                                           vehicleSnapshot, stopSnapshot, arrivalSnapshot)
+from .helpers import vehicleFeedDir, tripFeedDir, vehicle, make_agency
+
+# What goes in comes back out, as read only views of the mapped file, and
+# a file that is replaced while it's mapped still has the old data in it.
+def test_snapshot_file(tmp_path):
+    path = os.path.join(tmp_path, "snapshot.bin")
+    writeSnapshotFile(path, 7, 1700000000, { "names" : stringColumnOf([ "A", "", "Ünïcode", "BC" ]),
+                                             "none"  : stringColumnOf([]),
+                                             "ints"  : np.arange(5, dtype=np.int64),
+                                             "reals" : np.array([ 0.5, -1.25 ]) })
+    first = mappedSnapshot(path)
+    assert (first.generation, first.updatetime) == (7, 1700000000)
+    assert first.columns["names"].tolist() == [ "A", "", "Ünïcode", "BC" ]
+    assert first.columns["names"].take([ 3, 0 ]) == [ "BC", "A" ]
+    assert first.columns["none"].tolist() == []
+    assert first.columns["ints"].tolist() == [ 0, 1, 2, 3, 4 ]
+    assert first.columns["reals"].tolist() == [ 0.5, -1.25 ]
+    assert not first.columns["ints"].flags.writeable
+
+    writeSnapshotFile(path, 8, 1700000010, { "ints" : np.arange(3, dtype=np.int64) })
+    second = mappedSnapshot(path)
+    assert second.identity != first.identity
+    assert second.columns["ints"].tolist() == [ 0, 1, 2 ]
+    assert first.columns["ints"].tolist() == [ 0, 1, 2, 3, 4 ]
+    assert not os.path.exists(path + ".tmp")
+
+# The ingest publishes a snapshot file every time it writes a generation, and
+# the API moves on to it, without looking at the database while it's there.
+def test_ingest_publishes_snapshot(tmp_path, monkeypatch):
+    vehicleModule = feedDaemon.loadFeedModule(vehicleFeedDir)
+    engine = vehicleModule.makeEngine(os.path.join(tmp_path, "database.db"))
+
+    try :
+        cache = snapshotCache(engine, loadVehicleSnapshot, 0.0, os.path.join(tmp_path, "snapshot.bin"),
+                              lambda mapped : vehicleSnapshot(mapped.generation, mapped.columns, mapped.updatetime))
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.0), vehicle("V2", 2.0) ], 1000)
+        first = cache.refresh()
+        assert cache.mappedID is not None
+        assert first.generation == 1
+        assert first.rows(first.select(), withIDs=True) == loadVehicleSnapshot(engine, 1).rows(first.select(), withIDs=True)
+
+        # Nothing changed, so the file is left alone and we keep what we have.
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.0), vehicle("V2", 2.0) ], 1010)
+        assert cache.refresh() is first
+
+        vehicleModule.writeDatabase(engine, [ vehicle("V2", 2.5), vehicle("V3", 3.0) ], 1020)
+        second = cache.refresh()
+        assert second.generation == 2
+        assert second.delta(first.token) == { "token" : second.token, "full" : False, "removed" : [ "V1" ],
+                                              "vehicles" : second.rows(second.select(), withIDs=True) }
+        assert [ v['vehicleid'] for v in first.rows(first.select(), withIDs=True) ] == [ "V1", "V2" ]
+
+        # If the file goes away we go back to the database.
+        os.remove(os.path.join(tmp_path, "snapshot.bin"))
+        third = cache.refresh()
+        assert cache.mappedID is None
+        assert third.generation == 2 and third is not second
+
+        # Or if it goes away between seeing it's there and mapping it.
+        monkeypatch.setattr(bussinSnapshots, "snapshotIdentity", lambda path : (0, 0, 0, 0))
+        assert cache.refresh() is third
+        assert cache.mappedID is None
+    finally :
+        engine.dispose()
+
+# The arrivals at a stop from the trip snapshot, from a time on and up to a limit.
+def test_arrival_snapshot(tmp_path):
+    tripModule = feedDaemon.loadFeedModule(tripFeedDir)
+    engine = tripModule.makeEngine(os.path.join(tmp_path, "database.db"))
+    trips = [ { 'route' : f"R{i % 3}", 'schedule_relationship' : 0, 'arrivaltime' : 1000 + (i * 37) % 100,
+                'stopid' : f"S{i % 4}" } for i in range(40) ]
+    try :
+        tripModule.writeDatabase(engine, trips, 1000)
+    finally :
+        engine.dispose()
+
+    snapshot = mapArrivalSnapshot(mappedSnapshot(os.path.join(tmp_path, "snapshot.bin")))
+    for stopID in [ "S0", "S1", "S3", "S4", "", "S" ] :
+        for since in [ None, 1000, 1050, 2000 ] :
+            for limit in [ None, 1, 3 ] :
+                expected = sorted((t['arrivaltime'], t['route']) for t in trips
+                                  if t['stopid'] == stopID and (since is None or t['arrivaltime'] >= since))
+                got = [ (a['arrivaltime'], a['route']) for a in snapshot.arrivals(stopID, since, limit) ]
+                assert got == expected[:limit]
+
+# Two agencies with the same data, one served out of snapshot files and
+# one out of the databases, have to serve out exactly the same things.
+def test_mapped_matches_database(tmp_path):
+    mappedDir = os.path.join(tmp_path, 'mapped')
+    envFiles = [ make_agency(os.path.join(tmp_path, 'db'), 'DB', 20), make_agency(mappedDir, 'Mapped', 20) ]
+    for feed, readColumns in [ ('stops', readStopColumns), ('vehicles', readVehicleColumns),
+                               ('trip_updates', readArrivalColumns) ] :
+        engine = create_engine("sqlite:///" + os.path.join(mappedDir, 'test_databases', feed, 'database.db'))
+        try :
+            publishSnapshot(engine, readColumns)
+        finally :
+            engine.dispose()
+
+    hostApp, agencies = makeHostApp(envFiles)
+    client = TestClient(hostApp)
+
+    urls = [ "/vehicleService", "/vehicleService?minLat=-5.0&maxLon=4.0", "/vehicleService?routesCSV=bus01,BUS07,nope",
+             "/vehicleService?since=0&minLat=-3.0", "/vehicleService?format=columns", "/vehicleService?clusterDeg=2.0",
+             "/routeService", "/busStopService", "/busStopService?minLat=-5.0&maxLat=5.0", "/busStopService?zoom=3",
+             "/busStopService?zoom=0&minLon=0.0", "/tripService?stopID=STP01", "/tripService?stopID=NOPE",
+             "/multiStopTripService?stopIDsCSV=STP02,NOPE,STP01&limit=3" ]
+    for url in urls :
+        fromDatabase = client.get("/db" + url)
+        fromSnapshot = client.get("/mapped" + url)
+        assert fromDatabase.status_code == fromSnapshot.status_code == 200
+        assert fromDatabase.content == fromSnapshot.content, url
+        assert fromDatabase.headers['etag'] == fromSnapshot.headers['etag']
+
+    # And the mapped agency really did use the snapshot files.
+    assert isinstance(agencies['mapped'].stopsStamps.snapshot, stopSnapshot)
+    assert isinstance(agencies['mapped'].tripStamps.snapshot, arrivalSnapshot)
+    assert agencies['mapped'].vehicleCache.mappedID is not None
+    assert agencies['db'].vehicleCache.mappedID is None
+    assert not isinstance(agencies['db'].stopsStamps.snapshot, stopSnapshot)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+import os
+
+from fastapi.testclient import TestClient
+
+from ..webservices.bussinHost import makeHostApp
+from .helpers import make_agency
+
+# Each agency gets its own data, pages and caches from the one application.
+def test_agencies_served_from_one_app(tmp_path):
+    hostApp, agencies = makeHostApp([ make_agency(os.path.join(tmp_path, 'one'), 'ONE', 20),
+                                      make_agency(os.path.join(tmp_path, 'two'), 'Two', 5) ])
+    client = TestClient(hostApp)
+
+    assert sorted(agencies.keys()) == [ 'one', 'two' ]
+    assert agencies['one'].vehicleEngine is not agencies['two'].vehicleEngine
+    assert agencies['one'].vehicleCache is not agencies['two'].vehicleCache
+    assert agencies['two'].dbThreads == 2
+
+    assert len(client.get("/one/vehicleService").json()) == 20
+    assert len(client.get("/two/vehicleService").json()) == 5
+    assert len(client.get("/two/routeService").json()) == 5
+    assert len(client.get("/two/busStopService").json()) == 20
+    assert len(client.get("/one/tripService?stopID=STP01").json()) == 11
+    assert client.get("/one/").text == "<html>ONE</html>"
+    assert client.get("/two/").text == "<html>Two</html>"
+    assert client.get("/three/vehicleService").status_code == 404
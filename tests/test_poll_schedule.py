@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import itertools
+import random
+
+from ..databases.pollSchedule import pollSchedule, publishTimeOf
+
+# Small function to make the times a feed is published, every periodSec
+# seconds (give or take jitterSec) from startSec until endSec.
+def publish_times(periodSec, jitterSec=0.0, startSec=0.0, endSec=3600.0, seed=1) :
+    rng = random.Random(seed)
+    times = []
+    t = startSec
+    while t < endSec :
+        times.append(t + rng.uniform(-jitterSec, jitterSec))
+        t += periodSec
+    return times
+
+# Simulate polling a feed published at the times in published, each of
+# which shows up for us delaySec seconds later, until durationSec.
+# nextFetch is given the time of each fetch, the publish time of the
+# version it got and whether that was new, and says when to fetch next.
+# Returns the number of fetches, the mean time from when a version
+# showed up to when we had it (how much older the data we serve are than
+# they need to be) and the number of versions we never got, because a
+# newer one had shown up by the time we looked.
+def simulate(nextFetch, published, delaySec=2.0, durationSec=3600.0, startSec=7.0) :
+    fetches = 0
+    have = None # Publish time of the version we have
+    seen = set()
+    waits = []
+    now = startSec
+    while now < durationSec :
+        fetches += 1
+        available = [ p for p in published if p + delaySec <= now ]
+        latest = available[-1] if len(available) > 0 else None
+        newVersion = latest is not None and latest != have
+        if newVersion :
+            have = latest
+            seen.add(latest)
+            waits.append(now - (latest + delaySec))
+        now = max(nextFetch(now, latest, newVersion), now + 0.1)
+
+    missed = [ p for p, later in itertools.pairwise(published)
+               if p + delaySec > startSec and later + delaySec < now and p not in seen ]
+    return fetches, sum(waits) / len(waits), len(missed)
+
+def fixed(pollSec) :
+    return lambda now, publishTime, newVersion : now + pollSec
+
+def adaptive(schedule) :
+    def nextFetch(now, publishTime, newVersion) :
+        schedule.fetched(now, publishTime, newVersion)
+        return schedule.nextFetch()
+    return nextFetch
+
+# Feeds published every 30 seconds (on the dot, and give or take a second)
+# polled every 15 seconds as we do, and one published every 10 seconds.
+# Learning when they're published, we have each version sooner, fetch
+# the slower feeds less often and don't miss versions of the faster one.
+def test_adaptive_beats_fixed():
+    for periodSec, jitterSec in [ (30.0, 0.0), (30.0, 1.0), (10.0, 0.5) ] :
+        published = publish_times(periodSec, jitterSec)
+        fixedFetches, fixedWait, fixedMissed = simulate(fixed(15.0), published)
+        adaptiveFetches, adaptiveWait, adaptiveMissed = simulate(adaptive(pollSchedule(15.0)), published)
+        assert adaptiveWait < 0.5 * fixedWait
+        assert adaptiveMissed == 0
+        if periodSec > 15.0 :
+            assert adaptiveFetches < 0.8 * fixedFetches
+        else :
+            assert fixedMissed > 100
+
+# If the agency starts publishing more often, we notice.
+def test_faster_publishing():
+    schedule = pollSchedule(15.0)
+    published = publish_times(30.0, endSec=1800.0) + publish_times(10.0, startSec=1800.0)
+    _, _, missed = simulate(adaptive(schedule), published)
+    assert schedule.period() == 10.0
+    assert missed < 20
+
+# Failures back off, up to a limit, and a good fetch goes back to normal.
+def test_backoff():
+    schedule = pollSchedule(15.0, maxBackoffSec=100.0)
+    assert schedule.nextFetch() == 0.0
+    waits = []
+    for i in range(5) :
+        schedule.failed(1000.0)
+        waits.append(schedule.nextFetch() - 1000.0)
+    assert waits == [ 15.0, 30.0, 60.0, 100.0, 100.0 ]
+    schedule.fetched(1000.0, 990.0, True)
+    assert schedule.nextFetch() == 1015.0
+
+def test_publish_time():
+    assert publishTimeOf(1700000000, "Tue, 14 Nov 2023 22:13:25 GMT") == 1700000000.0
+    assert publishTimeOf(0, "Tue, 14 Nov 2023 22:13:25 GMT") == 1700000005.0
+    assert publishTimeOf(0, "not a date") is None
+    assert publishTimeOf(0) is None
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+from ..databases import feedDaemon
+from ..webservices.bussinAPIs import bussinApp, vehicleEvents, tripEvents, tripStamps, currentSnapshot
+from ..webservices.bussinPush import generationWatcher
+from .helpers import vehicleFeedDir, vehicle
+from ..webservices.bussinSnapshots import snapshotCache, loadVehicleSnapshot
+
+# Small function to turn a server-sent event back into its name and data.
+def parse_event(event) :
+    lines = event.decode().strip().split('\n')
+    return lines[0][len("event: "):], json.loads(lines[1][len("data: "):])
+
+# Lots of subscribers watching the vehicles. Every subscriber has to get
+# every generation, and the events for the same area are only made once.
+def test_many_vehicle_subscribers(tmp_path):
+    vehicleModule = feedDaemon.loadFeedModule(vehicleFeedDir)
+    engine = vehicleModule.makeEngine(os.path.join(tmp_path, "database.db"))
+
+    async def getSnapshot(cache) :
+        return cache.refresh()
+
+    numSubscribers = 500
+    numGenerations = 5
+
+    async def run() :
+        cache = snapshotCache(engine, loadVehicleSnapshot, 0.0)
+        watcher = generationWatcher(cache, getSnapshot, 0.01)
+        received = [ [] for i in range(numSubscribers) ]
+
+        async def subscriber(n) :
+            # Half of them are watching a smaller area.
+            maxLat = 100.0 if n % 2 == 0 else 2.5
+            events = vehicleEvents(watcher, None, None, maxLat, None, None)
+            try :
+                async for event in events :
+                    if event.startswith(b"event:") :
+                        received[n].append(parse_event(event)[1])
+                        if len(received[n]) == numGenerations + 1 :
+                            break
+            finally :
+                await events.aclose()
+
+        # Small function to wait until everyone has had the generations so far.
+        async def everyoneHas(count) :
+            while min(len(r) for r in received) < count :
+                await asyncio.sleep(0.005)
+
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.0), vehicle("V2", 2.0), vehicle("V3", 3.0) ], 1000)
+        start = time.perf_counter()
+        tasks = [ asyncio.ensure_future(subscriber(n)) for n in range(numSubscribers) ]
+        await everyoneHas(1)
+        for g in range(numGenerations) :
+            vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.0), vehicle("V2", 2.0 + g + 1), vehicle("V3", 3.0) ], 1010 + g)
+            await everyoneHas(g + 2)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+        print(f"{numSubscribers} subscribers, {numSubscribers * (numGenerations + 1)} events "
+              f"in {elapsed:.3f} seconds, counters {watcher.counters}")
+        return watcher, received
+
+    try :
+        watcher, received = asyncio.run(run())
+    finally :
+        engine.dispose()
+
+    for n, events in enumerate(received) :
+        assert events[0]['full']
+        assert [ v['vehicleid'] for v in events[0]['vehicles'] ] == ([ "V1", "V2", "V3" ] if n % 2 == 0 else [ "V1", "V2" ])
+        for g, delta in enumerate(events[1:]) :
+            assert not delta['full']
+            if n % 2 == 0 :
+                assert [ (v['vehicleid'], v['lat']) for v in delta['vehicles'] ] == [ ("V2", 2.0 + g + 1) ]
+            else :
+                # V2 has moved out of the smaller area.
+                assert delta['vehicles'] == [] and delta['removed'] == [ "V2" ]
+        # Each event was sent on with the token for the next one.
+        assert [ e['token'] for e in events[1:] ] == [ e['token'] for e in received[0][1:] ]
+
+    # Two areas, once for the first snapshot and once for each generation after that.
+    assert watcher.counters['generations'] == numGenerations
+    assert watcher.counters['payloadsBuilt'] == 2 * (numGenerations + 1)
+    assert watcher.counters['payloadsShared'] == (numSubscribers - 2) * (numGenerations + 1)
+    assert watcher.subscribers == 0
+
+# Someone watching a stop gets its arrivals as soon as they subscribe,
+# the same as the trip end point serves them.
+def test_trip_stream():
+    client = TestClient(bussinApp)
+    expected = client.get("/tripService?stopID=STP01").json()
+
+    async def firstEvent() :
+        watcher = generationWatcher(tripStamps, currentSnapshot, 0.01)
+        events = tripEvents(watcher, "STP01")
+        try :
+            return await events.__anext__()
+        finally :
+            await events.aclose()
+
+    event, data = parse_event(asyncio.run(firstEvent()))
+    assert event == "arrivals"
+    assert data == expected
+
+# A payload that fails to build isn't kept, so the next subscriber
+# to ask for it builds it again rather than getting the same failure.
+def test_failed_payload():
+    async def run() :
+        watcher = generationWatcher(tripStamps, currentSnapshot, 60.0)
+        await watcher.subscribe()
+        builds = []
+
+        async def build(snapshot) :
+            builds.append(snapshot)
+            if len(builds) == 1 :
+                raise ValueError("no")
+            return "yes"
+
+        try :
+            try :
+                await watcher.payload("key", build)
+            except ValueError :
+                pass
+            return await watcher.payload("key", build), len(builds)
+        finally :
+            watcher.unsubscribe()
+
+    assert asyncio.run(run()) == ("yes", 2)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import asyncio
+
+import httpx
+from fastapi import Response
+from fastapi.testclient import TestClient
+
+from ..webservices.bussinAPIs import bussinApp, endPointCache
+from ..webservices.bussinCache import responseCache
+
+# Small function to make a build for the cache that sends out body.
+def builder(body) :
+    async def build() :
+        return Response(content=body, media_type="application/json")
+    return build
+
+# The least recently used entries go first, when there are too many or they're too big.
+def test_eviction():
+    async def run() :
+        cache = responseCache(3, 100)
+        for key in [ "a", "b", "c" ] :
+            await cache.get(key, builder(b"x" * 10))
+        assert await cache.get("a", builder(b"")) == (b"x" * 10, "application/json")
+        await cache.get("d", builder(b"y" * 10))
+        assert list(cache.entries.keys()) == [ "c", "a", "d" ]
+
+        # Too many bytes.
+        await cache.get("e", builder(b"z" * 75))
+        assert list(cache.entries.keys()) == [ "a", "d", "e" ]
+        assert cache.bytes == 95
+
+        # Too big to keep at all.
+        await cache.get("f", builder(b"w" * 101))
+        assert "f" not in cache.entries
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["hits"] == 1 and stats["misses"] == 6 and stats["evictions"] == 2
+    assert stats["entries"] == 3 and stats["hitRate"] == 1 / 7
+
+# Lots of requests for the same thing at once only build it once. If
+# the build fails, they all get the error and it isn't cached.
+def test_single_flight():
+    async def run() :
+        cache = responseCache(10, 1000)
+        builds = []
+
+        async def build() :
+            builds.append(1)
+            await asyncio.sleep(0.05)
+            return Response(content=b"slow", media_type="application/json")
+
+        results = await asyncio.gather(*[ cache.get("key", build) for i in range(50) ])
+        assert results == [ (b"slow", "application/json") ] * 50
+        assert len(builds) == 1
+
+        async def fail() :
+            await asyncio.sleep(0.01)
+            raise RuntimeError("no database")
+
+        results = await asyncio.gather(*[ cache.get("bad", fail) for i in range(5) ], return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert "bad" not in cache.entries and len(cache.inFlight) == 0
+        assert await cache.get("bad", builder(b"ok")) == (b"ok", "application/json")
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["misses"] == 3 and stats["coalesced"] == 53 and stats["errors"] == 1
+
+# Turned off, it builds every time.
+def test_disabled():
+    cache = responseCache(0, 1000)
+    assert asyncio.run(cache.get("a", builder(b"1"))) == (b"1", "application/json")
+    assert asyncio.run(cache.get("a", builder(b"2"))) == (b"2", "application/json")
+    assert len(cache.entries) == 0
+
+# Clients asking for the same area at the same time run one query between
+# them, and the same area later on is served out of the cache. Nearly the
+# same area is a different entry, with just the stops in that area in it.
+def test_API_coalescing():
+    endPointCache.clear()
+    url = "/busStopService?minLat=-5.001&minLon=-4.002&maxLat=5.003&maxLon=5.004"
+
+    async def run() :
+        transport = httpx.ASGITransport(app=bussinApp)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client :
+            responses = await asyncio.gather(*[ client.get(url) for i in range(20) ])
+            later = await client.get(url)
+            nearly = await client.get("/busStopService?minLat=-5.008&minLon=-4.001&maxLat=5.002&maxLon=5.009")
+        return responses, later, nearly
+
+    responses, later, nearly = asyncio.run(run())
+    assert all(r.status_code == 200 and r.content == responses[0].content for r in responses)
+    assert later.content == responses[0].content
+    assert len(nearly.json()) > 0
+    for stop in nearly.json() :
+        assert -5.008 <= stop['lat'] <= 5.002 and -4.001 <= stop['lon'] <= 5.009
+
+    client = TestClient(bussinApp)
+    stats = client.get("/cacheStatsService").json()
+    assert stats["misses"] == 2
+    assert stats["hits"] + stats["coalesced"] == 20
+    assert stats["hitRate"] == 20 / 22
+
+    # The columns and the usual JSON are cached separately.
+    endPointCache.clear()
+    plain = client.get("/vehicleService?routesCSV=BUS02,BUS01")
+    columns = client.get("/vehicleService?routesCSV=BUS01,BUS02,BUS01&format=columns")
+    assert client.get("/vehicleService?routesCSV=bus01,bus02").content == plain.content
+    assert columns.headers['content-type'] == "application/vnd.bussin.columns+json"
+    assert columns.json()['routes'] == [ 'BUS01', 'BUS02' ]
+    stats = client.get("/cacheStatsService").json()
+    assert (stats["misses"], stats["hits"]) == (2, 1)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+from ..databases import feedDaemon
+from ..webservices.bussinAPIs import bussinApp, vehicleDbFile
+from .helpers import vehicleFeedDir, vehicle
+
+client=TestClient(bussinApp)
+
+def test_route_catalog():
+    response = client.get("/routeService")
+    routes = response.json()
+    assert routes == [ { 'route' : f"BUS{i:02d}", 'vehicles' : 1 } for i in range(20) ]
+
+    # It only changes when the vehicles do.
+    assert client.get("/routeService", headers={ 'If-None-Match' : response.headers['etag'] }).status_code == 304
+
+# Vehicle queries for a few routes use the route index
+# rather than looking at every vehicle.
+def test_route_index_is_used():
+    conn = sqlite3.connect(vehicleDbFile)
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT route, lat, lon FROM vehicles "
+                        "WHERE route IN ('BUS01', 'BUS02') ORDER BY vehicles.rowid").fetchall()
+    conn.close()
+    assert "USING INDEX vehicle_route_index" in " ".join(row[-1] for row in plan)
+
+# The ingest keeps the routes table up to date with the vehicles.
+def test_ingest_counts_routes(tmp_path):
+    vehicleModule = feedDaemon.loadFeedModule(vehicleFeedDir)
+    db_file = os.path.join(tmp_path, "database.db")
+    engine = vehicleModule.makeEngine(db_file)
+
+    def routes() :
+        conn = sqlite3.connect(db_file)
+        rows = conn.execute("SELECT route, vehicles FROM vehicle_routes ORDER BY route").fetchall()
+        conn.close()
+        return rows
+
+    try :
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", route="R1"), vehicle("V2", route="R1"), vehicle("V3", route="R2") ])
+        assert routes() == [ ("R1", 2), ("R2", 1) ]
+
+        # V1 goes, V3 changes route and V4 is new.
+        vehicleModule.writeDatabase(engine, [ vehicle("V2", route="R1"), vehicle("V3", route="R3"), vehicle("V4", route="R3") ])
+        assert routes() == [ ("R1", 1), ("R3", 2) ]
+    finally :
+        engine.dispose()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import time
+
+from fastapi.testclient import TestClient
+
+from ..webservices.bussinAPIs import bussinApp, sharedCacheSec, sharedCacheMaxSec
+from ..webservices.bussinSnapshots import generationStamp
+
+# A shared cache can keep things until the ingest next writes, as long as
+# that's no more than the most it can keep anything, and a second when it's late.
+def test_shared_cache_sec():
+    now = int(time.time())
+    assert sharedCacheSec(generationStamp(1, now), 15) == 15
+    assert sharedCacheSec(generationStamp(1, now - 10), 15) in (4, 5)
+    assert sharedCacheSec(generationStamp(1, now - 60), 15) == 1
+    assert sharedCacheSec(generationStamp(1, 0), 15) == 1
+    assert sharedCacheSec(generationStamp(1, now), 7 * 24 * 3600) == sharedCacheMaxSec
+
+# The end points that follow the ingest say how long a shared cache can keep
+# what they send, and the vehicles vary on the Accept header. The test
+# databases were written long ago, so that's a second.
+def test_shared_cache_headers():
+    client = TestClient(bussinApp)
+    shared = 'public, max-age=0, must-revalidate, s-maxage=1'
+    for url in [ "/vehicleService", "/vehicleService?since=0", "/vehicleService?clusterDeg=1.0", "/routeService",
+                 "/busStopService?minLat=-5.0", "/tripService?stopID=STP01", "/multiStopTripService?stopIDsCSV=STP01" ] :
+        response = client.get(url)
+        assert response.headers['cache-control'] == shared
+
+        # The 304 says the same.
+        again = client.get(url, headers={ 'If-None-Match' : response.headers['etag'] })
+        assert again.status_code == 304 and again.headers['cache-control'] == shared
+
+    assert client.get("/vehicleService", headers={ 'Accept' : 'application/vnd.bussin.columns+json' }).headers['vary'] == 'Accept'
+    assert client.get("/cacheStatsService").headers['cache-control'] == 'no-store'
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import random
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+from ..databases.stops import stopLevels
+from ..webservices.bussinAPIs import bussinApp, stopsDbFile
+
+# Small function to get the grid cell a stop is in at a zoom level.
+def cell_of(stop, zoom) :
+    x, y = stopLevels.mercatorPixels(stop['lat'], stop['lon'], zoom)
+    return int(x // stopLevels.cellPixels), int(y // stopLevels.cellPixels)
+
+# At every zoom level the stops shown are no closer than a grid cell,
+# and every stop that isn't shown is in a cell that has one that is.
+def test_stops_spread_evenly():
+    rng = random.Random(1)
+    stops = [ { 'stopid' : str(i), 'lat' : 39.5 + rng.random() * 0.5, 'lon' : -105.3 + rng.random() * 0.5 }
+              for i in range(2000) ]
+    stopLevels.assignMinZooms(stops, important=[ '1500' ])
+    assert [ stop['stopid'] for stop in stops if stop['minzoom'] == 0 ] == [ '1500' ]
+
+    for zoom in range(stopLevels.maxZoom) :
+        shown = [ stop for stop in stops if stop['minzoom'] <= zoom ]
+        occupied = [ cell_of(stop, zoom) for stop in shown ]
+        assert len(occupied) == len(set(occupied))
+        for stop in stops :
+            assert cell_of(stop, zoom) in occupied
+    assert all(stop['minzoom'] <= stopLevels.maxZoom for stop in stops)
+
+def test_zoom_parameter():
+    client = TestClient(bussinApp)
+    conn = sqlite3.connect(stopsDbFile)
+    minzoom = dict(conn.execute("SELECT stopid, minzoom FROM stops").fetchall())
+    conn.close()
+
+    everything = client.get("/busStopService").json()
+    assert len(everything) == len(minzoom)
+    for zoom in [ 0, 3, 4, 5, 20 ] :
+        stops = client.get(f"/busStopService?zoom={zoom}").json()
+        assert sorted(stop['stopid'] for stop in stops) == sorted(s for s, z in minzoom.items() if z <= zoom)
+        # The stops shown from the lowest zoom come first.
+        assert [ minzoom[stop['stopid']] for stop in stops ] == sorted(minzoom[stop['stopid']] for stop in stops)
+
+    # And with the spatial index as well.
+    stops = client.get("/busStopService?minLat=-5.0&maxLat=5.0&zoom=4").json()
+    assert sorted(stop['stopid'] for stop in stops) == sorted(stop['stopid'] for stop in everything
+                                                              if -5.0 <= stop['lat'] <= 5.0 and minzoom[stop['stopid']] <= 4)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from ..databases.stops import stopTiles
+from ..webservices.bussinHost import makeHostApp
+from .helpers import make_agency
+
+# Each tile has the stops in it that are shown at its zoom level, most
+# important first, and can be cached for good. Other versions aren't found.
+def test_stop_tiles(tmp_path):
+    envFile = make_agency(os.path.join(tmp_path, 'tiled'), 'tiled', 20)
+    engine = create_engine("sqlite:///" + os.path.join(tmp_path, 'tiled', 'test_databases', 'stops', 'database.db'))
+    tilesPath = stopTiles.publishStopTiles(engine)
+    with engine.connect() as conn :
+        stops = [ dict(row) for row in conn.exec_driver_sql("SELECT stopid, lat, lon, minzoom FROM stops").mappings() ]
+    engine.dispose()
+
+    hostApp, _ = makeHostApp([ envFile, make_agency(os.path.join(tmp_path, 'plain'), 'plain', 20) ])
+    client = TestClient(hostApp)
+
+    info = client.get("/tiled/stopTileService").json()
+    assert info['minZoom'] == stopTiles.minTileZoom
+    assert info['maxZoom'] == stopTiles.stopLevels.maxZoom
+    version = info['version']
+
+    for zoom in [ info['minZoom'], 12, info['maxZoom'] ] :
+        tiles = {}
+        for stop in stops :
+            if stop['minzoom'] <= zoom :
+                tiles.setdefault(stopTiles.tileOf(stop['lat'], stop['lon'], zoom), []).append(stop['stopid'])
+        for (x, y), stopIDs in tiles.items() :
+            response = client.get(f"/tiled/stopTiles/{version}/{zoom}/{x}/{y}")
+            assert response.status_code == 200
+            assert response.headers['cache-control'] == 'public, max-age=31536000, immutable'
+            tile = response.json()
+            assert sorted(stop['stopid'] for stop in tile) == sorted(stopIDs)
+            assert [ stop['minzoom'] for stop in tile ] == sorted(stop['minzoom'] for stop in tile)
+
+    # An empty tile, then ones that aren't there.
+    assert client.get(f"/tiled/stopTiles/{version}/{info['maxZoom']}/0/0").json() == []
+    for url in [ f"/tiled/stopTiles/0-0/{info['minZoom']}/0/0", f"/tiled/stopTiles/{version}/{info['maxZoom'] + 1}/0/0",
+                 f"/tiled/stopTiles/{version}/{info['minZoom'] - 1}/0/0", f"/tiled/stopTiles/{version}/9/512/0" ] :
+        response = client.get(url)
+        assert response.status_code == 404 and response.headers['cache-control'] == 'no-store'
+
+    # Without tiles, the web page asks the bus stop end point.
+    assert client.get("/plain/stopTileService").json() == { "version" : None, "minZoom" : None, "maxZoom" : None }
+    assert client.get(f"/plain/stopTiles/{version}/0/0/0").status_code == 404
+
+    # If making the tiles fails, the old ones are removed rather than served out.
+    engine = create_engine("sqlite:///" + os.path.join(tmp_path, 'tiled', 'test_databases', 'stops', 'database.db'))
+    with engine.begin() as conn :
+        conn.exec_driver_sql("ALTER TABLE stops RENAME TO old_stops")
+    with pytest.raises(OperationalError) :
+        stopTiles.publishStopTiles(engine)
+    engine.dispose()
+    assert not os.path.exists(tilesPath)
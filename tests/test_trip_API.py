@@ -27,3 +27,20 @@ def test_rectangle_request():
         assert isinstance(item['route'], str)
         assert isinstance(item['arrivaltime'], int)
 
+
+# The batch end point gives each stop what the single stop end point does.
+def test_multi_stop_request():
+    response=client.get("/multiStopTripService?stopIDsCSV=STP02, STP01,NOPE,STP02")
+    stops = response.json()
+    assert [ stop['stopid'] for stop in stops ] == [ 'STP02', 'STP01', 'NOPE' ]
+    for stop in stops :
+        single = client.get("/tripService?stopID=" + stop['stopid']).json()
+        assert sorted(stop['arrivals'], key=lambda a : (a['arrivaltime'], a['route'])) == \
+               sorted(single, key=lambda a : (a['arrivaltime'], a['route']))
+
+    # Up to limit arrivals for each stop.
+    stops = client.get("/multiStopTripService?stopIDsCSV=STP01,STP02&limit=3").json()
+    assert [ len(stop['arrivals']) for stop in stops ] == [ 3, 3 ]
+
+    assert client.get("/multiStopTripService").json() == []
+    assert client.get("/multiStopTripService?stopIDsCSV=STP01&limit=0").status_code == 422
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+from fastapi.testclient import TestClient
+
+from ..webservices.bussinAPIs import bussinApp, vehicleSession, vehicleEngine, vehicleQuery
+from ..webservices.bussinSnapshots import loadVehicleSnapshot, readGeneration, vehicleColumns
+
+# Small function to turn the columns back into the usual list of vehicles.
+def from_columns(columns) :
+    scale = columns['scale']
+    return [ { 'route' : columns['routes'][columns['route'][i]], 'timestamp' : columns['timestamp'][i],
+               'current_status' : columns['current_status'][i], 'lat' : columns['lat'][i] / scale,
+               'lon' : columns['lon'][i] / scale, 'bearing' : columns['bearing'][i] }
+             for i in range(len(columns['route'])) ]
+
+def test_vehicle_columns():
+    client = TestClient(bussinApp)
+    url = "/vehicleService?minLat=-50.0"
+    plain = client.get(url)
+    vehicles = plain.json()
+    assert len(vehicles) > 0
+
+    # Asking with the format parameter or the Accept header gets the same thing.
+    columns = client.get(url + "&format=columns")
+    assert columns.headers['content-type'] == "application/vnd.bussin.columns+json"
+    assert columns.content == client.get(url, headers={ 'Accept' : "application/vnd.bussin.columns+json" }).content
+    assert len(columns.content) < len(plain.content)
+
+    # Same vehicles, to within the precision of the columns.
+    decoded = from_columns(columns.json())
+    assert len(decoded) == len(vehicles)
+    for got, expected in zip(decoded, vehicles) :
+        assert got['route'] == expected['route']
+        assert got['timestamp'] == expected['timestamp']
+        assert got['current_status'] == expected['current_status']
+        assert abs(got['lat'] - expected['lat']) <= 0.5 / columns.json()['scale']
+        assert abs(got['lon'] - expected['lon']) <= 0.5 / columns.json()['scale']
+        assert abs(got['bearing'] - expected['bearing']) <= 0.5
+
+    # Caches have to keep the two apart.
+    assert columns.headers['vary'] == "Accept"
+    assert columns.headers['etag'] != plain.headers['etag']
+    assert client.get(url + "&format=columns", headers={ 'If-None-Match' : columns.headers['etag'] }).status_code == 304
+    assert client.get(url, headers={ 'If-None-Match' : columns.headers['etag'] }).status_code == 200
+
+# The database query and the in memory snapshot make the same columns.
+def test_columns_match_query():
+    snapshot = loadVehicleSnapshot(vehicleEngine, readGeneration(vehicleEngine))
+    for routes in [ None, [ 'BUS02', 'BUS07' ], [ 'NOPE' ] ] :
+        db = vehicleSession()
+        try :
+            rows = vehicleQuery(db, None, None, None, None, routes).all()
+        finally :
+            db.close()
+        expected = vehicleColumns(*zip(*rows)) if len(rows) > 0 else vehicleColumns([], [], [], [], [], [])
+        assert snapshot.columns(snapshot.select(routes=routes)) == expected
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import os
+
+from fastapi.testclient import TestClient
+
+from ..databases import feedDaemon
+from ..webservices.bussinAPIs import bussinApp, vehicleSession, vehicleEngine, vehicleQuery
+from ..webservices.bussinSnapshots import snapshotCache, loadVehicleSnapshot, readGeneration
+from .helpers import vehicleFeedDir, vehicle
+
+# The snapshot has to give exactly what the database query gives,
+# in the same order, for any bounding box and list of routes.
+def test_snapshot_matches_query():
+    snapshot = loadVehicleSnapshot(vehicleEngine, readGeneration(vehicleEngine))
+    assert snapshot.size == 20
+
+    cases = [ (None, None, None, None, None),
+              (-5.0, None, None, None, None),
+              (-5.0, -3.0, 4.5, 8.0, None),
+              (0.0, 0.0, 0.0, 0.0, None),
+              (None, None, None, None, [ 'BUS01', 'BUS02', 'BUS03' ]),
+              (-8.0, None, 2.0, None, [ 'BUS01', 'BUS05', 'NOPE' ]),
+              (None, None, None, None, [ '' ]),
+              (50.0, 50.0, 60.0, 60.0, None) ]
+
+    for minLat, minLon, maxLat, maxLon, routes in cases :
+        db = vehicleSession()
+        try :
+            expected = [ dict(row._mapping) for row in vehicleQuery(db, minLat, minLon, maxLat, maxLon, routes).all() ]
+        finally :
+            db.close()
+        got = snapshot.rows(snapshot.select(minLat, minLon, maxLat, maxLon, routes, limit=1000))
+        assert got == expected
+
+def test_snapshot_limit():
+    snapshot = loadVehicleSnapshot(vehicleEngine, readGeneration(vehicleEngine))
+    assert len(snapshot.select(limit=5)) == 5
+
+# The snapshot is only reloaded when the ingest publishes a new generation.
+def test_snapshot_reloads_on_new_generation(tmp_path):
+    vehicleModule = feedDaemon.loadFeedModule(vehicleFeedDir)
+    engine = vehicleModule.makeEngine(os.path.join(tmp_path, "database.db"))
+
+    try :
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.0), vehicle("V2", 2.0) ], 1000)
+        cache = snapshotCache(engine, loadVehicleSnapshot, 0.0)
+        first = cache.refresh()
+        assert first.size == 2
+
+        # Nothing new was published, so we keep the snapshot we have.
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.0), vehicle("V2", 2.0) ], 1010)
+        assert cache.refresh() is first
+
+        # Now something changed.
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.5) ], 1020)
+        second = cache.refresh()
+        assert second is not first
+        assert second.generation > first.generation
+        assert second.rows(second.select()) == [ { 'route' : 'R1', 'timestamp' : 100, 'current_status' : 2,
+                                                   'lat' : 1.5, 'lon' : 1.0, 'bearing' : 0.0 } ]
+    finally :
+        engine.dispose()
+
+# A client that sends back the token from last time gets just what changed.
+def test_vehicle_deltas(tmp_path):
+    vehicleModule = feedDaemon.loadFeedModule(vehicleFeedDir)
+    engine = vehicleModule.makeEngine(os.path.join(tmp_path, "database.db"))
+
+    try :
+        cache = snapshotCache(engine, loadVehicleSnapshot, 0.0)
+        vehicleModule.writeDatabase(engine, [ vehicle("V1", 1.0), vehicle("V2", 2.0), vehicle("V3", 3.0) ], 1000)
+        first = cache.refresh()
+
+        # Starting out, or with a token we don't know, we get everything.
+        for since in [ "0", "junk", "1-1" ] :
+            delta = first.delta(since)
+            assert delta['full']
+            assert [ v['vehicleid'] for v in delta['vehicles'] ] == [ "V1", "V2", "V3" ]
+        assert first.delta(first.token) == { "token" : first.token, "full" : False, "vehicles" : [], "removed" : [] }
+
+        # V1 goes, V2 moves, V3 stays put and V4 is new.
+        vehicleModule.writeDatabase(engine, [ vehicle("V2", 2.5), vehicle("V3", 3.0), vehicle("V4", 4.0) ], 1010)
+        second = cache.refresh()
+        delta = second.delta(first.token)
+        assert not delta['full']
+        assert delta['token'] == second.token
+        assert [ (v['vehicleid'], v['lat']) for v in delta['vehicles'] ] == [ ("V2", 2.5), ("V4", 4.0) ]
+        assert delta['removed'] == [ "V1" ]
+
+        # Vehicles that changed and are now outside the area (or not on
+        # the routes asked for) are removed as far as the client is concerned.
+        vehicleModule.writeDatabase(engine, [ vehicle("V2", 9.0), vehicle("V3", 3.0), vehicle("V4", 4.0, 'R2') ], 1020)
+        third = cache.refresh()
+        delta = third.delta(first.token, maxLat=5.0, routes=[ 'R1' ])
+        assert delta['vehicles'] == []
+        assert delta['removed'] == [ "V1", "V2", "V4" ]
+
+        # Only the last few generations are kept, after that it's everything again.
+        for i in range(vehicleModule.changeRingSize) :
+            vehicleModule.writeDatabase(engine, [ vehicle("V3", 10.0 + i) ], 2000 + i)
+        assert cache.refresh().delta(first.token)['full']
+    finally :
+        engine.dispose()
+
+def test_vehicle_delta_API():
+    client = TestClient(bussinApp)
+    response = client.get("/vehicleService?routesCSV=bus01,Bus02,BUS03&since=0")
+    delta = response.json()
+    assert delta['full']
+    assert sorted(v['vehicleid'] for v in delta['vehicles']) == [ 'VEH01', 'VEH02', 'VEH03' ]
+
+    # Nothing changes in the test database, so next time there's nothing to send.
+    response = client.get("/vehicleService?routesCSV=bus01,Bus02,BUS03&since=" + delta['token'])
+    assert response.json() == { "token" : delta['token'], "full" : False, "vehicles" : [], "removed" : [] }
+
+# Clusters have all the vehicles in the area between them, each one where its vehicles are on average.
+def test_vehicle_clusters():
+    snapshot = loadVehicleSnapshot(vehicleEngine, readGeneration(vehicleEngine))
+    for cellDeg in [ 0.5, 2.0, 100.0 ] :
+        indices = snapshot.select(minLat=-5.0)
+        clusters = snapshot.clusters(indices, cellDeg)
+        assert sum(c['count'] for c in clusters) == len(indices)
+        for cluster in clusters :
+            inCell = [ i for i in indices if (snapshot.lat[i] // cellDeg, snapshot.lon[i] // cellDeg) ==
+                       (cluster['lat'] // cellDeg, cluster['lon'] // cellDeg) ]
+            assert len(inCell) == cluster['count']
+    assert snapshot.clusters(snapshot.select(routes=[ 'NOPE' ]), 1.0) == []
+
+    client = TestClient(bussinApp)
+    clusters = client.get("/vehicleService?minLat=-5.0&clusterDeg=2.0").json()
+    assert clusters == snapshot.clusters(snapshot.select(minLat=-5.0), 2.0)
+    assert client.get("/vehicleService?clusterDeg=0").status_code == 422
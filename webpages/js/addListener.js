@@ -10,3 +10,9 @@ document.getElementById("routeBox").addEventListener("keydown", function(event)
   }
 });
 
+
+// Get the routes that are running when the route box is clicked
+// on, so they are up to date when they are offered as suggestions.
+document.getElementById("routeBox").addEventListener("focus", function(event) {
+  loadRunningRoutes();
+});
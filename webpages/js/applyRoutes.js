@@ -6,7 +6,48 @@ function applyRoutes(){
   document.getElementById("routePara").innerHTML="";
  } else {
   document.getElementById("routePara").innerHTML="Filtering for routes : <B>" + routesCSV + "</b>";
+
+  // Say if any of the routes don't have vehicles on them, which
+  // is usually because the route name was mistyped.
+  let notRunning = new Array();
+  for (const route of routesCSV.toUpperCase().split(',')){
+   if (route.trim().length > 0 && !(route.trim() in runningRoutes)){
+    notRunning.push(route.trim());
+   }
+  }
+  if (notRunning.length > 0 && Object.keys(runningRoutes).length > 0){
+   document.getElementById("routePara").innerHTML += "<br>No vehicles on route " + notRunning.join(', ') + " right now";
+  }
  }
  vehicleUpdateSec=0;
  return;
 }
+
+// Get the routes that have vehicles on them from the route service,
+// and offer them as suggestions in the route box.
+async function loadRunningRoutes(){
+
+ let response = await fetch(config['webservicesURL'] + "/routeService");
+ if (response.status != 200) {
+   return;
+ }
+
+ // What we get looks like this :
+ // [
+ //   {
+ //     "route": "BOLT",
+ //     "vehicles": 4
+ //   }
+ // ]
+ let routes = JSON.parse(await response.text());
+
+ runningRoutes = {};
+ let options = "";
+ for (const route of routes){
+  runningRoutes[route['route']] = route['vehicles'];
+  options += "<option value=\"" + route['route'] + "\">" + route['vehicles'] + " vehicles</option>";
+ }
+ document.getElementById("routeList").innerHTML = options;
+
+ return;
+}
@@ -0,0 +1,45 @@
+// The area of the map, for the URLs we ask the server for things in it.
+//
+// Every time the map moves a little, the area is a little different, so if
+// we put it in the URLs as it is, no two browsers (or the same browser a
+// minute later) ever ask for quite the same URL and nothing in between can
+// keep what the server sent. Instead we make the area a little bigger, out
+// to a grid bboxGridDeg degrees on a side (from the config, default 0.01),
+// so that maps that are nearly in the same place ask for the same URL, and
+// nginx's cache in front of the server (whose keys are the URLs) answers
+// most of them without the server working it out again.
+
+// Small function to get the grid size, and how many decimal places
+// it takes to write a point on it.
+function bboxGrid(){
+ let gridDeg = config['bboxGridDeg'];
+ if (gridDeg == undefined){
+  gridDeg = 0.01;
+ }
+ let places = 0;
+ if (gridDeg > 0){
+  places = Math.min(Math.max(Math.ceil(-Math.log10(gridDeg)), 0), 8);
+ }
+ return [gridDeg, places];
+}
+
+// Returns the area of the map (Leaflet bounds) snapped outwards to the grid,
+// as [minLat, minLon, maxLat, maxLon], each a string so the URLs come out
+// the same every time.
+function snapBounds(bounds){
+ let sw = bounds.getSouthWest();
+ let ne = bounds.getNorthEast();
+ let [gridDeg, places] = bboxGrid();
+ if (gridDeg <= 0){
+  return [String(sw.lat), String(sw.lng), String(ne.lat), String(ne.lng)];
+ }
+ let down = x => (Math.floor(x / gridDeg) * gridDeg).toFixed(places);
+ let up   = x => (Math.ceil(x / gridDeg) * gridDeg).toFixed(places);
+ return [down(sw.lat), down(sw.lng), up(ne.lat), up(ne.lng)];
+}
+
+// Returns the query string for the area of the map, snapped to the grid.
+function boundsQuery(bounds){
+ let [minLat, minLon, maxLat, maxLon] = snapBounds(bounds);
+ return "minLat=" + minLat + "&minLon=" + minLon + "&maxLat=" + maxLat + "&maxLon=" + maxLon;
+}
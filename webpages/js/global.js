@@ -4,8 +4,30 @@ var map;
 // The config we get from the JSON on the server.
 var config;
 
-// The vehicle markers we put on the map.
-var vehicleMarkers = new Array();
+// The vehicle markers we put on the map, keyed by vehicle ID.
+var vehicleMarkers = {};
+
+// The token the vehicle service gave us last time, which we send back
+// to get just the vehicles that changed since then, and the request
+// (area and routes) it was for.
+var vehicleToken = "";
+var vehicleRequest = "";
+
+// The vehicle cluster markers we put on the map when there are
+// too many vehicles to show, the request (area and routes) there
+// were too many vehicles for, and roughly how many cells high
+// the grid the vehicles are gathered into is.
+var vehicleClusterMarkers = new Array();
+var vehicleClusterRequest = "";
+var clusterCells = 12;
+
+// The server-sent event streams we get vehicle and arrival updates on,
+// if the browser can do them (otherwise we ask every so often).
+var vehicleStream = null;
+var tripStream = null;
+
+// The arrivals at the monitored station we last got.
+var monitoredArrivals = [];
 
 // The number of seconds until we update the vehicles on the map.
 var vehicleUpdateSec=0;
@@ -28,3 +50,6 @@ var monitorUpdateSec = 0;
 // Comma separated list of routes, if any
 var routesCSV = "";
 
+// The routes that have vehicles on them, and how many, from the route service.
+var runningRoutes = {};
+
@@ -2,6 +2,9 @@
 // Start monitoring a bus station.
 function monitorStart(indx){
 
+ // Stop listening for arrivals at the last station, if we were.
+ closeTripStream();
+
  // Set the global vars.
  monitoredStationDetails = stationDetails[indx];
 
@@ -26,6 +29,8 @@ function monitorStart(indx){
 // Stop monitoring.
 function monitorEnd(){
 
+ closeTripStream();
+
  document.getElementById('monitorStopPara').innerHTML ='';
  document.getElementById('monitorUpdatePara').innerHTML ='';
  document.getElementById('monitorPara').innerHTML ='';
@@ -36,6 +41,19 @@ function monitorEnd(){
 
 }
 
+// Stop listening to the arrivals stream, if we are.
+function closeTripStream(){
+
+ if (tripStream != null){
+  tripStream.close();
+  tripStream = null;
+ }
+ monitoredArrivals = [];
+
+ return;
+
+}
+
 // Monitor the selected station - look for updates
 // as appropriate.
 async function monitor(){
@@ -49,6 +67,25 @@ async function monitor(){
  // We're still monitoring. We will be back in 1 second.
  setTimeout(monitor,1000);
 
+ // If the browser can do server-sent events, subscribe to the arrivals
+ // at the station and the server sends them whenever they change. In
+ // between we draw them again every second, so the minutes count down
+ // and the buses that have come and gone drop off.
+ if (!!window.EventSource){
+  if (tripStream == null){
+   tripStream = new EventSource(config['webservicesURL'] + "/tripStream?stopID=" +
+                                monitoredStationDetails['stopid']);
+   tripStream.addEventListener("arrivals", function(event) {
+    monitoredArrivals = JSON.parse(event.data);
+    showArrivals(monitoredArrivals);
+   });
+  }
+  document.getElementById('monitorUpdatePara').innerHTML = "Watching for updates on stop " +
+   monitoredStationDetails['stopid'];
+  showArrivals(monitoredArrivals);
+  return;
+ }
+
  // Do we still have time before an update?
  // If so then tell the user and return.
  if (monitorUpdateSec > 0){
@@ -84,6 +121,15 @@ async function monitor(){
    return;
  }
 
+ showArrivals(arrivals);
+
+ return;
+
+}
+
+// Show the arrivals at the monitored station.
+function showArrivals(arrivals){
+
  // Arrivals data looks like :
  // [
  //   {
@@ -105,6 +151,7 @@ async function monitor(){
  // ] 
 
  let current_sec = Math.floor(Date.now() / 1000);
+ arrivals = arrivals.filter(arrival => arrival['arrivaltime'] >= current_sec);
  let ar = timeFormat(current_sec);
  let tmStr = ar[0];
 
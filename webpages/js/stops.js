@@ -3,36 +3,21 @@
 async function drawStops(){
 
 
-    // Check if map is zoomed out too far to even try
+    // We ask for the stops that are shown at the map's zoom level, which
+    // the server spreads out evenly over the map, so there are fewer of
+    // them, further apart, as we zoom out.
     mapZoom = map.getZoom();
-    if (mapZoom < config['minZoomForStations']){
-      removeStops();
-      document.getElementById('stopInfoPara').innerHTML = 'Map is zoomed out to level ' + mapZoom +
-         ' need to zoom in to level ' + config['minZoomForStations'] + ' to show stops.';
-      return;
-    }
 
     let bounds = map.getBounds();
-    let sw = bounds.getSouthWest();
-    let ne = bounds.getNorthEast();
-
-    let url=config['webservicesURL'] + "/busStopService?minLat=" +
-      sw.lat + "&minLon=" + sw.lng + "&maxLat=" + ne.lat + "&maxLon=" + ne.lng;
-
-    let response = await fetch(url);
-
-    if (response.status != 200) {
-      alert(response.statusText);
-      return;
-    }
-
-    let responseText = await response.text();
 
-    try {
-      stationDetails = JSON.parse(responseText);
-    } catch (error) {
-      alert("Error parsing vehicle JSON:", error.message);
-      return;
+    // If the server has the stops as tiles, get the tiles the map covers,
+    // which the browser can keep, otherwise ask for the stops in the area.
+    stationDetails = await fetchStopTiles(bounds);
+    if (stationDetails == null){
+      stationDetails = await fetchStops(bounds);
+      if (stationDetails == null){
+        return;
+      }
     }
 
     // What we have in the global var stationDetails looks like :
@@ -53,12 +38,12 @@ async function drawStops(){
     //  }
     // ]
 
-    // Are there just too many stops to show?
-    if (stationDetails.length > config['maxStations']){
-      removeStops();
-      document.getElementById('stopInfoPara').innerHTML = "There are " + stationDetails.length +
-        " stops in the region, the limit is " + config['maxStations'] + ", not showing stops, try zooming in.";
-      return;
+    // Are there just too many stops to show? If so only show the first of
+    // them, which are the ones the server shows from the lowest zoom level,
+    // so they are still spread out over the map.
+    let numStops = stationDetails.length;
+    if (numStops > config['maxStations']){
+      stationDetails = stationDetails.slice(0, config['maxStations']);
     }
 
     var stationIcon = L.icon({
@@ -88,6 +73,9 @@ async function drawStops(){
                 });
 
     document.getElementById('stopInfoPara').innerHTML = 'Displaying ' + stationMarkers.length + ' stops';
+    if (numStops > stationMarkers.length){
+      document.getElementById('stopInfoPara').innerHTML += ' of ' + numStops + ', zoom in to see more';
+    }
 
 
 
@@ -95,6 +83,118 @@ async function drawStops(){
 
 }
 
+// Get the stops in the area of the map from the bus stop end point.
+// Returns null if that didn't work.
+async function fetchStops(bounds){
+
+    // The area is snapped to a grid (see bbox.js) so that
+    // everyone looking at about the same place asks for the same URL.
+    let url=config['webservicesURL'] + "/busStopService?" + boundsQuery(bounds) + "&zoom=" + mapZoom;
+
+    let response = await fetch(url);
+
+    if (response.status != 200) {
+      alert(response.statusText);
+      return null;
+    }
+
+    let responseText = await response.text();
+
+    // The area asked for was snapped outwards, so keep the stops that are on
+    // the map, still in the order the server sent them, so the ones off the
+    // edge don't take up places under maxStations.
+    try {
+      return JSON.parse(responseText).filter(stop => bounds.contains([stop['lat'], stop['lon']]));
+    } catch (error) {
+      alert("Error parsing stop JSON:", error.message);
+      return null;
+    }
+
+}
+
+// The version and zoom levels of the stop tiles, from the stop tile
+// service, or null if we haven't got them (or there weren't any tiles).
+var stopTileInfo = null;
+
+// Small function to get the version and zoom levels of the stop tiles, from
+// the stop tile service unless we already have them. Returns null if there
+// aren't any tiles.
+async function fetchStopTileInfo(){
+
+    if (stopTileInfo == null){
+      let response = await fetch(config['webservicesURL'] + "/stopTileService");
+      if (response.status != 200) {
+        return null;
+      }
+      let tileInfo = await response.json();
+      if (tileInfo['version'] != null){
+        stopTileInfo = tileInfo;
+      }
+    }
+    return stopTileInfo;
+
+}
+
+// Get the stops in the area of the map from the stop tiles, the slippy
+// map tiles of the stops the server makes when they're updated. Returns
+// null if there aren't any tiles for the map's zoom level (or they've just
+// been updated and even the new version isn't there), so we ask for the
+// area instead. The version is only asked for again when a tile isn't found,
+// which is what happens when the stops are updated.
+async function fetchStopTiles(bounds){
+
+    for (let attempt = 0; attempt < 2; attempt++){
+      let tileInfo = await fetchStopTileInfo();
+      // There aren't tiles for the lowest zoom levels.
+      if (tileInfo == null || Math.floor(mapZoom) < tileInfo['minZoom']){
+        return null;
+      }
+      let stops = await fetchTileStops(bounds, tileInfo);
+      if (stops != null){
+        return stops;
+      }
+      stopTileInfo = null;
+    }
+    return null;
+
+}
+
+// Get the stops in the area of the map from the stop tiles with the
+// version in tileInfo. Returns null if a tile wasn't found.
+async function fetchTileStops(bounds, tileInfo){
+
+    // Past the highest zoom level there are tiles for, every stop is in them.
+    let tileZoom = Math.min(Math.floor(mapZoom), tileInfo['maxZoom']);
+    let numTiles = Math.pow(2, tileZoom);
+    let nw = map.project(bounds.getNorthWest(), tileZoom).divideBy(256).floor();
+    let se = map.project(bounds.getSouthEast(), tileZoom).divideBy(256).floor();
+
+    let urls = [];
+    for (let x = Math.max(nw.x, 0); x <= Math.min(se.x, numTiles - 1); x++){
+      for (let y = Math.max(nw.y, 0); y <= Math.min(se.y, numTiles - 1); y++){
+        urls.push(config['webservicesURL'] + "/stopTiles/" + tileInfo['version'] + "/" + tileZoom + "/" + x + "/" + y);
+      }
+    }
+
+    let tiles = [];
+    try {
+      let responses = await Promise.all(urls.map(url => fetch(url)));
+      if (responses.some(tileResponse => tileResponse.status != 200)){
+        return null;
+      }
+      tiles = await Promise.all(responses.map(tileResponse => tileResponse.json()));
+    } catch (error) {
+      return null;
+    }
+
+    // The tiles cover more than the map, so keep the stops on it, most important
+    // (shown from the lowest zoom level) first, as the bus stop end point does.
+    let stops = tiles.flat().filter(stop => bounds.contains([stop['lat'], stop['lon']]));
+    stops.sort((a, b) => a['minzoom'] - b['minzoom']);
+    return stops;
+
+}
+
 // Remove the bus stop markers from the map.
 function removeStops() {
 
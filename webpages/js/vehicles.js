@@ -22,22 +22,62 @@ async function drawVehicles(){
       mapZoom = map.getZoom();
       if (mapZoom < config['minZoomForVehicles']){
         removeVehicles();
-        document.getElementById('vehicleInfoPara').innerHTML = 'Map is zoomed out to level ' + mapZoom +
-           ' need to zoom in to level ' + config['minZoomForVehicles'] + ' to show vehicles.';
+        closeVehicleStream();
+        vehicleToken = ""; // Start again when we're zoomed back in.
+        vehicleClusterRequest = ""; // And look at the vehicles again then.
+        await drawVehicleClusters('Map is zoomed out to level ' + mapZoom +
+           ' need to zoom in to level ' + config['minZoomForVehicles'] + ' to show vehicles.');
         return;
       }
     }
 
-    let bounds = map.getBounds();
-    let sw = bounds.getSouthWest();
-    let ne = bounds.getNorthEast();
-
-    let url=config['webservicesURL'] + "/vehicleService?minLat=" +
-      sw.lat + "&minLon=" + sw.lng + "&maxLat=" + ne.lat + "&maxLon=" + ne.lng;
+    // The area is snapped to a grid (see bbox.js) so that
+    // everyone looking at about the same place asks for the same URL.
+    let url=config['webservicesURL'] + "/vehicleService?" + boundsQuery(map.getBounds());
     if (routesCSV.length > 0){
       url += "&routesCSV=" + routesCSV;
     }
 
+    // If there were too many vehicles to show the last time we
+    // looked at this area, go straight to the clusters. Once the map
+    // moves (or the routes change) we forget that, so coming back
+    // here looks at the vehicles again.
+    if (url == vehicleClusterRequest){
+      await drawVehicleClusters(tooManyVehicles());
+      return;
+    }
+    vehicleClusterRequest = "";
+
+    // If the browser can do server-sent events, subscribe to the vehicles
+    // in the area and the server sends us the changes as they happen, in
+    // the same format as below. We only have to subscribe again if the
+    // map moved or the routes changed. The browser reconnects by itself
+    // if the connection drops, and we start again with everything then.
+    if (!!window.EventSource){
+      if (url != vehicleRequest || vehicleStream == null){
+        closeVehicleStream();
+        vehicleRequest = url;
+        vehicleStream = new EventSource(url.replace("/vehicleService?", "/vehicleStream?"));
+        vehicleStream.addEventListener("vehicles", function(event) {
+          applyVehicleDelta(JSON.parse(event.data));
+        });
+      }
+      return;
+    }
+
+    // If we're asking about the same area and routes as last time, send
+    // back the token we got so we only get the vehicles that changed.
+    // Otherwise (the map moved, or the routes changed) start again.
+    if (url != vehicleRequest){
+      vehicleRequest = url;
+      vehicleToken = "";
+    }
+    if (vehicleToken.length > 0){
+      url += "&since=" + vehicleToken;
+    } else {
+      url += "&since=0";
+    }
+
     let response = await fetch(url);
 
     if (response.status != 200) {
@@ -48,66 +88,92 @@ async function drawVehicles(){
     let responseText = await response.text();
 
     try {
-      var vehicles = JSON.parse(responseText);
+      var delta = JSON.parse(responseText);
     } catch (error) {
       alert("Error parsing vehicle JSON:", error.message);
       return;
     }
 
+    applyVehicleDelta(delta);
+
+    return;
+
+}
+
+// Bring the vehicles on the map up to date with what
+// the vehicle service (or stream) sent us.
+function applyVehicleDelta(delta){
+
     // What we got should look like this :
-    // [
-    //  {
-    //    "route": "WEST",
-    //    "timestamp": 1769905251,
-    //    "current_status": 2,
-    //    "lat": 39.063350677490234,
-    //    "lon": -108.56390380859375,
-    //    "bearing": 79
-    //  },
-    //  {
-    //    "route": "SOUT",
-    //    "timestamp": 1769905235,
-    //    "current_status": 2,
-    //    "lat": 39.53459930419922,
-    //    "lon": -104.8725814819336,
-    //    "bearing": 269
-    //  }
-    // ]
+    // {
+    //  "token": "1234-1769905260",
+    //  "full": false,
+    //  "vehicles": [
+    //   {
+    //     "route": "WEST",
+    //     "timestamp": 1769905251,
+    //     "current_status": 2,
+    //     "lat": 39.063350677490234,
+    //     "lon": -108.56390380859375,
+    //     "bearing": 79,
+    //     "vehicleid": "3021"
+    //   }
+    //  ],
+    //  "removed": [ "3007", "3110" ]
+    // }
+    //
+    // If full is true, vehicles is all the vehicles in the area and we
+    // start again, otherwise it's just the vehicles that were added or
+    // changed since the token we sent, and removed has the vehicles
+    // that we should take off the map.
+    if (delta['full']){
+      removeVehicles();
+    }
+    for (const vehicleID of delta['removed']){
+      removeVehicle(vehicleID);
+    }
+    vehicleToken = delta['token'];
 
     // Are there just too many vehicles to show?
-    if (vehicles.length > config['maxVehicles']){
+    let numVehicles = Object.keys(vehicleMarkers).length;
+    for (const vehicle of delta['vehicles']){
+      if (!(vehicle['vehicleid'] in vehicleMarkers)){
+        numVehicles += 1;
+      }
+    }
+    if (numVehicles > config['maxVehicles']){
+      vehicleClusterRequest = vehicleRequest;
       removeVehicles();
-      document.getElementById('vehicleInfoPara').innerHTML = "There are " + vehicles.length +
-        " vehicles in the region, the limit is " + config['maxVehicles'] + ", not showing vehicles, try zooming in.";
+      closeVehicleStream();
+      vehicleToken = ""; // Start again next time.
+      drawVehicleClusters(tooManyVehicles());
       return;
     }
+    removeVehicleClusters();
 
     // Get the data into the vehicleLocs array
     let vehicleLocs = new Array();
-    for (const vehicle of vehicles){
+    for (const vehicle of delta['vehicles']){
        pos = [vehicle['lat'], vehicle['lon']];
-       im='Yes';
-       if (vehicle['current_status'] != 2){ // current_status == 2 => in motion
-        im='No';
-       }
 
-       let tArray=timeFormat(vehicle['timestamp']);
-       let tmStr=tArray[0];
-       let tRel=tArray[1];
+       // The status is put together when the popup is opened, since a
+       // marker now stays on the map until its vehicle changes and
+       // "2 minutes ago" wouldn't stay right for long.
+       let status = function() { return vehicleStatus(vehicle); };
 
-       status = '<B>Route ' + vehicle['route'] + '</b>' + " bearing " + Math.round(vehicle['bearing']) +
-           "<br>Time : " + tmStr + "<br>" + tRel + "<br>In motion : " + im;
-
-       v = { "pos": pos, "status": status, "bearing": vehicle['bearing'], "current_status": vehicle['current_status'] };
+       v = { "vehicleid": vehicle['vehicleid'], "pos": pos, "status": status, "bearing": vehicle['bearing'],
+             "current_status": vehicle['current_status'] };
 
       vehicleLocs.push(v);
     }
 
 
-    removeVehicles(); // Remove any existing markers
-    // Go through the information in vehicleLocs and put the markers on the map.
+    // Go through the information in vehicleLocs and put the markers on the map,
+    // replacing the markers we have for any vehicles that changed.
     vehicleLocs.forEach(vehicleLoc => {
 
+           removeVehicle(vehicleLoc['vehicleid']);
+
            fullFile= config['webservicesURL'] + '/icons/stopped_bus.png';
            if (vehicleLoc['current_status'] == 2){
                af=arrow(vehicleLoc['bearing']);
@@ -124,22 +190,143 @@ async function drawVehicles(){
            let m = L.marker(vehicleLoc['pos'], {icon: vehicleIcon}) // Create a new marker
                   .addTo(map) // Add the marker to the map
                   .bindPopup(vehicleLoc['status']); // Bind a clickable popup with the status message we put together
-           vehicleMarkers.push(m);
+           vehicleMarkers[vehicleLoc['vehicleid']] = m;
                 });
 
-    document.getElementById('vehicleInfoPara').innerHTML = 'Displaying ' + vehicleMarkers.length + ' vehicles';
+    document.getElementById('vehicleInfoPara').innerHTML = 'Displaying ' + Object.keys(vehicleMarkers).length + ' vehicles';
 
     return;
 
 }
 
+// What we say when there are too many vehicles to show.
+function tooManyVehicles(){
+ return "There are more than " + config['maxVehicles'] + " vehicles in the region, showing clusters of vehicles, try zooming in.";
+}
+
+// Show clusters of vehicles rather than the vehicles themselves, for
+// when the map is zoomed out too far or there are too many vehicles.
+// The server gathers the vehicles into a grid of cells over the map
+// and sends back how many vehicles there are in each cell (and where
+// they are on average), so there's not much to send. The message is
+// what to say about why we're doing this.
+async function drawVehicleClusters(message){
+
+    let bounds = map.getBounds();
+
+    // About clusterCells cells from the top of the map to the bottom,
+    // worked out from the snapped area so it's the same when that is.
+    let [minLat, minLon, maxLat, maxLon] = snapBounds(bounds);
+    let clusterDeg = ((maxLat - minLat) / clusterCells).toPrecision(3);
+
+    let url=config['webservicesURL'] + "/vehicleService?" + boundsQuery(bounds) +
+      "&clusterDeg=" + clusterDeg;
+    if (routesCSV.length > 0){
+      url += "&routesCSV=" + routesCSV;
+    }
+
+    let response = await fetch(url);
+
+    if (response.status != 200) {
+      alert(response.statusText);
+      return;
+    }
+
+    let responseText = await response.text();
+
+    try {
+      var clusters = JSON.parse(responseText);
+    } catch (error) {
+      alert("Error parsing vehicle cluster JSON:", error.message);
+      return;
+    }
+
+    // What we got should look like this :
+    // [
+    //   {
+    //     "lat": 39.74529,
+    //     "lon": -104.99183,
+    //     "count": 37
+    //   }
+    // ]
+    removeVehicleClusters();
+    let numVehicles = 0;
+    for (const cluster of clusters){
+      let m = L.circleMarker([cluster['lat'], cluster['lon']], {radius: 8 + 2 * Math.log2(cluster['count'])})
+             .bindTooltip(String(cluster['count']), {permanent: true, direction: 'center'})
+             .addTo(map);
+      vehicleClusterMarkers.push(m);
+      numVehicles += cluster['count'];
+    }
+
+    document.getElementById('vehicleInfoPara').innerHTML = message + '<br>Displaying ' + numVehicles +
+      ' vehicles in ' + clusters.length + ' clusters';
+
+    return;
+
+}
+
+// Remove the vehicle cluster markers from the map.
+function removeVehicleClusters() {
+
+ vehicleClusterMarkers.forEach(clusterMarker => {
+  clusterMarker.remove();
+ });
+ vehicleClusterMarkers = new Array();
+
+ return;
+
+}
+
+// Put together the status message for a vehicle's popup.
+function vehicleStatus(vehicle) {
+
+ im='Yes';
+ if (vehicle['current_status'] != 2){ // current_status == 2 => in motion
+  im='No';
+ }
+
+ let tArray=timeFormat(vehicle['timestamp']);
+ let tmStr=tArray[0];
+ let tRel=tArray[1];
+
+ return '<B>Route ' + vehicle['route'] + '</b>' + " bearing " + Math.round(vehicle['bearing']) +
+     "<br>Time : " + tmStr + "<br>" + tRel + "<br>In motion : " + im;
+
+}
+
+// Stop listening to the vehicle stream, if we are.
+function closeVehicleStream() {
+
+ if (vehicleStream != null){
+  vehicleStream.close();
+  vehicleStream = null;
+ }
+ vehicleRequest = "";
+
+ return;
+
+}
+
 // Remove the vehicle markers from the map.
 function removeVehicles() {
 
- vehicleMarkers.forEach(vehicleMarker => {
+ Object.values(vehicleMarkers).forEach(vehicleMarker => {
   vehicleMarker.remove();
  });                      
- vehicleMarkers = new Array();
+ vehicleMarkers = {};
+
+ return;
+
+}
+
+// Remove the marker for one vehicle from the map, if we have one.
+function removeVehicle(vehicleID) {
+
+ if (vehicleID in vehicleMarkers){
+  vehicleMarkers[vehicleID].remove();
+  delete vehicleMarkers[vehicleID];
+ }
 
  return;
 
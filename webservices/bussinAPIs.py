@@ -1,15 +1,35 @@
 #!/usr/bin/env python
 
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request, Response
 from pydantic import BaseModel
+from pydantic_core import to_json
 from typing import List
 
 import os
-import time
+import asyncio
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+
+# The in memory snapshots. uvicorn loads this file as a top level
+# module from the webservices directory, while the tests import it
+# as part of the package, so try both ways.
+try:
+    from .bussinSnapshots import snapshotCache, loadVehicleSnapshot, loadGenerationStamp, vehicleColumns, loadRouteCatalog
+    from .bussinSnapshots import mapVehicleSnapshot, mapRouteCatalog, mapStopSnapshot, mapArrivalSnapshot, stopSnapshot, arrivalSnapshot, snapshotFileFor
+    from .bussinSnapshots import stopTilePack, mapStopTilePack, stopTileFileFor
+    from .bussinPush import generationWatcher, sseEvent, keepAlive
+    from .bussinCache import responseCache
+except ImportError:
+    from bussinSnapshots import snapshotCache, loadVehicleSnapshot, loadGenerationStamp, vehicleColumns, loadRouteCatalog
+    from bussinSnapshots import mapVehicleSnapshot, mapRouteCatalog, mapStopSnapshot, mapArrivalSnapshot, stopSnapshot, arrivalSnapshot, snapshotFileFor
+    from bussinSnapshots import stopTilePack, mapStopTilePack, stopTileFileFor
+    from bussinPush import generationWatcher, sseEvent, keepAlive
+    from bussinCache import responseCache
 
 # Database imports.
-from sqlalchemy import create_engine, Column, String, Float, Integer, UniqueConstraint, or_
+from sqlalchemy import create_engine, inspect, Index, literal_column, Column, String, Float, Integer, UniqueConstraint
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.dialects.mysql import BIGINT
@@ -22,17 +42,10 @@ from sqlalchemy.dialects.mysql import BIGINT
 
 # Now we do this instead :
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 # so we can serve out the static files on the same port so
 # there's no issue that needs middleware.
 
-# Small function that waits if a file exists.
-# We do this to be sure we don't access a database while it's
-# being updated.
-def waitOnFile(file) :
-    while os.path.exists(file) :
-        time.sleep(0.25)
-    return
-
 # Set up tags that appear in the documentation pages that FastAPI generates.
 tags_metadata = [
     {
@@ -45,28 +58,360 @@ tags_metadata = [
     },
     {
         "name":"bus-stop-service",
-        "description":"Serves out locations and descriptions of bus stops in a specified area. For RTD, test with a minimum latitude of 40 (Baseline road). A hard coded limit of 1000 stops returned is imposed."
+        "description":"Serves out locations and descriptions of bus stops in a specified area. For RTD, test with a minimum latitude of 40 (Baseline road). A hard coded limit of 1000 stops returned is imposed. If zoom is given, only the stops shown at that map zoom level are served out, which are spread evenly over the map, most important (shown from the lowest zoom level) first."
     },
     {
         "name":"vehicle-service",
-        "description":"Serves out locations and descriptions of vehicles in a specified area. For the current_status field, 2=Moving 1=Stopped. Can also specify a comma separated list of routes (default is all routes). Internally spaces are removed from the list of routes and it is converted to upper case, so that \"bolt, jump\" becomes \"BOLT,JUMP\". To test for RTD, enter a minimum latitude of 40 (Baseline road). A hard coded limit of 1000 vehicles returned is imposed."
+        "description":"Serves out locations and descriptions of vehicles in a specified area. For the current_status field, 2=Moving 1=Stopped. Can also specify a comma separated list of routes (default is all routes). Internally spaces are removed from the list of routes and it is converted to upper case, so that \"bolt, jump\" becomes \"BOLT,JUMP\". To test for RTD, enter a minimum latitude of 40 (Baseline road). A hard coded limit of 1000 vehicles returned is imposed. If since is given (start with since=0), only the vehicles that were added, changed or removed since the generation with that token are served out, along with the token to send next time. For slow links, format=columns (or an Accept header of application/vnd.bussin.columns+json) serves the vehicles out as one list per column, with the routes dictionary encoded and lat/lon as whole numbers of 1/scale degrees. For maps that are zoomed out, clusterDeg gathers the vehicles into a grid of cells that many degrees on a side and serves out, for each cell with vehicles in it, the number of vehicles and their mean position (the 1000 vehicle limit doesn't apply)."
+    },
+    {
+        "name":"route-service",
+        "description":"Serves out the routes that have vehicles on them right now, and how many vehicles are on each, in route order. These are the route names the vehicle service's routesCSV takes."
     },
     {
         "name":"trip-service",
-        "description":"Serves out trip updates for a specified stop ID. Union Station in Denver has stop ID 34343 which may be a good test for that region."
+        "description":"Serves out trip updates for a specified stop ID. Union Station in Denver has stop ID 34343 which may be a good test for that region. The multi stop end point takes a comma separated list of up to 100 stop IDs (and optionally a limit on the number of arrivals for each stop) and serves out the arrivals at each of them, in the order asked for, from one query."
+    },
+    {
+        "name":"stop-tile-service",
+        "description":"Serves out the bus stops as slippy map tiles, made when the stops are updated. The stop tile service gives the version of the tiles and the lowest and highest zoom levels there are tiles for (at higher zoom levels, use the tiles at the highest one, and at lower ones, the bus stop service), or a version of null if there aren't any. A tile at /stopTiles/{version}/{z}/{x}/{y} has the stops in it that are shown at zoom z, most important first, as the bus stop service serves them out plus the minzoom of each. Since the version is in the URL, tiles never change and can be cached for good, and an old version is not found."
+    },
+    {
+        "name":"cache-stats",
+        "description":"Serves out the counters of the response cache that the bus stop and vehicle end points keep - hits, misses, requests that waited on someone else's miss (coalesced), evictions and errors - along with how full it is and the hit rate."
     }
    ]
 
+# Where our settings come from. Normally that's the environment (which
+# start_server.sh sets up from environment.vars) and we run in the
+# webservices directory of the agency's tree. bussinHost.py, which serves
+# several agencies from one process, loads a copy of this module for each
+# agency and sets hostedAgency to a dictionary with that agency's
+# environment.vars settings (env) and the top of its tree (topDir).
+hostedAgency = globals().get('hostedAgency')
+agencyEnv = os.environ
+topDir = '..'
+if hostedAgency is not None :
+    agencyEnv = hostedAgency['env']
+    topDir = hostedAgency['topDir']
+
 try:
-    agency_name = os.environ["BFR_AGENCY_NAME"]
+    agency_name = agencyEnv["BFR_AGENCY_NAME"]
 except KeyError:
     print("Error: BFR_AGENCY_NAME environment variable not set.")
     quit()
 agency_name=agency_name.lower()
 
-# Get a FastAPI application object
+# Database setup. This is done once, when the worker process loads this
+# module, rather than on every request - building the ORM classes, engines
+# and session factories on every call cost more than the query itself
+# once a few hundred browsers were polling.
+#
+# Which databases we read depends on if we're in testing mode, which
+# is set through the BFR_TEST_MODE env var (which has to be set to either ON or TRUE
+# (case insensitive) to activate test mode). It is read once, at startup.
+testMode=False
+test_env = agencyEnv.get('BFR_TEST_MODE', 'OFF')
+if test_env.lower() == 'on' or test_env.lower() == 'true' :
+    testMode=True
+
+db_dir='databases'
+if testMode :
+    db_dir='test_databases'
+
+# Database table ORM models.
+Base = declarative_base()
+
+class stopsTable(Base):
+    __tablename__='stops'
+    stopid   = Column(String, nullable=False, primary_key=True)
+    stopname = Column(String, nullable=False)
+    stopdesc = Column(String, nullable=False)
+    lat      = Column(Float,  nullable=False)
+    lon      = Column(Float,  nullable=False)
+    minzoom  = Column(Integer, nullable=False, server_default='0')
+    __table_args__ = (UniqueConstraint('stopid', name='unique_constraint'),)
+
+# The spatial index on the stops table, an sqlite R*Tree virtual table
+# that databases/stops/update_db.py builds. id is the rowid of the stop
+# in the stops table. The R*Tree stores 32 bit floats, rounded outwards,
+# so it can give us a few stops just outside the box - the filters on the
+# stops table itself still decide what is served out.
+class stopsRtreeTable(Base):
+    __tablename__='stops_rtree'
+    id       = Column(Integer, nullable=False, primary_key=True)
+    minLat   = Column(Float,   nullable=False)
+    maxLat   = Column(Float,   nullable=False)
+    minLon   = Column(Float,   nullable=False)
+    maxLon   = Column(Float,   nullable=False)
+
+class vehiclesTable(Base):
+    __tablename__='vehicles'
+    vehicleid      = Column(String,  nullable=False, primary_key=True)
+    tripid         = Column(String,  nullable=False)
+    route          = Column(String,  nullable=False)
+    schedule_relationship = Column(Integer, nullable=False)
+    direction_id   = Column(Integer, nullable=False)
+    current_status = Column(Integer, nullable=False)
+    timestamp      = Column(BIGINT(unsigned=True), nullable=False)
+    lat            = Column(Float,   nullable=False)
+    lon            = Column(Float,   nullable=False)
+    bearing        = Column(Float,   nullable=False)
+    __table_args__ = (Index('vehicle_route_index', 'route'),)
+
+class tripsTable(Base):
+    __tablename__='intrepid_trips'
+    id             = Column(Integer, nullable=False, primary_key=True)
+    route          = Column(String,  nullable=False)
+    schedule_relationship = Column(Integer, nullable=False)
+    arrivaltime    = Column(BIGINT(unsigned=True), nullable=False)
+    stopid         = Column(String,   nullable=False)
+    # Covering index for the trip service, which looks up the arrivals
+    # at a stop in time order and only wants the route and arrival time.
+    __table_args__ = (Index('stop_arrival_index', 'stopid', 'arrivaltime', 'route'),)
+
+# The queries themselves are synchronous (SQLAlchemy and sqlite), so
+# they are run in a small, bounded pool of threads rather than in the
+# event loop. The number of threads is set by the BFR_DB_THREADS env var.
+dbThreads = int(agencyEnv.get('BFR_DB_THREADS', '4'))
+dbExecutor = ThreadPoolExecutor(max_workers=dbThreads, thread_name_prefix='bussinDB')
+
+# Small function that runs a query in the database thread pool and
+# closes the session (returning the connection to the pool) when done.
+async def runQuery(db, query) :
+    def fetchAll() :
+        try :
+            return query.all()
+        finally :
+            db.close()
+    return await asyncio.get_running_loop().run_in_executor(dbExecutor, fetchAll)
+
+# Small function that makes the session factory for one of the
+# databases (stops, vehicles or trip_updates). The engine behind the
+# session factory keeps a pool of connections that are handed out to
+# requests and go back into the pool when the session is closed.
+# check_same_thread is turned off since a pooled connection may be
+# used by a different thread than the one that opened it.
+#
+# The databases are in WAL mode (the update scripts set that up) and
+# new data are swapped in within a single transaction, so we can
+# read at any time - we just see the old data until the swap commits.
+def makeDatabase(name) :
+    db_file=topDir + "/" + db_dir + "/" + name + "/database.db"
+    engine = create_engine("sqlite:///" + db_file, pool_size=dbThreads, connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return SessionLocal, db_file, engine
+
+stopsSession,   stopsDbFile,   stopsEngine   = makeDatabase('stops')
+vehicleSession, vehicleDbFile, vehicleEngine = makeDatabase('vehicles')
+tripSession,    tripDbFile,    tripEngine    = makeDatabase('trip_updates')
+
+# Small function to see if the stops database has the spatial index.
+# Databases made before there was one get it the next time update_db.py
+# runs, so until we've seen it we look every time, after that we remember.
+stopsHaveRtree = False
+def stopsIndexed() :
+    global stopsHaveRtree
+    if not stopsHaveRtree :
+        stopsHaveRtree = inspect(stopsEngine).has_table('stops_rtree')
+    return stopsHaveRtree
+
+# Likewise for the minimum zoom of each stop (the level of detail, see
+# databases/stops/stopLevels.py), which older databases don't have.
+stopsHaveLevels = False
+def stopsLeveled() :
+    global stopsHaveLevels
+    if not stopsHaveLevels :
+        stopsHaveLevels = 'minzoom' in [ column['name'] for column in inspect(stopsEngine).get_columns('stops') ]
+    return stopsHaveLevels
+
+# The vehicle end point is served out of an in memory snapshot of the
+# vehicles table (see bussinSnapshots.py) that is reloaded when the ingest
+# publishes a new generation. We look for a new generation at most every
+# BFR_SNAPSHOT_CHECK_SEC seconds. Setting BFR_VEHICLE_SNAPSHOT to FALSE
+# goes back to querying the database for every request.
+snapshotCheckSec = float(agencyEnv.get('BFR_SNAPSHOT_CHECK_SEC', '1'))
+useVehicleSnapshot = agencyEnv.get('BFR_VEHICLE_SNAPSHOT', 'TRUE').upper() not in ('FALSE', 'OFF', '0')
+
+# The ingest publishes a snapshot file next to each database with every
+# generation (see databases/snapshotFile.py), which every worker maps into
+# memory and serves out of, so the workers share one copy of the data and
+# don't query the databases. Until there is a snapshot file (or if the
+# ingest couldn't write it) we go to the database as before. Setting
+# BFR_MAPPED_SNAPSHOTS to FALSE ignores the snapshot files.
+useMappedSnapshots = agencyEnv.get('BFR_MAPPED_SNAPSHOTS', 'TRUE').upper() not in ('FALSE', 'OFF', '0')
+
+# Small function to get the snapshot file for a database, if we're using them.
+def mappedFile(db_file) :
+    if not useMappedSnapshots :
+        return None
+    return snapshotFileFor(db_file)
+
+vehicleCache = snapshotCache(vehicleEngine, loadVehicleSnapshot, snapshotCheckSec,
+                             mappedFile(vehicleDbFile), mapVehicleSnapshot)
+
+# For the conditional GETs (see clientIsCurrent below) every end point
+# needs to know the generation of its data. The vehicle snapshot has it,
+# for the other databases we keep just the generation and when it was
+# published, looked at no more often than the vehicle snapshot - or, when
+# there is a snapshot file, the stops (a stopSnapshot) or the arrivals at
+# each stop (an arrivalSnapshot) that the end points serve out of.
+stopsStamps   = snapshotCache(stopsEngine, loadGenerationStamp, snapshotCheckSec,
+                              mappedFile(stopsDbFile), mapStopSnapshot)
+tripStamps    = snapshotCache(tripEngine,  loadGenerationStamp, snapshotCheckSec,
+                              mappedFile(tripDbFile), mapArrivalSnapshot)
+vehicleStamps = vehicleCache
+
+# The stops as slippy map tiles, which the stops update makes (see
+# databases/stops/stopTiles.py) and the tile end point serves out
+# of. Until there is a tile file, the tile end points say so and the
+# web page asks the bus stop end point instead.
+stopTileCache = snapshotCache(stopsEngine, loadGenerationStamp, snapshotCheckSec,
+                              stopTileFileFor(stopsDbFile), mapStopTilePack)
+
+# The routes that are running, which the ingest works out for
+# every generation of the vehicles, ready made as JSON.
+routeCache = snapshotCache(vehicleEngine, loadRouteCatalog, snapshotCheckSec,
+                           mappedFile(vehicleDbFile), mapRouteCatalog)
+if not useVehicleSnapshot :
+    vehicleStamps = snapshotCache(vehicleEngine, loadGenerationStamp, snapshotCheckSec)
+
+# What the bus stop and vehicle end points send out is cached (see
+# bussinCache.py), keyed by the area exactly as asked for (the web pages
+# snap it to a grid, see webpages/js/bbox.js, so they ask for the same
+# areas), the routes and so on, and the generation of the data.
+# BFR_RESPONSE_CACHE_ENTRIES and BFR_RESPONSE_CACHE_MB bound the
+# size, and zero entries turns it off.
+responseCacheEntries = int(agencyEnv.get('BFR_RESPONSE_CACHE_ENTRIES', '1000'))
+responseCacheBytes   = int(float(agencyEnv.get('BFR_RESPONSE_CACHE_MB', '32')) * 1024 * 1024)
+endPointCache = responseCache(responseCacheEntries, responseCacheBytes)
+
+# Small function to send out the response for a cache key, from the cache if
+# it's there, otherwise made by build (an async function that returns a Response).
+async def cachedResponse(key, build, response) :
+    body, mediaType = await endPointCache.get(key, build)
+    return Response(content=body, media_type=mediaType, headers=responseHeaders(response))
+
+# Small function to get the current snapshot out of a snapshot cache.
+# Usually that's just handing back what we have, but every so often
+# it means looking at the database, which is done in the thread pool.
+async def currentSnapshot(cache) :
+    snapshot = cache.fresh()
+    if snapshot is None :
+        snapshot = await asyncio.get_running_loop().run_in_executor(dbExecutor, cache.refresh)
+    return snapshot
+
+# For the push end points (see bussinPush.py), something to watch
+# each database for new generations. A subscriber that hasn't had
+# anything for streamKeepAliveSec seconds gets a keep alive.
+vehicleWatcher = generationWatcher(vehicleCache, currentSnapshot, snapshotCheckSec)
+tripWatcher    = generationWatcher(tripStamps,   currentSnapshot, snapshotCheckSec)
+streamKeepAliveSec = 15.0
+
+# What we send out can also be kept by a shared cache in front of us
+# (nginx's proxy_cache, see superUserStuff/bussinfr.net) for everyone who
+# asks for the same URL, until the ingest next writes the database, which
+# it does about every BFR_VEHICLE_POLL (or BFR_TRIP_POLL) seconds, and the
+# stops once a week (see the cron table). A shared cache keeps it no more
+# than BFR_SHARED_CACHE_MAX_SEC seconds (default 60) in case the data turn
+# up early, and setting that to zero stops shared caches keeping it at all.
+vehiclePollSec     = int(float(agencyEnv.get('BFR_VEHICLE_POLL', '15')))
+tripPollSec        = int(float(agencyEnv.get('BFR_TRIP_POLL', '15')))
+stopsPollSec       = 7 * 24 * 3600
+sharedCacheMaxSec  = int(float(agencyEnv.get('BFR_SHARED_CACHE_MAX_SEC', '60')))
+
+# Small function to work out how many seconds a shared cache can keep what
+# we send out of data published at stamp.updatetime, for a database written
+# every pollSec seconds - until the next write is due, or a second if it's
+# overdue (so a burst of requests for the same thing still only reaches us once).
+def sharedCacheSec(stamp, pollSec) :
+    untilNextWrite = stamp.updatetime + pollSec - int(time.time())
+    return max(1, min(untilNextWrite, pollSec, sharedCacheMaxSec))
+
+# Small function for conditional GETs. The web pages ask for the same
+# thing every few seconds, and between ingest cycles the answer doesn't
+# change, so the end points send an ETag header (and for data that only
+# change when the ingest writes, a Last-Modified header) and if the browser
+# sends back the ETag it already has (If-None-Match) or the time it got its
+# copy (If-Modified-Since) we can say "304 Not Modified" rather than
+# serializing and sending the same thing again.
+#
+# The ETag is made from the generation of the data and when it was published
+# (so that a database that is rebuilt and starts counting again doesn't look
+# the same), plus anything else the answer depends on (extra). This sets the
+# headers on the response and returns True if the client's copy is current,
+# in which case the end point should return notModified(response). If
+# pollSec is given (how often the database is written) shared caches
+# can keep the response for a while, see sharedCacheSec above.
+def clientIsCurrent(request, response, stamp, extra="", lastModified=True, pollSec=None) :
+
+    # A generation of zero means the database doesn't publish one
+    # (made before there was a feed_generation table) so we can't tell.
+    if stamp.generation == 0 :
+        return False
+
+    # no-cache tells the browser to keep its copy but ask us (with the
+    # validators) every time, rather than guess how long it's good for
+    # from Last-Modified. For a shared cache, max-age=0 and must-revalidate
+    # do the same for the browser, and s-maxage is how long the shared
+    # cache can hand out its copy without asking us.
+    etag = f'"{stamp.generation}-{stamp.updatetime}{extra}"'
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    if pollSec is not None and sharedCacheMaxSec > 0 :
+        response.headers['Cache-Control'] = f'public, max-age=0, must-revalidate, s-maxage={sharedCacheSec(stamp, pollSec)}'
+    if lastModified and stamp.updatetime > 0 :
+        response.headers['Last-Modified'] = formatdate(stamp.updatetime, usegmt=True)
+
+    # If-None-Match wins if both are sent. Proxies may have made the tag weak.
+    ifNoneMatch = request.headers.get('if-none-match')
+    if ifNoneMatch is not None :
+        tags = [ tag.strip().removeprefix('W/') for tag in ifNoneMatch.split(',') ]
+        return etag in tags or '*' in tags
+
+    ifModifiedSince = request.headers.get('if-modified-since')
+    if ifModifiedSince is not None and 'last-modified' in response.headers :
+        try :
+            return stamp.updatetime <= parsedate_to_datetime(ifModifiedSince).timestamp()
+        except (TypeError, ValueError) :
+            return False
+
+    return False
+
+# Small function to get the headers the end point has set on the response
+# that FastAPI handed it (ETag and so on), so they can go on the response
+# we actually send back.
+def responseHeaders(response) :
+    return { key : value for key, value in response.headers.items() if key not in ('content-length', 'content-type') }
+
+# The 304 Not Modified response, with the same validators the full response would have had.
+def notModified(response) :
+    return Response(status_code=304, headers=responseHeaders(response))
+
+# Small function to send out a list of rows (dictionaries, or database rows
+# with the columns the end point serves out) as JSON.
+#
+# If an end point hands FastAPI the rows to send out, FastAPI validates every
+# one of them against the response_model (the pydantic classes below) and
+# then serializes them, and under load that is where most of the CPU time
+# goes. But the rows come out of our own database with the right columns and
+# types, so there is nothing to validate. Instead we serialize them here
+# with pydantic's JSON encoder (the same one FastAPI uses for the response
+# model, so the bytes are exactly the same) and send those, and FastAPI
+# passes a Response it is handed straight through. The response_model is
+# still on the end points so the documentation pages show the format.
+def jsonRows(rows, response) :
+    rows = [ row if isinstance(row, dict) else row._asdict() for row in rows ]
+    return Response(content=to_json(rows), media_type="application/json", headers=responseHeaders(response))
+
+# Get a FastAPI application object. When bussinHost.py serves us, it
+# mounts us at /agency_name itself, which sets the root path.
+rootPath = "/" + agency_name
+if hostedAgency is not None :
+    rootPath = ""
+
 bussinApp = FastAPI(title="bussinAPIs",
-        root_path="/" + agency_name,                  # Because we're deploying behind a gateway. Must match nginx settings.
+        root_path=rootPath,                           # Because we're deploying behind a gateway. Must match nginx settings.
         summary="End points for bussinFR.",
         description="Used by javaScript to get the data.",
         contact={
@@ -98,47 +443,57 @@ class busStopServiceResponseClass(BaseModel) :
 
 # Serve out bus stop location, description.
 @bussinApp.get("/busStopService", tags=['bus-stop-service'], response_model=List[busStopServiceResponseClass])
-async def get_bus_stops(minLat:     float = Query(default=None),
+async def get_bus_stops(request:    Request,
+                        response:   Response,
+                        minLat:     float = Query(default=None),
                         minLon:     float = Query(default=None),
                         maxLat:     float = Query(default=None),
-                        maxLon:     float = Query(default=None)):
+                        maxLon:     float = Query(default=None),
+                        zoom:       int   = Query(default=None)):
     """
     Returns bus stop information for a specified area.
     """
 
-    # Database table ORM model.
-    Base = declarative_base()
-    class stopsTable(Base):
-        __tablename__='stops'
-        stopid   = Column(String, nullable=False, primary_key=True)
-        stopname = Column(String, nullable=False)
-        stopdesc = Column(String, nullable=False)
-        lat      = Column(Float,  nullable=False)
-        lon      = Column(Float,  nullable=False)
-        __table_args__ = (UniqueConstraint('stopid', name='unique_constraint'),)
-
-    # Database URL and block file. Depends on if we're in testing mode, which
-    # is set through the BFR_TEST_MODE env var (which has to be set to either ON or TRUE
-    # (case insensitive) to activate test mode).
-    db_dir='databases'
-    testMode=False
-    test_env = os.getenv('BFR_TEST_MODE', 'OFF')
-    if test_env.lower() == 'on' or test_env.lower() == 'true' :
-        testMode=True
+    # If the client already has the current stops, say so.
+    stamp = await currentSnapshot(stopsStamps)
+    if clientIsCurrent(request, response, stamp, pollSec=stopsPollSec) :
+        return notModified(response)
 
-    if testMode :
-        db_dir='test_databases'
+    # Serve out of the cache if someone else asked for this area lately.
+    key = ("stops", minLat, minLon, maxLat, maxLon, zoom, stamp.generation, stamp.updatetime)
+    async def build() :
+        return await stopsResponse(stamp, minLat, minLon, maxLat, maxLon, zoom)
+    return await cachedResponse(key, build, response)
 
-    db_url="sqlite:///../" + db_dir + "/stops/database.db"
-    db_block_file="../" + db_dir + "/stops/db_offline.marker"
+# Work out the stops in an area for the bus stop end point,
+# out of the stops snapshot (stamp) or from the database.
+async def stopsResponse(stamp, minLat, minLon, maxLat, maxLon, zoom) :
 
-    # Connect to the database.
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
+    # If the ingest published a snapshot file, serve out of that.
+    if isinstance(stamp, stopSnapshot) :
+        return jsonRows(stamp.rows(stamp.select(minLat, minLon, maxLat, maxLon, zoom, limit=1000)), Response())
+
+    # Get a pooled connection to the database.
+    db = stopsSession()
 
     # Set up basic query.
-    query = db.query(stopsTable)
+    query = db.query(stopsTable).with_entities(stopsTable.stopid, stopsTable.stopname, stopsTable.stopdesc,
+                                               stopsTable.lat, stopsTable.lon)
+
+    # If we have a bounding box and the spatial index, use the index
+    # to find the stops in the box rather than looking at every stop.
+    # A point is in the box if its (zero size) rectangle overlaps it.
+    bbox = [ minLat, minLon, maxLat, maxLon ]
+    if any(limit is not None for limit in bbox) and stopsIndexed() :
+        query = query.join(stopsRtreeTable, stopsRtreeTable.id == literal_column("stops.rowid"))
+        if minLat is not None :
+            query = query.filter(stopsRtreeTable.maxLat >= minLat)
+        if minLon is not None :
+            query = query.filter(stopsRtreeTable.maxLon >= minLon)
+        if maxLat is not None :
+            query = query.filter(stopsRtreeTable.minLat <= maxLat)
+        if maxLon is not None :
+            query = query.filter(stopsRtreeTable.minLon <= maxLon)
 
     # Add filters.
     if minLat is not None :
@@ -153,6 +508,15 @@ async def get_bus_stops(minLat:     float = Query(default=None),
     if maxLon is not None :
         query = query.filter(stopsTable.lon <= maxLon)
 
+    # If we have a zoom level, only serve the stops that are shown at that
+    # zoom, the ones shown from the lowest zoom level first so that if there
+    # are too many, it's the most detailed level that gets left out. Within
+    # a level they stay in table order, as the snapshot has them, so that the
+    # limit leaves out the same stops whichever way we get them.
+    if zoom is not None and stopsLeveled() :
+        query = query.filter(stopsTable.minzoom <= zoom)
+        query = query.order_by(stopsTable.minzoom, literal_column("stops.rowid"))
+
     # In the interests of speed if someone uses the API directly,
     # decided not to do this.
     #query = query.order_by(stopsTable.lat)
@@ -160,14 +524,67 @@ async def get_bus_stops(minLat:     float = Query(default=None),
     # In fact, decided to do this instead
     query = query.limit(1000)
 
-    waitOnFile(db_block_file)
+    db_results = await runQuery(db, query)
+
+    return jsonRows(db_results, Response())
+
+
+
+# Bus stop tile end points.
+class stopTileServiceResponseClass(BaseModel) :
+    """
+    Pydantic class that defines the format of what the stop tile service serves out.
+    """
+    version:  str | None
+    minZoom:  int | None
+    maxZoom:  int | None
+
+class stopTileResponseClass(busStopServiceResponseClass) :
+    """
+    Pydantic class for a stop in a tile, which also has the lowest zoom level it's shown at.
+    """
+    minzoom:  int
 
-    db_results = query.all()
+# A tile is the same for as long as anyone keeps it,
+# since a new version of the stops has new URLs.
+tileHeaders = { 'Cache-Control' : 'public, max-age=31536000, immutable' }
 
-    db.close()
+# Serve out the version of the stop tiles, to go in the tile URLs.
+@bussinApp.get("/stopTileService", tags=['stop-tile-service'], response_model=stopTileServiceResponseClass)
+async def get_stop_tile_version(request:    Request,
+                                response:   Response):
+    """
+    Returns the version of the bus stop tiles and the lowest and highest zoom levels there are tiles for.
+    """
+    pack = await currentSnapshot(stopTileCache)
+    if clientIsCurrent(request, response, pack, pollSec=stopsPollSec) :
+        return notModified(response)
+
+    version = { "version" : None, "minZoom" : None, "maxZoom" : None }
+    if isinstance(pack, stopTilePack) :
+        version = { "version" : pack.version, "minZoom" : pack.minZoom, "maxZoom" : pack.maxZoom }
+    return Response(content=to_json(version), media_type="application/json", headers=responseHeaders(response))
+
+# Serve out a tile of bus stops.
+@bussinApp.get("/stopTiles/{version}/{z}/{x}/{y}", tags=['stop-tile-service'], response_model=List[stopTileResponseClass])
+async def get_stop_tile(version:    str,
+                        z:          int,
+                        x:          int,
+                        y:          int):
+    """
+    Returns the bus stops in a slippy map tile, for a version of the stops.
+    """
 
-    return db_results
+    # Anything we don't have - an old version, or a tile outside the
+    # map - is not found, and that mustn't be cached, since the URL
+    # may well be there once the tiles are updated.
+    pack = await currentSnapshot(stopTileCache)
+    if (not isinstance(pack, stopTilePack) or version != pack.version or
+        z < pack.minZoom or z > pack.maxZoom or x < 0 or y < 0 or x >= 2 ** z or y >= 2 ** z) :
+        return Response(content=b'{"detail":"Not Found"}', status_code=404, media_type="application/json",
+                        headers={ 'Cache-Control' : 'no-store' })
 
+    return Response(content=pack.tile(z, x, y), media_type="application/json", headers=tileHeaders)
 
 
 
@@ -184,51 +601,26 @@ class vehicleServiceResponseClass(BaseModel) :
     lon:      float
     bearing:  float
 
-# Serve out vehicle information.
-@bussinApp.get("/vehicleService", tags=['vehicle-service'], response_model=List[vehicleServiceResponseClass])
-async def get_vehicles(minLat:     float = Query(default=None),
-                       minLon:     float = Query(default=None),
-                       maxLat:     float = Query(default=None),
-                       maxLon:     float = Query(default=None),
-                       routesCSV:  str   = Query(default=None)):
+# What the vehicle end point serves out if it's asked for the
+# changes since a generation (see get_vehicles below).
+class vehicleDeltaClass(vehicleServiceResponseClass) :
     """
-    Returns vehicle information for a specified area.
+    Pydantic class for a vehicle in a delta, which also has the vehicle ID.
     """
+    vehicleid: str
 
-    Base = declarative_base()
-
-    class vehiclesTable(Base):
-        __tablename__='vehicles'
-        id             = Column(Integer, nullable=False, primary_key=True)
-        route          = Column(String,  nullable=False)
-        schedule_relationship = Column(Integer, nullable=False)
-        direction_id   = Column(Integer, nullable=False)
-        current_status = Column(Integer, nullable=False)
-        timestamp      = Column(BIGINT(unsigned=True), nullable=False)
-        lat            = Column(Float,   nullable=False)
-        lon            = Column(Float,   nullable=False)
-        bearing        = Column(Float,   nullable=False)
-
-
-    # Database URL and block file. Depends on if we're in testing mode, which
-    # is set through the BFR_TEST_MODE env var (which has to be set to either ON or TRUE
-    # (case insensitive) to activate test mode).
-    db_dir='databases'
-    testMode=False
-    test_env = os.getenv('BFR_TEST_MODE', 'OFF')
-    if test_env.lower() == 'on' or test_env.lower() == 'true' :
-        testMode=True
-
-    if testMode :
-        db_dir='test_databases'
-
-    db_url="sqlite:///../" + db_dir + "/vehicles/database.db"
-    db_block_file="../" + db_dir + "/vehicles/db_offline.marker"
+class vehicleDeltaResponseClass(BaseModel) :
+    """
+    Pydantic class that defines the format of what the vehicle end point serves out when asked for changes.
+    """
+    token:    str
+    full:     bool
+    vehicles: List[vehicleDeltaClass]
+    removed:  List[str]
 
-    # Connect to the database.
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
+# Set up the database query for the vehicle end point.
+# This is what the in memory snapshot has to agree with.
+def vehicleQuery(db, minLat, minLon, maxLat, maxLon, routes) :
 
     # Set up query but not all columns - only selected ones.
     query = db.query(vehiclesTable).with_entities(vehiclesTable.route, vehiclesTable.timestamp,
@@ -247,57 +639,196 @@ async def get_vehicles(minLat:     float = Query(default=None),
     if maxLon is not None :
         query = query.filter(vehiclesTable.lon <= maxLon)
 
-    # Routes is a comma separated list of routes of interest.
-    # Default is to serve all routes, but if this is specified,
-    # the only serve these routes.
-
-    if routesCSV is not None :
-        routesCSV = routesCSV.upper()  # Convert entered route list to upper case
-        routesCSV = "".join(routesCSV.split()) # Remove whitespaces
-        routes=routesCSV.split(',')
-        if len(routes) > 0 :
-            # This next part is a bit tricky.
-            # If the caller specified routesCSV="bolt, 205"
-            # then routes is now the list [ "BOLT", "205" ].
-            #
-            # The * operator (the unpacking operator)
-            # when used in a function call
-            # takes an iterable (like a list or tuple) and
-            # unpacks its elements as separate positional
-            # arguments, so for example we can :
-            # >>> x=[1,2,3]  # A list
-            # >>> print(x)   #
-            # [1, 2, 3]      # Printed the list
-            # >>> print(*x)  #
-            # 1 2 3          # Printed the list as positional parameters
-            #
-            # So we can pass the elements of a list
-            # to the function as positional arguments
-            # (in this case the or_()
-            # function).
-            #
-            # So make the list of filters that we want to throw at or_() :
-            route_filters = [vehiclesTable.route == route for route in routes]
-            # And then use the unpacking operator to throw them all at or_()
-            # as positional arguments :
-            query = query.filter(or_(*route_filters))
+    if routes is not None and len(routes) > 0 :
+        # If the caller specified routesCSV="bolt, 205"
+        # then routes is now the list [ "BOLT", "205" ].
+        # The vehicles table has an index on the route (see
+        # databases/vehicles/update_db.py), so "route IN (...)" only
+        # looks at the vehicles on those routes. Since the index gives
+        # them in route order, put them back in table order so that the
+        # limit leaves out the same vehicles whichever way we get them.
+        query = query.filter(vehiclesTable.route.in_(routes))
+        query = query.order_by(literal_column("vehicles.rowid"))
 
     # Decided against doing this.
     #query = query.order_by(vehiclesTable.lat)
     # Did this in case anyone uses the API directly.
     query = query.limit(1000)
 
-    waitOnFile(db_block_file)
-
-    db_results = query.all()
+    return query
 
-    db.close()
+# Routes is a comma separated list of routes of interest.
+# Default is to serve all routes (None), but if this is specified,
+# the only serve these routes.
+def parseRoutes(routesCSV) :
+    routes = None
+    if routesCSV is not None :
+        routesCSV = routesCSV.upper()  # Convert entered route list to upper case
+        routesCSV = "".join(routesCSV.split()) # Remove whitespaces
+        routes=routesCSV.split(',')
+    return routes
 
-    return db_results
+# Serve out vehicle information.
+# The compact columnar format of the vehicle end point
+# (see vehicleColumns in bussinSnapshots.py).
+class vehicleColumnsResponseClass(BaseModel) :
+    """
+    Pydantic class that defines the format of what the vehicle end point serves out in columns.
+    """
+    scale:          int
+    routes:         List[str]
+    route:          List[int]
+    timestamp:      List[int]
+    current_status: List[int]
+    lat:            List[int]
+    lon:            List[int]
+    bearing:        List[int]
+
+# The clusters the vehicle end point serves out when asked to.
+class vehicleClusterResponseClass(BaseModel) :
+    """
+    Pydantic class that defines the format of a cluster of vehicles from the vehicle end point.
+    """
+    lat:   float
+    lon:   float
+    count: int
+
+columnsMediaType = "application/vnd.bussin.columns+json"
+
+# Small function to tell if the client wants the vehicles in columns,
+# either from the format parameter or, if that isn't set, the Accept header.
+def wantsColumns(request, format) :
+    if format is not None :
+        return format == "columns"
+    return columnsMediaType in request.headers.get("accept", "")
+
+@bussinApp.get("/vehicleService", tags=['vehicle-service'],
+               response_model=List[vehicleServiceResponseClass] | vehicleDeltaResponseClass |
+                              vehicleColumnsResponseClass | List[vehicleClusterResponseClass])
+async def get_vehicles(request:    Request,
+                       response:   Response,
+                       minLat:     float = Query(default=None),
+                       minLon:     float = Query(default=None),
+                       maxLat:     float = Query(default=None),
+                       maxLon:     float = Query(default=None),
+                       routesCSV:  str   = Query(default=None),
+                       since:      str   = Query(default=None),
+                       format:     str   = Query(default=None),
+                       clusterDeg: float = Query(default=None, gt=0.0)):
+    """
+    Returns vehicle information for a specified area.
+    """
 
+    routes = parseRoutes(routesCSV)
+
+    # What we send depends on the Accept header, so caches have to know that.
+    response.headers["Vary"] = "Accept"
+    columns = wantsColumns(request, format)
+
+    # If clusterDeg is set, the map is zoomed out too far to show every
+    # vehicle, so send clusters of them instead, which is a lot less to
+    # send than the vehicles would be. Like the deltas, these come from the
+    # in memory snapshot, and there's no limit since there's one cluster
+    # for many vehicles.
+    if clusterDeg is not None :
+        snapshot = await currentSnapshot(vehicleCache)
+        if clientIsCurrent(request, response, snapshot, extra=f"-clusters{clusterDeg}", pollSec=vehiclePollSec) :
+            return notModified(response)
+        key = ("clusters", minLat, minLon, maxLat, maxLon, routesKey(routes), clusterDeg, snapshot.generation, snapshot.updatetime)
+        async def build() :
+            indices = snapshot.select(minLat, minLon, maxLat, maxLon, routes, limit=snapshot.size)
+            return jsonRows(snapshot.clusters(indices, clusterDeg), Response())
+        return await cachedResponse(key, build, response)
+
+    # If since is set, the client has the vehicles in this area as of the
+    # generation with that token (or wants to start - any value that isn't
+    # a token we know gets everything) and we send just what changed since
+    # then, and the token for this generation to send next time. Most
+    # vehicles don't report every cycle, so this is a lot less to send.
+    # The changes come from the in memory snapshot, even if the plain
+    # requests are set to query the database.
+    if since is not None :
+        snapshot = await currentSnapshot(vehicleCache)
+        if clientIsCurrent(request, response, snapshot, pollSec=vehiclePollSec) :
+            return notModified(response)
+        delta = snapshot.delta(since, minLat, minLon, maxLat, maxLon, routes, limit=1000)
+        return Response(content=to_json(delta), media_type="application/json", headers=responseHeaders(response))
+
+    # If the client already has the current vehicles, say so.
+    # The columns get a different ETag from the usual JSON.
+    stamp = await currentSnapshot(vehicleStamps)
+    if clientIsCurrent(request, response, stamp, extra="-columns" if columns else "", pollSec=vehiclePollSec) :
+        return notModified(response)
+
+    # Serve out of the cache if someone else asked for this area lately.
+    key = ("vehicles", minLat, minLon, maxLat, maxLon, routesKey(routes), columns, stamp.generation, stamp.updatetime)
+    async def build() :
+        return await vehiclesResponse(stamp, minLat, minLon, maxLat, maxLon, routes, columns)
+    return await cachedResponse(key, build, response)
+
+# Small function to get the routes as part of a cache key. The order
+# they're asked for in and any repeats don't change the answer.
+def routesKey(routes) :
+    if routes is None :
+        return None
+    return tuple(sorted(set(routes)))
+
+# Work out the vehicles in an area and on the routes for the vehicle end point,
+# in the usual JSON or in columns, out of the snapshot (stamp) or from the database.
+async def vehiclesResponse(stamp, minLat, minLon, maxLat, maxLon, routes, columns) :
+
+    # Filter the in memory snapshot (which is what we got the generation
+    # from above). The same limit of 1000 vehicles applies as for the
+    # database query.
+    if useVehicleSnapshot :
+        snapshot = stamp
+        indices = snapshot.select(minLat, minLon, maxLat, maxLon, routes, limit=1000)
+        if columns :
+            return columnsResponse(snapshot.columns(indices))
+        return jsonRows(snapshot.rows(indices), Response())
+
+    # Get a pooled connection to the database.
+    db = vehicleSession()
+    query = vehicleQuery(db, minLat, minLon, maxLat, maxLon, routes)
+
+    db_results = await runQuery(db, query)
+
+    if columns :
+        return columnsResponse(vehicleColumns(*zip(*db_results)) if len(db_results) > 0
+                               else vehicleColumns([], [], [], [], [], []))
+    return jsonRows(db_results, Response())
+
+# Small function to serve out vehicles in columns.
+def columnsResponse(columns) :
+    return Response(content=to_json(columns), media_type=columnsMediaType)
+
+
+
+
+
+
+# Route end point.
+class routeServiceResponseClass(BaseModel) :
+    """
+    Pydantic class that defines the format of what the route end point serves out.
+    """
+    route:    str
+    vehicles: int
 
+@bussinApp.get("/routeService", tags=['route-service'], response_model=List[routeServiceResponseClass])
+async def get_routes(request:    Request,
+                     response:   Response):
+    """
+    Returns the routes that have vehicles on them, with the number of vehicles on each.
+    """
 
+    # The catalog is only loaded when the vehicles change, and the
+    # JSON for it is made then too, so there's nothing to do here.
+    catalog = await currentSnapshot(routeCache)
+    if clientIsCurrent(request, response, catalog, pollSec=vehiclePollSec) :
+        return notModified(response)
 
+    return Response(content=catalog.json, media_type="application/json", headers=responseHeaders(response))
 
 
 # Trip update end point.
@@ -308,70 +839,248 @@ class tripServiceResponseClass(BaseModel) :
     route:   str
     arrivaltime: int
 
+# Set up the database query for the arrivals at a stop.
+def tripQuery(db, stopID) :
+
+    # Set up query but not all columns - only selected ones.
+    query = db.query(tripsTable).with_entities(tripsTable.route, tripsTable.arrivaltime)
+
+    # Add filter on stop ID.
+    query = query.filter(tripsTable.stopid == stopID)
+
+    query = upcomingOnly(query)
+
+    query = query.order_by(tripsTable.arrivaltime)
+
+    return query
+
+# Add a filter so that we only serve out arrival
+# times that are in the future. Don't do this in test mode.
+def upcomingOnly(query) :
+    if not testMode :
+        current_utc_time = datetime.datetime.now(datetime.timezone.utc)
+        current_unix_time = int(current_utc_time.timestamp())
+        query = query.filter(tripsTable.arrivaltime >= current_unix_time)
+    return query
+
+# Small function to get the time from which arrivals are served
+# out of the trip snapshot, the same as upcomingOnly() (None for all of them).
+def upcomingFrom() :
+    if testMode :
+        return None
+    return int(time.time())
+
+# Small function to get the arrivals at a stop, as a list of dictionaries, out of
+# the trip snapshot file if the ingest published one, otherwise from the database.
+async def arrivalsAt(stamp, stopID) :
+    if isinstance(stamp, arrivalSnapshot) :
+        return stamp.arrivals(stopID, upcomingFrom())
+    db = tripSession()
+    db_results = await runQuery(db, tripQuery(db, stopID))
+    return [ row._asdict() for row in db_results ]
+
+# Set up the database query for the arrivals at several stops at once.
+# With the stop ID first, the (stopid, arrivaltime, route) index covers
+# this too - one range of the index for each stop, already in order.
+def stopsTripQuery(db, stopIDs) :
+    query = db.query(tripsTable).with_entities(tripsTable.stopid, tripsTable.route, tripsTable.arrivaltime)
+    query = query.filter(tripsTable.stopid.in_(stopIDs))
+    query = upcomingOnly(query)
+    query = query.order_by(tripsTable.stopid, tripsTable.arrivaltime)
+    return query
+
 # Serve out vehicle information.
 @bussinApp.get("/tripService", tags=['trip-service'], response_model=List[tripServiceResponseClass])
-async def get_trips(stopID:     str = Query(default=None)):
+async def get_trips(request:    Request,
+                    response:   Response,
+                    stopID:     str = Query(default=None)):
     """
     Returns trip update information for the specified stop ID.
     """
 
     if stopID is None :
-        return []
-
-    Base = declarative_base()
-
-    class tripsTable(Base):
-        __tablename__='intrepid_trips'
-        id             = Column(Integer, nullable=False, primary_key=True)
-        route          = Column(String,  nullable=False)
-        schedule_relationship = Column(Integer, nullable=False)
-        arrivaltime    = Column(BIGINT(unsigned=True), nullable=False)
-        stopid         = Column(String,   nullable=False)
+        return jsonRows([], response)
 
+    stamp = await currentSnapshot(tripStamps)
 
-    # Database URL and block file. Depends on if we're in testing mode, which
-    # is set through the BFR_TEST_MODE env var (which has to be set to either ON or TRUE
-    # (case insensitive) to activate test mode).
-    db_dir='databases'
-    testMode=False
-    test_env = os.getenv('BFR_TEST_MODE', 'OFF')
-    if test_env.lower() == 'on' or test_env.lower() == 'true' :
-        testMode=True
+    db_results = await arrivalsAt(stamp, stopID)
 
-    if testMode :
-        db_dir='test_databases'
+    # If the client already has these arrivals, say so. Since we only serve
+    # out arrivals that are still to come, the answer can change between
+    # ingest cycles as buses arrive, so no Last-Modified and the ETag also
+    # has the first arrival time in it - for one generation, the arrivals
+    # still to come are all the ones from the first arrival on.
+    extra = ""
+    if not testMode :
+        extra = "-" + (str(db_results[0]["arrivaltime"]) if len(db_results) > 0 else "none")
+    if clientIsCurrent(request, response, stamp, extra, lastModified=False, pollSec=tripPollSec) :
+        return notModified(response)
 
-    db_url="sqlite:///../" + db_dir + "/trip_updates/database.db"
-    db_block_file="../" + db_dir + "/trip_updates/db_offline.marker"
+    return jsonRows(db_results, response)
 
-    # Connect to the database.
-    engine = create_engine(db_url)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
+# The batch trip update end point, for the arrivals at several stops.
+class stopArrivalsResponseClass(BaseModel) :
+    """
+    Pydantic class that defines the format of the arrivals at one stop from the batch trip update end point.
+    """
+    stopid:   str
+    arrivals: List[tripServiceResponseClass]
 
-    # Set up query but not all columns - only selected ones.
-    query = db.query(tripsTable).with_entities(tripsTable.route, tripsTable.arrivaltime)
+# The most stops that can be asked about at once.
+maxBatchStops = 100
 
-    # Add filter on stop ID.
-    query = query.filter(tripsTable.stopid == stopID)
+@bussinApp.get("/multiStopTripService", tags=['trip-service'], response_model=List[stopArrivalsResponseClass])
+async def get_multi_stop_trips(request:    Request,
+                               response:   Response,
+                               stopIDsCSV: str = Query(default=None),
+                               limit:      int = Query(default=None, gt=0)):
+    """
+    Returns trip update information for each of a comma separated list of stop IDs, up to limit arrivals per stop.
+    """
 
-    # Also add a filter so that we only serve out
-    # arrival times that are in the future.
-    # Don't do this in test mode.
+    # The stops in the order they were asked for, without repeats.
+    stopIDs = []
+    if stopIDsCSV is not None :
+        for stopID in stopIDsCSV.split(',') :
+            stopID = stopID.strip()
+            if len(stopID) > 0 and stopID not in stopIDs :
+                stopIDs.append(stopID)
+    stopIDs = stopIDs[:maxBatchStops]
+    if len(stopIDs) == 0 :
+        return jsonRows([], response)
+
+    stamp = await currentSnapshot(tripStamps)
+
+    # The trip snapshot file already has the arrivals grouped by stop.
+    if isinstance(stamp, arrivalSnapshot) :
+        since = upcomingFrom()
+        arrivals = { stopID : stamp.arrivals(stopID, since, limit) for stopID in stopIDs }
+    else :
+        # One query for all the stops.
+        db = tripSession()
+        query = stopsTripQuery(db, stopIDs)
+
+        db_results = await runQuery(db, query)
+
+        # Group the arrivals by stop, up to limit for each.
+        arrivals = { stopID : [] for stopID in stopIDs }
+        for row in db_results :
+            stopArrivals = arrivals[row.stopid]
+            if limit is None or len(stopArrivals) < limit :
+                stopArrivals.append({ "route" : row.route, "arrivaltime" : row.arrivaltime })
+
+    # As for the single stop end point, but the ETag has the first arrival at any of
+    # the stops, since that is the first of them that will have gone by.
+    extra = ""
     if not testMode :
-        current_utc_time = datetime.datetime.now(datetime.timezone.utc)
-        current_unix_time = int(current_utc_time.timestamp())
-        query = query.filter(tripsTable.arrivaltime >= current_unix_time)
+        firsts = [ stopArrivals[0]["arrivaltime"] for stopArrivals in arrivals.values() if len(stopArrivals) > 0 ]
+        extra = "-" + (str(min(firsts)) if len(firsts) > 0 else "none")
+    if clientIsCurrent(request, response, stamp, extra, lastModified=False, pollSec=tripPollSec) :
+        return notModified(response)
 
-    query = query.order_by(tripsTable.arrivaltime)
-
-    waitOnFile(db_block_file)
+    return jsonRows([ { "stopid" : stopID, "arrivals" : stopArrivals } for stopID, stopArrivals in arrivals.items() ],
+                    response)
 
-    db_results = query.all()
 
-    db.close()
+# Response cache end point.
+class cacheStatsResponseClass(BaseModel) :
+    """
+    Pydantic class that defines the format of what the cache stats end point serves out.
+    """
+    hits:       int
+    misses:     int
+    coalesced:  int
+    evictions:  int
+    errors:     int
+    entries:    int
+    bytes:      int
+    maxEntries: int
+    maxBytes:   int
+    hitRate:    float
+
+@bussinApp.get("/cacheStatsService", tags=['cache-stats'], response_model=cacheStatsResponseClass)
+async def get_cache_stats():
+    """
+    Returns the counters of the bus stop and vehicle response cache in this worker.
+    """
+    return Response(content=to_json(endPointCache.stats()), media_type="application/json",
+                    headers={ 'Cache-Control' : 'no-store' })
+
+
+# Push end points. Rather than asking again every few seconds, the web
+# page subscribes once and gets an event every time there is a new
+# generation of the data, using server-sent events (see bussinPush.py).
+# The headers tell browsers and nginx not to cache or buffer the stream.
+streamHeaders = { 'Cache-Control' : 'no-cache', 'X-Accel-Buffering' : 'no' }
+
+# The vehicle events for a subscriber. The first event has all the vehicles
+# in the area and on the routes, and after that each generation gets an
+# event with the changes since the last one, both in the same format as the
+# vehicle end point's deltas. Subscribers with the same area and routes that
+# are on the same token share the work of making the events.
+async def vehicleEvents(watcher, minLat, minLon, maxLat, maxLon, routes) :
+    snapshot = await watcher.subscribe()
+    try :
+        token = "0"
+        while True :
+            if token != snapshot.token :
+                def build(snapshot, since=token) :
+                    delta = snapshot.delta(since, minLat, minLon, maxLat, maxLon, routes, limit=1000)
+                    return sseEvent("vehicles", to_json(delta)), snapshot.token
+                key = (token, minLat, minLon, maxLat, maxLon, routesKey(routes))
+                event, token = await watcher.payload(key, asyncBuild(build))
+                yield event
+            else :
+                yield keepAlive
+            snapshot = await watcher.waitForChange(snapshot, streamKeepAliveSec)
+    finally :
+        watcher.unsubscribe()
+
+# The arrival events for a subscriber, which have the arrivals
+# at the stop, as the trip end point serves them out. One for
+# each generation, shared by everyone watching the same stop.
+async def tripEvents(watcher, stopID) :
+    snapshot = await watcher.subscribe()
+    try :
+        generation = None
+        while True :
+            if generation != snapshot.generation :
+                async def build(snapshot) :
+                    db_results = await arrivalsAt(snapshot, stopID)
+                    return sseEvent("arrivals", jsonRows(db_results, Response()).body), snapshot.generation
+                event, generation = await watcher.payload(stopID, build)
+                yield event
+            else :
+                yield keepAlive
+            snapshot = await watcher.waitForChange(snapshot, streamKeepAliveSec)
+    finally :
+        watcher.unsubscribe()
+
+# Small function to turn a function into an async one, for watcher.payload().
+def asyncBuild(build) :
+    async def run(snapshot) :
+        return build(snapshot)
+    return run
+
+@bussinApp.get("/vehicleStream", tags=['vehicle-service'])
+async def stream_vehicles(minLat:     float = Query(default=None),
+                          minLon:     float = Query(default=None),
+                          maxLat:     float = Query(default=None),
+                          maxLon:     float = Query(default=None),
+                          routesCSV:  str   = Query(default=None)):
+    """
+    Server-sent events with the vehicles in the specified area, then the changes every time they change.
+    """
+    return StreamingResponse(vehicleEvents(vehicleWatcher, minLat, minLon, maxLat, maxLon, parseRoutes(routesCSV)),
+                             media_type="text/event-stream", headers=streamHeaders)
 
-    return db_results
+@bussinApp.get("/tripStream", tags=['trip-service'])
+async def stream_trips(stopID:     str = Query(default=None)):
+    """
+    Server-sent events with the arrivals at the specified stop ID every time the trip updates change.
+    """
+    return StreamingResponse(tripEvents(tripWatcher, stopID),
+                             media_type="text/event-stream", headers=streamHeaders)
 
 
 # Mount for the static HTML/css/javaScript/favicon
@@ -387,6 +1096,6 @@ async def get_trips(stopID:     str = Query(default=None)):
 # Note that order matters. FastAPI matches requests *sequentially* so
 # we define this last so that it will try the API end points first.
 # Follow sym links to show test coverage results.
-bussinApp.mount("/", StaticFiles(directory="../webpages", html=True, follow_symlink=True), name="webpages")
+bussinApp.mount("/", StaticFiles(directory=topDir + "/webpages", html=True, follow_symlink=True), name="webpages")
 
 
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# An in process cache of what the end points send out.
+#
+# The web pages all start out looking at the same place (mapLat, mapLng
+# and initZoom in the agency's config.json) and ask for the same area
+# every few seconds, and between ingest cycles the answer is the same,
+# so there's no need to work it out (query, filter, serialize) every time.
+# The end points keep what they sent in a responseCache, keyed by the end
+# point, the area, the routes, anything else the answer depends on and
+# the generation of the data, so a new generation just means new keys and
+# the old entries age out.
+#
+# The cache is least recently used (LRU), bounded by the number of entries
+# and the bytes in them. Requests for the same key that come in while the
+# first one is still being worked out wait for that one rather than doing
+# the same work again (single flight). How well it's doing is kept in
+# counters, which the cache stats end point serves out.
+
+import asyncio
+from collections import OrderedDict
+
+class responseCache :
+    """
+    LRU cache of responses, as (body, media type), with single flight
+    misses. maxEntries and maxBytes bound the size. A maxEntries of zero
+    turns the cache off, in which case get() just builds every time.
+    """
+
+    def __init__(self, maxEntries, maxBytes) :
+        self.maxEntries = maxEntries
+        self.maxBytes   = maxBytes
+        self.clear()
+
+    # Small function to empty the cache and start the counters again.
+    def clear(self) :
+        self.entries  = OrderedDict()
+        self.inFlight = {}
+        self.bytes    = 0
+        self.counters = { "hits" : 0, "misses" : 0, "coalesced" : 0, "evictions" : 0, "errors" : 0 }
+        return
+
+    def enabled(self) :
+        return self.maxEntries > 0
+
+    # Get the response for a key. If it isn't cached, build (an async function
+    # with no arguments that returns a Response) makes it, and anyone else who
+    # asks for the same key in the meantime waits for that.
+    async def get(self, key, build) :
+        if not self.enabled() :
+            response = await build()
+            return response.body, response.media_type
+
+        entry = self.entries.get(key)
+        if entry is not None :
+            self.counters["hits"] += 1
+            self.entries.move_to_end(key)
+            return entry
+
+        future = self.inFlight.get(key)
+        if future is not None :
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        # The build is a task of its own, so if the client that started it
+        # goes away, the others waiting on it still get their answer.
+        self.counters["misses"] += 1
+        future = asyncio.ensure_future(self.fill(key, build))
+        self.inFlight[key] = future
+        return await asyncio.shield(future)
+
+    # Small function that builds the response for a key and caches it.
+    # If it fails, everyone waiting gets the exception, and nothing is cached.
+    async def fill(self, key, build) :
+        try :
+            response = await build()
+        except Exception :
+            self.counters["errors"] += 1
+            raise
+        finally :
+            self.inFlight.pop(key, None)
+        entry = (response.body, response.media_type)
+        self.put(key, entry)
+        return entry
+
+    # Small function to add an entry, evicting the least recently used
+    # entries to make room. An entry too big for the cache isn't kept.
+    def put(self, key, entry) :
+        size = len(entry[0])
+        if size > self.maxBytes :
+            return
+        self.entries[key] = entry
+        self.bytes += size
+        while len(self.entries) > self.maxEntries or self.bytes > self.maxBytes :
+            _, oldEntry = self.entries.popitem(last=False)
+            self.bytes -= len(oldEntry[0])
+            self.counters["evictions"] += 1
+        return
+
+    # The counters, along with how full the cache is and the hit rate (the
+    # share of requests that didn't have to build, counting the ones that
+    # waited on someone else's build).
+    def stats(self) :
+        requests = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+        hitRate = 0.0
+        if requests > 0 :
+            hitRate = (self.counters["hits"] + self.counters["coalesced"]) / requests
+        return dict(self.counters, entries=len(self.entries), bytes=self.bytes,
+                    maxEntries=self.maxEntries, maxBytes=self.maxBytes, hitRate=hitRate)
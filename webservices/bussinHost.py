@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Serve several agencies from one process.
+#
+# Normally each agency runs under its own linux user with its own
+# uvicorn (see start_server.sh), so every agency pays for a Python
+# interpreter with FastAPI, SQLAlchemy, numpy and so on loaded. This
+# serves them all from one uvicorn instead. Each agency still gets its
+# own copy of bussinAPIs.py - its own database engines and connection
+# pools, database thread pool, snapshots and caches - set up from its
+# own environment.vars, but the interpreter and the libraries are
+# shared, so adding an agency only costs its data.
+#
+# The agencies are given by their environment.vars files, which are
+# at the top of each agency's tree (where project_setup.sh puts them),
+# in BFR_AGENCY_ENV_FILES separated by colons, eg :
+#   export BFR_AGENCY_ENV_FILES="/home/cdot/bussinFR/environment.vars:/home/rtd/bussinFR/environment.vars"
+# and then, in this directory :
+#   uvicorn bussinHost:hostApp --host 127.0.0.1 --port 8002
+# (see start_host.sh). Each agency is mounted at /agency_name (in lower
+# case), so nginx should pass /cdot/ and /rtd/ on to the port as they
+# are, rather than stripping them off as it does for the separate
+# uvicorn instances.
+
+import importlib.util
+import os
+import sys
+
+from fastapi import FastAPI
+
+# The environment.vars files are read the same way the ingest reads them.
+try:
+    from ..databases.feedDaemon import readEnvFile
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'databases'))
+    from feedDaemon import readEnvFile
+
+# Small function that loads a copy of bussinAPIs.py for one agency.
+# The copy gets its own name, so it doesn't share anything with the
+# other agencies' copies, and the agency's settings are put in it
+# before it runs (see hostedAgency in bussinAPIs.py).
+def loadAgency(envFile) :
+    envVars = readEnvFile(envFile)
+    agency = envVars["BFR_AGENCY_NAME"].lower()
+    spec = importlib.util.spec_from_file_location("bussinAPIs_" + agency,
+                                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), "bussinAPIs.py"))
+    module = importlib.util.module_from_spec(spec)
+    module.__package__ = __package__ # So it imports bussinSnapshots etc the way we were imported
+    module.hostedAgency = { 'env' : envVars, 'topDir' : os.path.dirname(os.path.abspath(envFile)) }
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return agency, module
+
+# Make the application that serves all the agencies in envFiles,
+# each one mounted at /agency_name. Returns the application and a
+# dictionary of the agencies' bussinAPIs modules, keyed by agency name.
+def makeHostApp(envFiles) :
+    hostApp = FastAPI(title="bussinHost", summary="bussinFR end points for several agencies.")
+    agencies = {}
+    for envFile in envFiles :
+        agency, module = loadAgency(envFile)
+        if agency in agencies :
+            raise ValueError(f"Agency {agency} from {envFile} is already being served")
+        agencies[agency] = module
+        hostApp.mount("/" + agency, module.bussinApp, name=agency)
+    return hostApp, agencies
+
+# When uvicorn loads this module, serve the agencies in BFR_AGENCY_ENV_FILES.
+if 'BFR_AGENCY_ENV_FILES' in os.environ :
+    hostApp, hostedAgencies = makeHostApp([ envFile for envFile in os.environ['BFR_AGENCY_ENV_FILES'].split(':')
+                                            if len(envFile) > 0 ])
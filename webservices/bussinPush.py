@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Pushing updates out to the web pages with server-sent events (SSE).
+#
+# Rather than every browser asking for the vehicles (or the arrivals at
+# the stop it's monitoring) every few seconds, a browser can subscribe
+# once and we send it an update when the ingest publishes a new
+# generation of the data. Each API worker has one generationWatcher per
+# database that looks for a new generation (at most every
+# BFR_SNAPSHOT_CHECK_SEC seconds, the same as the snapshots) and wakes up
+# all the subscribers when there is one. What is sent out is worked out
+# once per generation for each distinct subscription (same area and
+# routes, or same stop) and shared by all the subscribers that have it,
+# so a thousand browsers watching the same area cost about the same as one.
+
+import asyncio
+
+class generationWatcher :
+    """
+    Watches a snapshotCache (see bussinSnapshots.py) for new generations
+    and wakes up everyone waiting on it when there is one.
+
+    getSnapshot is an async function that gets the current snapshot out of
+    the cache. The watching is done by a task that is started when the
+    first subscriber turns up and stops when the last one goes away.
+    """
+
+    def __init__(self, cache, getSnapshot, checkSec) :
+        self.cache       = cache
+        self.getSnapshot = getSnapshot
+        self.checkSec    = checkSec
+        self.loop        = None
+        self.subscribers = 0
+
+        # Counts of what we did, for the tests and the benchmarks.
+        self.counters = { "generations" : 0, "payloadsBuilt" : 0, "payloadsShared" : 0 }
+
+    # Small function to start again, which we do if we find ourselves
+    # in a different event loop (which only happens in the tests).
+    def reset(self) :
+        self.loop        = asyncio.get_running_loop()
+        self.snapshot    = None
+        self.changed     = asyncio.Event()
+        self.payloads    = {}
+        self.task        = None
+        self.subscribers = 0
+        return
+
+    # Small function to move on to a new snapshot - forget the
+    # payloads for the old one and wake up everyone waiting.
+    def publish(self, snapshot) :
+        self.snapshot = snapshot
+        self.payloads = {}
+        self.counters["generations"] += 1
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+        return
+
+    # The watching task.
+    async def watch(self) :
+        while self.subscribers > 0 :
+            # If we can't get at the database this time, say so and
+            # try again next time, the subscribers just wait longer.
+            # Whatever went wrong, this task has to keep going, or
+            # everyone subscribed would wait forever.
+            try :
+                snapshot = await self.getSnapshot(self.cache)
+                if snapshot.generation != self.snapshot.generation :
+                    self.publish(snapshot)
+            except Exception as e : # noqa: BLE001
+                print(f"Failed to check for a new generation : {e}")
+            await asyncio.sleep(self.checkSec)
+        self.task = None
+        return
+
+    # Sign up a subscriber. Returns the current snapshot.
+    async def subscribe(self) :
+        if self.loop is not asyncio.get_running_loop() :
+            self.reset()
+        self.subscribers += 1
+        if self.snapshot is None :
+            self.snapshot = await self.getSnapshot(self.cache)
+        if self.task is None :
+            self.task = asyncio.get_running_loop().create_task(self.watch())
+        return self.snapshot
+
+    def unsubscribe(self) :
+        self.subscribers -= 1
+        return
+
+    # Wait for a generation after the snapshot the subscriber has, or for
+    # timeoutSec seconds, whichever comes first. Returns the current snapshot.
+    async def waitForChange(self, snapshot, timeoutSec) :
+        if self.snapshot is snapshot :
+            try :
+                await asyncio.wait_for(self.changed.wait(), timeoutSec)
+            except TimeoutError :
+                pass
+        return self.snapshot
+
+    # Get what to send out for a subscription (key) with the current
+    # snapshot. The first subscriber to ask builds it (build is an async
+    # function that is given the snapshot and returns what to send) and
+    # everyone else with the same key gets the same thing. If the build
+    # fails, it's forgotten, so the next one to ask tries again rather than
+    # getting the same failure until the next generation.
+    async def payload(self, key, build) :
+        future = self.payloads.get(key)
+        if future is None :
+            self.counters["payloadsBuilt"] += 1
+            future = asyncio.ensure_future(build(self.snapshot))
+            self.payloads[key] = future
+        else :
+            self.counters["payloadsShared"] += 1
+        try :
+            return await asyncio.shield(future)
+        finally :
+            if future.done() and (future.cancelled() or future.exception() is not None) and self.payloads.get(key) is future :
+                del self.payloads[key]
+
+# Small function to format one server-sent event.
+# data is the (JSON) bytes to send.
+def sseEvent(event, data) :
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+# Sent every so often when there's nothing else to send, so that
+# proxies don't give up on the connection and we notice if the browser
+# has gone away. Lines starting with a colon are comments in SSE.
+keepAlive = b": keepalive\n\n"
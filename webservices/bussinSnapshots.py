@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+
+# In memory snapshots of the databases for the API.
+#
+# The vehicle table only holds a few thousand rows at most and is
+# rewritten by the ingest every poll, so rather than run an SQL range
+# scan (there is no index on lat/lon) for every request, each API worker
+# keeps the current vehicles in memory as numpy arrays, one per column.
+# The bounding box and route filters are then vectorized masks over
+# those arrays.
+#
+# The ingest bumps a generation number in the feed_generation table
+# every time it writes a change (see databases/vehicles/update_db.py).
+# The snapshot is only reloaded when that number changes, and we only
+# look at it every so often (BFR_SNAPSHOT_CHECK_SEC, default 1 second).
+#
+# The ingest also publishes a snapshot file with each generation (see
+# databases/snapshotFile.py) with the vehicles, the arrivals grouped by
+# stop and the stops. When that is there, the snapshots here are made
+# from the file mapped into memory rather than loaded from the database,
+# so the arrays are shared by all the API workers rather than each
+# worker having its own copy.
+
+import bisect
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from pydantic_core import to_json
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# The snapshot files are written by the ingest and read here, so the
+# format is kept in one place, with the ingest. As for our own modules,
+# the tests import that as part of the package and uvicorn doesn't.
+try:
+    from ..databases.snapshotFile import mappedSnapshot, snapshotIdentity, readVehicleColumns, snapshotFileName, stopTileFileName
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'databases'))
+    from snapshotFile import mappedSnapshot, snapshotIdentity, readVehicleColumns, snapshotFileName, stopTileFileName
+
+# Small function to get a column of the feed_generation table.
+# Returns 0 if the database doesn't have a feed_generation table (yet).
+def readGenerationColumn(engine, column) :
+    with engine.connect() as conn :
+        try :
+            row = conn.execute(text(f"SELECT {column} FROM feed_generation WHERE id=1")).fetchone()
+        except OperationalError :
+            return 0
+    if row is None :
+        return 0
+    return row[0]
+
+# Small function to get the generation the ingest last published.
+# Returns 0 if the database doesn't have a feed_generation table
+# (yet), in which case we load it once and keep it.
+def readGeneration(engine) :
+    return readGenerationColumn(engine, "generation")
+
+# Small function to get when (unix time) the ingest last published.
+def readUpdateTime(engine) :
+    return readGenerationColumn(engine, "updatetime")
+
+class generationStamp :
+    """
+    Just the generation of a database and when it was published, for
+    the end points that don't keep a snapshot but still want to know
+    if the data have changed (for ETag and Last-Modified headers).
+    """
+
+    def __init__(self, generation, updatetime) :
+        self.generation = generation
+        self.updatetime = updatetime
+
+# Load a generationStamp, the "snapshot" a snapshotCache keeps
+# for the databases we don't hold in memory.
+def loadGenerationStamp(engine, generation) :
+    return generationStamp(generation, readUpdateTime(engine))
+
+# Small function that returns an array that is True where lat, lon (arrays)
+# is inside the bounding box, any of which can be None for no limit.
+def inBox(lat, lon, minLat=None, minLon=None, maxLat=None, maxLon=None) :
+    mask = np.ones(len(lat), dtype=bool)
+    if minLat is not None :
+        mask &= lat >= minLat
+    if minLon is not None :
+        mask &= lon >= minLon
+    if maxLat is not None :
+        mask &= lat <= maxLat
+    if maxLon is not None :
+        mask &= lon <= maxLon
+    return mask
+
+class vehicleSnapshot :
+    """
+    The vehicles table as it was at one generation, held as numpy arrays.
+    Rows are in the order the table stores them, which is the order an SQL
+    table scan returns them in, so filtering and then taking the first
+    so many rows gives the same answer as the SQL query with a limit.
+
+    columns are the vehicle columns of a snapshot file (see
+    readVehicleColumns in databases/snapshotFile.py), either read from
+    the database or mapped from the file the ingest published.
+    """
+
+    def __init__(self, generation, columns, updatetime=0) :
+        self.generation = generation
+        self.updatetime = updatetime
+
+        # The token a client sends back to get what changed since this
+        # generation. The update time is in it so that a token from a
+        # database that has since been rebuilt doesn't match.
+        self.token = f"{generation}-{updatetime}"
+
+        self.vehicleid      = columns["vehicleid"]
+        self.timestamp      = columns["timestamp"]
+        self.current_status = columns["current_status"]
+        self.lat            = columns["lat"]
+        self.lon            = columns["lon"]
+        self.bearing        = columns["bearing"]
+        self.size = len(self.lat)
+
+        # The routes are dictionary encoded so that filtering on them is a
+        # comparison of integers rather than strings.
+        self.routeNames = np.array(columns["routeNames"].tolist(), dtype=object)
+        self.routeCodes = columns["routeCodes"]
+        self.routeIndex = { name : code for code, name in enumerate(self.routeNames.tolist()) }
+
+        # And index the vehicles by route, so that asking for a few routes
+        # only looks at the vehicles on them. The vehicles on the route with
+        # code c are routeOrder[routeStarts[c]:routeStarts[c+1]], in order.
+        self.routeOrder  = np.argsort(self.routeCodes, kind='stable')
+        self.routeStarts = np.searchsorted(self.routeCodes[self.routeOrder], np.arange(len(self.routeNames) + 1))
+
+        # Where each vehicle is in the arrays, which only the deltas
+        # need, so it's worked out the first time they ask.
+        self.rowOf = None
+
+        # The vehicle_changes ring, as the vehicles that changed in each
+        # generation and the tokens of the generations it goes back to.
+        self.changedIn = {}
+        ringTokens = set()
+        for changeGeneration, vid, changeUpdatetime in zip(columns["changeGeneration"].tolist(),
+                                                           columns["changeVehicle"].tolist(),
+                                                           columns["changeUpdatetime"].tolist()) :
+            self.changedIn.setdefault(changeGeneration, []).append(vid)
+            ringTokens.add(f"{changeGeneration}-{changeUpdatetime}")
+        self.ringTokens = ringTokens
+
+    # Returns the indices of the vehicles inside the bounding box (any of which
+    # can be None for no limit) and on one of the routes (None for all routes),
+    # up to limit of them.
+    def select(self, minLat=None, minLon=None, maxLat=None, maxLon=None, routes=None, limit=1000) :
+        if routes is not None :
+            indices = self.onRoutes(routes)
+            return indices[inBox(self.lat[indices], self.lon[indices], minLat, minLon, maxLat, maxLon)][:limit]
+        return np.flatnonzero(self.mask(minLat, minLon, maxLat, maxLon, routes))[:limit]
+
+    # Returns the indices of the vehicles on the routes, in order, from the route index.
+    def onRoutes(self, routes) :
+        codes = sorted({ self.routeIndex[route] for route in routes if route in self.routeIndex })
+        if len(codes) == 0 :
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate([ self.routeOrder[self.routeStarts[code]:self.routeStarts[code + 1]]
+                                        for code in codes ]))
+
+    # Returns an array that is True for the vehicles that are inside
+    # the bounding box and on one of the routes, as for select().
+    def mask(self, minLat=None, minLon=None, maxLat=None, maxLon=None, routes=None) :
+        mask = inBox(self.lat, self.lon, minLat, minLon, maxLat, maxLon)
+        if routes is not None :
+            codes = [ self.routeIndex[route] for route in routes if route in self.routeIndex ]
+            mask &= np.isin(self.routeCodes, codes)
+        return mask
+
+    # Returns the vehicles at the indices as a list of dictionaries
+    # with the keys that the vehicle end point serves out, and
+    # optionally the vehicle ID as well (for the deltas).
+    def rows(self, indices, withIDs=False) :
+        rows = [ { "route" : route, "timestamp" : timestamp, "current_status" : current_status,
+                   "lat" : lat, "lon" : lon, "bearing" : bearing }
+                 for route, timestamp, current_status, lat, lon, bearing in
+                 zip(self.routeNames[self.routeCodes[indices]].tolist(), self.timestamp[indices].tolist(),
+                     self.current_status[indices].tolist(), self.lat[indices].tolist(),
+                     self.lon[indices].tolist(), self.bearing[indices].tolist()) ]
+        if withIDs :
+            rows = [ dict(vehicleid=vid, **row) for vid, row in zip(self.vehicleid.take(indices), rows) ]
+        return rows
+
+    # Returns the vehicles at the indices in the compact columnar format
+    # (see vehicleColumns below).
+    def columns(self, indices) :
+        return vehicleColumns(self.routeNames[self.routeCodes[indices]], self.timestamp[indices], self.current_status[indices],
+                              self.lat[indices], self.lon[indices], self.bearing[indices])
+
+    # Returns the vehicles at the indices gathered into clusters, for maps
+    # that are zoomed out too far to show each vehicle. The vehicles are put
+    # in a grid of cells cellDeg degrees on a side, and each cell with any
+    # vehicles in it is a cluster, as a dictionary with the number of
+    # vehicles in it and their mean lat and lon (so the cluster is drawn
+    # where the vehicles are, not at the middle of the cell).
+    def clusters(self, indices, cellDeg) :
+        if len(indices) == 0 :
+            return []
+        lat = self.lat[indices]
+        lon = self.lon[indices]
+        cells = np.stack([ np.floor(lat / cellDeg), np.floor(lon / cellDeg) ], axis=1).astype(np.int64)
+        cells, cellOf, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        cellOf = cellOf.reshape(-1)
+        meanLat = np.bincount(cellOf, weights=lat) / counts
+        meanLon = np.bincount(cellOf, weights=lon) / counts
+        return [ { "lat" : lat, "lon" : lon, "count" : count }
+                 for lat, lon, count in zip(meanLat.tolist(), meanLon.tolist(), counts.tolist()) ]
+
+    # Returns the IDs of the vehicles that changed after the generation
+    # with the token since (up to and including this generation), or None
+    # if we can't tell (the token is from too long ago, or from some other
+    # database, or isn't a token at all).
+    def changedSince(self, since) :
+        if since == self.token :
+            return set()
+        if since not in self.ringTokens :
+            return None
+        sinceGeneration = int(since.split('-')[0])
+        changed = set()
+        for generation, vids in self.changedIn.items() :
+            if generation > sinceGeneration :
+                changed.update(vids)
+        return changed
+
+    # Returns what a client that has the vehicles as of the generation with
+    # the token since needs to bring its vehicles in the bounding box and on
+    # the routes up to date, as a dictionary :
+    #  * token    : the token for this generation, to send next time.
+    #  * full     : True if we couldn't work out the changes since then, in
+    #               which case vehicles is all of them and the client should
+    #               start again.
+    #  * vehicles : the vehicles (with their IDs) that were added or changed.
+    #  * removed  : the IDs of the vehicles that are gone, or have left the
+    #               bounding box, or are no longer on one of the routes.
+    def delta(self, since, minLat=None, minLon=None, maxLat=None, maxLon=None, routes=None, limit=1000) :
+        changed = self.changedSince(since)
+        if changed is None :
+            return { "token" : self.token, "full" : True,
+                     "vehicles" : self.rows(self.select(minLat, minLon, maxLat, maxLon, routes, limit), withIDs=True),
+                     "removed" : [] }
+
+        if self.rowOf is None :
+            self.rowOf = { vid : i for i, vid in enumerate(self.vehicleid.tolist()) }
+        mask = self.mask(minLat, minLon, maxLat, maxLon, routes)
+        current = []
+        removed = []
+        for vid in sorted(changed) :
+            i = self.rowOf.get(vid)
+            if i is not None and mask[i] :
+                current.append(i)
+            else :
+                removed.append(vid)
+        return { "token" : self.token, "full" : False,
+                 "vehicles" : self.rows(np.array(current, dtype=np.int64), withIDs=True),
+                 "removed" : removed }
+
+# Coordinates in the columnar format are whole numbers of 1/coordinateScale
+# degrees, which is about a metre - plenty to put a bus on a map.
+coordinateScale = 100000
+
+# Put vehicles in the compact columnar format, for clients on slow links.
+# Rather than a list with the keys repeated for every vehicle, there is
+# one list per column. The routes are dictionary encoded (routes is the
+# distinct routes, route is the index of each vehicle's route in it),
+# lat and lon are whole numbers of 1/scale degrees and the bearing is
+# rounded to the nearest degree. The arguments are the columns, as
+# numpy arrays or lists.
+def vehicleColumns(route, timestamp, current_status, lat, lon, bearing) :
+    route = np.asarray(route, dtype=object)
+    if len(route) > 0 :
+        routeNames, routeCodes = np.unique(route, return_inverse=True)
+    else :
+        routeNames, routeCodes = np.array([], dtype=object), np.array([], dtype=np.int64)
+    return { "scale"          : coordinateScale,
+             "routes"         : routeNames.tolist(),
+             "route"          : routeCodes.tolist(),
+             "timestamp"      : np.asarray(timestamp, dtype=np.int64).tolist(),
+             "current_status" : np.asarray(current_status, dtype=np.int64).tolist(),
+             "lat"            : np.rint(np.asarray(lat, dtype=np.float64) * coordinateScale).astype(np.int64).tolist(),
+             "lon"            : np.rint(np.asarray(lon, dtype=np.float64) * coordinateScale).astype(np.int64).tolist(),
+             "bearing"        : np.rint(np.asarray(bearing, dtype=np.float64)).astype(np.int64).tolist() }
+
+# Load the vehicles table into a vehicleSnapshot. The generation is read
+# before the rows, so if the ingest writes in between the rows may be newer
+# than the generation says, and all that happens is we load them again
+# next time we check.
+def loadVehicleSnapshot(engine, generation) :
+    with engine.connect() as conn :
+        columns = readVehicleColumns(conn)
+    return vehicleSnapshot(generation, columns, readUpdateTime(engine))
+
+# Make a vehicleSnapshot from the vehicle snapshot file the ingest published.
+def mapVehicleSnapshot(mapped) :
+    return vehicleSnapshot(mapped.generation, mapped.columns, mapped.updatetime)
+
+class routeCatalog :
+    """
+    The routes that have vehicles on them and how many, as the ingest
+    worked them out for one generation of the vehicles, along with the
+    JSON for them, which is made once here rather than for every request.
+    """
+
+    def __init__(self, generation, rows, updatetime=0) :
+        self.generation = generation
+        self.updatetime = updatetime
+        self.routes = [ { "route" : route, "vehicles" : vehicles } for route, vehicles in rows ]
+        self.json = to_json(self.routes)
+
+# Load the vehicle_routes table into a routeCatalog. Databases
+# made before there was one count the routes from the vehicles.
+def loadRouteCatalog(engine, generation) :
+    with engine.connect() as conn :
+        try :
+            rows = conn.execute(text("SELECT route, vehicles FROM vehicle_routes ORDER BY route")).fetchall()
+        except OperationalError :
+            rows = conn.execute(text("SELECT route, COUNT(*) FROM vehicles GROUP BY route ORDER BY route")).fetchall()
+    return routeCatalog(generation, rows, readUpdateTime(engine))
+
+# Make a routeCatalog from the vehicle snapshot file, which has the vehicle_routes table in it.
+def mapRouteCatalog(mapped) :
+    return routeCatalog(mapped.generation, zip(mapped.columns["catalogRoute"].tolist(),
+                                               mapped.columns["catalogVehicles"].tolist()), mapped.updatetime)
+
+class stopSnapshot :
+    """
+    The stops as they were at one generation, from the stop snapshot file
+    (see readStopColumns in databases/snapshotFile.py), in table order.
+    """
+
+    def __init__(self, generation, columns, updatetime=0) :
+        self.generation = generation
+        self.updatetime = updatetime
+        self.stopid   = columns["stopid"]
+        self.stopname = columns["stopname"]
+        self.stopdesc = columns["stopdesc"]
+        self.lat      = columns["lat"]
+        self.lon      = columns["lon"]
+        self.minzoom  = columns["minzoom"]
+
+    # Returns the indices of the stops inside the bounding box (any of which
+    # can be None for no limit), up to limit of them, as the bus stop end
+    # point's query does. If zoom is given, only the stops shown at that zoom,
+    # the ones shown from the lowest zoom level first.
+    def select(self, minLat=None, minLon=None, maxLat=None, maxLon=None, zoom=None, limit=1000) :
+        mask = inBox(self.lat, self.lon, minLat, minLon, maxLat, maxLon)
+        if zoom is None :
+            return np.flatnonzero(mask)[:limit]
+        mask &= self.minzoom <= zoom
+        indices = np.flatnonzero(mask)
+        return indices[np.argsort(self.minzoom[indices], kind='stable')][:limit]
+
+    # Returns the stops at the indices as a list of dictionaries
+    # with the keys that the bus stop end point serves out.
+    def rows(self, indices) :
+        return [ { "stopid" : stopid, "stopname" : stopname, "stopdesc" : stopdesc, "lat" : lat, "lon" : lon }
+                 for stopid, stopname, stopdesc, lat, lon in
+                 zip(self.stopid.take(indices), self.stopname.take(indices), self.stopdesc.take(indices),
+                     self.lat[indices].tolist(), self.lon[indices].tolist()) ]
+
+# Make a stopSnapshot from the stop snapshot file the ingest published.
+def mapStopSnapshot(mapped) :
+    return stopSnapshot(mapped.generation, mapped.columns, mapped.updatetime)
+
+class arrivalSnapshot :
+    """
+    The trip updates as they were at one generation, as the arrivals at
+    each stop, from the trip snapshot file (see readArrivalColumns in
+    databases/snapshotFile.py).
+    """
+
+    def __init__(self, generation, columns, updatetime=0) :
+        self.generation = generation
+        self.updatetime = updatetime
+        self.stopIDs       = columns["stopIDs"]
+        self.arrivalStarts = columns["arrivalStarts"]
+        self.routeNames    = np.array(columns["routeNames"].tolist(), dtype=object)
+        self.routeCodes    = columns["routeCodes"]
+        self.arrivaltime   = columns["arrivaltime"]
+
+    # Returns the arrivals at a stop, in time order, as a list of dictionaries
+    # with the keys the trip end point serves out. If since is given, only
+    # the arrivals from then on (unix time), and only up to limit of them.
+    def arrivals(self, stopID, since=None, limit=None) :
+        s = bisect.bisect_left(self.stopIDs, stopID)
+        if s == len(self.stopIDs) or self.stopIDs[s] != stopID :
+            return []
+        start, end = int(self.arrivalStarts[s]), int(self.arrivalStarts[s + 1])
+        if since is not None :
+            start += int(np.searchsorted(self.arrivaltime[start:end], since))
+        if limit is not None :
+            end = min(end, start + limit)
+        return [ { "route" : route, "arrivaltime" : arrivaltime }
+                 for route, arrivaltime in zip(self.routeNames[self.routeCodes[start:end]].tolist(),
+                                               self.arrivaltime[start:end].tolist()) ]
+
+# Make an arrivalSnapshot from the trip snapshot file the ingest published.
+def mapArrivalSnapshot(mapped) :
+    return arrivalSnapshot(mapped.generation, mapped.columns, mapped.updatetime)
+
+# Small function to get where the ingest publishes the snapshot
+# file for a database, which is next to the database file.
+def snapshotFileFor(db_file) :
+    return os.path.join(os.path.dirname(db_file), snapshotFileName)
+
+# Likewise for the stop tiles, which the stops update makes.
+def stopTileFileFor(db_file) :
+    return os.path.join(os.path.dirname(db_file), stopTileFileName)
+
+class stopTilePack :
+    """
+    The slippy map tiles of the stops that the stops update made (see
+    databases/stops/stopTiles.py), mapped from the tile file. The
+    version, which goes in the tile URLs, is the generation of the stops
+    and when they were published, so it changes every time they do.
+    """
+
+    def __init__(self, generation, columns, updatetime=0) :
+        self.generation = generation
+        self.updatetime = updatetime
+        self.version    = f"{generation}-{updatetime}"
+        self.minZoom    = int(columns["minZoom"][0])
+        self.maxZoom    = int(columns["maxZoom"][0])
+        self.tileKeys   = columns["tileKeys"]
+        self.tiles      = columns["tiles"]
+
+    # Returns the JSON of the tile at zoom, x, y (which is an
+    # empty list if there are no stops in it).
+    def tile(self, zoom, x, y) :
+        key = (zoom << 48) | (x << 24) | y
+        i = int(np.searchsorted(self.tileKeys, key))
+        if i == len(self.tileKeys) or self.tileKeys[i] != key :
+            return b"[]"
+        return self.tiles.data[self.tiles.offsets[i]:self.tiles.offsets[i + 1]].tobytes()
+
+# Make a stopTilePack from the tile file.
+def mapStopTilePack(mapped) :
+    return stopTilePack(mapped.generation, mapped.columns, mapped.updatetime)
+
+class snapshotCache :
+    """
+    Keeps the latest snapshot of a database, and reloads it
+    when the ingest publishes a new generation.
+
+    fresh() is cheap and can be called from the event loop. It returns
+    the snapshot if we looked at the generation recently, or None if it's time
+    to look again, in which case refresh() (which does database work, so
+    should be run in the database thread pool) checks and reloads if needed.
+
+    If mappedFile is given, it's the snapshot file the ingest publishes
+    for the database, and as long as it is there, the snapshot is made from
+    it with mappedLoader (given the mappedSnapshot) when it is replaced, and
+    the database isn't looked at. Until it's there, or if it goes away,
+    loader loads the snapshot from the database as usual.
+    """
+
+    def __init__(self, engine, loader, checkSec, mappedFile=None, mappedLoader=None) :
+        self.engine       = engine
+        self.loader       = loader
+        self.checkSec     = checkSec
+        self.mappedFile   = mappedFile
+        self.mappedLoader = mappedLoader
+        self.mappedID     = None
+        self.snapshot     = None
+        self.checkedAt    = 0.0
+        self.lock         = threading.Lock()
+
+    def fresh(self) :
+        if self.snapshot is not None and time.monotonic() - self.checkedAt < self.checkSec :
+            return self.snapshot
+        return None
+
+    def refresh(self) :
+        with self.lock :
+            # Someone else may have just done this while we waited on the lock.
+            snapshot = self.fresh()
+            if snapshot is not None :
+                return snapshot
+            identity = None
+            if self.mappedFile is not None :
+                identity = snapshotIdentity(self.mappedFile)
+            # Map the file if it's been replaced since we last did.
+            # The identity we keep is the one of the file we mapped,
+            # in case it was replaced again in between.
+            # If it went away since we looked (the ingest removes it when
+            # a publish fails) go to the database, as if it wasn't there.
+            if identity is not None and identity != self.mappedID :
+                try :
+                    mapped = mappedSnapshot(self.mappedFile)
+                except OSError :
+                    identity = None
+                else :
+                    self.snapshot = self.mappedLoader(mapped)
+                    self.mappedID = mapped.identity
+            if identity is None :
+                generation = readGeneration(self.engine)
+                if self.snapshot is None or self.mappedID is not None or self.snapshot.generation != generation :
+                    self.snapshot = self.loader(self.engine, generation)
+                    self.mappedID = None
+            self.checkedAt = time.monotonic()
+            return self.snapshot
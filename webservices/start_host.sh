@@ -0,0 +1,46 @@
+#!/bin/bash
+
+
+# Serve several agencies from one uvicorn (see bussinHost.py).
+
+# Needed to run under cron : If the file
+# $HOME/.local/bin/env exists then
+# source it so that uv will be found.
+if [ -f "$HOME/.local/bin/env" ]
+then
+ source "$HOME/.local/bin/env"
+fi
+
+pn=`basename $0`
+
+# Get the host, port and the agencies' environment files from the command line.
+if [ "$#" -lt 3 ]
+then
+ echo $pn : A host, a port and one or more environment files are required on the command line, eg
+ echo $pn 127.0.0.1 8002 /home/cdot/bussinFR/environment.vars /home/rtd/bussinFR/environment.vars
+ exit -1
+fi
+
+host="$1"
+port="$2"
+shift 2
+
+BFR_AGENCY_ENV_FILES=""
+for envFile in "$@"
+do
+ if [ ! -f "$envFile" ]
+ then
+  echo $pn : Environment file $envFile not found
+  exit -1
+ fi
+ BFR_AGENCY_ENV_FILES="$BFR_AGENCY_ENV_FILES:$envFile"
+done
+export BFR_AGENCY_ENV_FILES
+echo BFR_AGENCY_ENV_FILES=$BFR_AGENCY_ENV_FILES
+
+cd `dirname $0`
+
+uv run uvicorn bussinHost:hostApp --host "$host" --port "$port"
+
+exit 0
+